@@ -0,0 +1,5 @@
+import time
+
+# start of the import of the package, the hooks report how long loading
+# their entry point took
+IMPORT_START = time.perf_counter()
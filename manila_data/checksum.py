@@ -0,0 +1,224 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checksums used to verify copied data.
+
+manila hashes both the source and the destination of every copied file when
+check_hash is enabled. The copy engine hashes the source while copying it
+and records the digest in a cache, which the sha256sum shim answers from
+instead of reading the source a second time.
+
+Like the copy engine, this module only depends on the standard library.
+"""
+
+import dataclasses
+import hashlib
+import mmap
+import os
+import sqlite3
+import time
+import typing
+from pathlib import Path
+
+from . import rendered
+
+SECTION = "snap_verify"
+
+Mode = typing.Literal["off", "sampled", "full"]
+Algorithm = typing.Literal["sha256", "blake2b", "blake2s"]
+
+# Files below this size are always hashed with sha256 by coreutils, a new
+# interpreter costs more than hashing them. Keep in sync with the shims.
+LARGE_FILE_SIZE = 16 * 1024 * 1024
+# Size of the chunks fed to the hash function.
+CHUNK_SIZE = 64 * 1024 * 1024
+# Blocks read from each file in sampled mode.
+SAMPLE_BLOCKS = 16
+SAMPLE_BLOCK_SIZE = 1024 * 1024
+
+DIGEST_CACHE = Path("lib/manila/digests.sqlite")
+# Digests not claimed within this delay are dropped from the cache.
+DIGEST_CACHE_TTL = 24 * 60 * 60
+
+
+@dataclasses.dataclass(frozen=True)
+class VerifyOptions:
+    """Options of the data verification."""
+
+    mode: Mode = "off"
+    algorithm: Algorithm = "sha256"
+
+    @classmethod
+    def from_config(cls, path: Path) -> "VerifyOptions":
+        """Load the options rendered into the [snap_verify] section.
+
+        :param path: the rendered manila.conf
+        :type path: Path
+        :return: the verification options
+        :rtype: VerifyOptions
+        """
+        section = rendered.read_section(path, SECTION)
+        return cls(
+            mode=typing.cast(Mode, section.get("mode", cls.mode)),
+            algorithm=typing.cast(Algorithm, section.get("algorithm", cls.algorithm)),
+        )
+
+
+def file_digest(path: str, algorithm: str, chunk_size: int = CHUNK_SIZE) -> str:
+    """Hash the whole content of a file.
+
+    The file is memory mapped and fed to the hash function in large chunks,
+    avoiding the copy into an intermediate buffer.
+
+    :param path: the file to hash
+    :param algorithm: the hashlib algorithm
+    :param chunk_size: size of the chunks fed to the hash function
+    :return: the hex digest
+    :rtype: str
+    """
+    hasher = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hasher.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mm) as view:
+                for offset in range(0, len(mm), chunk_size):
+                    hasher.update(view[offset : offset + chunk_size])
+    return hasher.hexdigest()
+
+
+def sampled_digest(
+    path: str,
+    algorithm: str,
+    blocks: int = SAMPLE_BLOCKS,
+    block_size: int = SAMPLE_BLOCK_SIZE,
+) -> str:
+    """Hash the size and evenly spread blocks of a file.
+
+    The offsets only depend on the size, so a file and a faithful copy of it
+    always produce the same digest.
+
+    :param path: the file to hash
+    :param algorithm: the hashlib algorithm
+    :param blocks: number of blocks to read
+    :param block_size: size of each block
+    :return: the hex digest
+    :rtype: str
+    """
+    hasher = hashlib.new(algorithm)
+    with open(path, "rb", buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        hasher.update(size.to_bytes(8, "little"))
+        if size <= blocks * block_size:
+            offsets: typing.Iterable[int] = range(0, size, block_size)
+        else:
+            step = (size - block_size) // (blocks - 1)
+            offsets = (i * step for i in range(blocks))
+        for offset in offsets:
+            hasher.update(os.pread(f.fileno(), block_size, offset))
+    return hasher.hexdigest()
+
+
+def digest(
+    path: str, options: VerifyOptions, cache: "DigestCache | None" = None
+) -> str:
+    """Hash a file according to the verification options.
+
+    :param path: the file to hash
+    :param options: the verification options
+    :param cache: digests recorded while copying, used in full mode
+    :return: the hex digest
+    :rtype: str
+    """
+    if os.stat(path).st_size < LARGE_FILE_SIZE:
+        return file_digest(path, "sha256")
+    if options.mode == "sampled":
+        return sampled_digest(path, options.algorithm)
+    if cache is not None and (cached := cache.pop(path, options.algorithm)):
+        return cached
+    return file_digest(path, options.algorithm)
+
+
+class DigestCache:
+    """Digests of source files computed while copying them.
+
+    Entries are keyed by the file identity and last change time, a file
+    modified after its copy is simply not found. Entries are removed once
+    read, manila hashes each source file once after copying it.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS digests ("
+                " path TEXT, dev INTEGER, ino INTEGER, size INTEGER,"
+                " ctime INTEGER, algorithm TEXT, digest TEXT, created REAL,"
+                " PRIMARY KEY (path, algorithm))"
+            )
+            self._conn.execute(
+                "DELETE FROM digests WHERE created < ?",
+                (time.time() - DIGEST_CACHE_TTL,),
+            )
+        return self._conn
+
+    @staticmethod
+    def _key(path: str, st: os.stat_result) -> tuple[str, int, int, int, int]:
+        return (
+            os.path.abspath(path),
+            st.st_dev,
+            st.st_ino,
+            st.st_size,
+            st.st_ctime_ns,
+        )
+
+    def store(
+        self, path: str, st: os.stat_result, algorithm: str, hexdigest: str
+    ) -> None:
+        """Record the digest of a file.
+
+        :param path: the hashed file
+        :param st: stat of the file taken before reading it
+        :param algorithm: the hashlib algorithm
+        :param hexdigest: the digest
+        """
+        self.conn.execute(
+            "INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (*self._key(path, st), algorithm, hexdigest, time.time()),
+        )
+
+    def pop(self, path: str, algorithm: str) -> str | None:
+        """Return and forget the digest of a file, if still valid.
+
+        :param path: the file
+        :param algorithm: the hashlib algorithm
+        :return: the digest, None when unknown or outdated
+        :rtype: str or None
+        """
+        key = self._key(path, os.stat(path))
+        row = self.conn.execute(
+            "DELETE FROM digests WHERE path = ? AND algorithm = ?"
+            " RETURNING dev, ino, size, ctime, digest",
+            (key[0], algorithm),
+        ).fetchone()
+        if row is None or tuple(row[:4]) != key[1:]:
+            return None
+        return row[4]
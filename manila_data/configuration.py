@@ -18,9 +18,69 @@ This module holds the definition of all configuration options the snap
 takes as input from `snap set`.
 """
 
+import os
+import re
+import typing
+
 import pydantic
 import pydantic.alias_generators
 
+from . import resources
+
+# Bounds for the automatically sized database connection pool.
+AUTO_POOL_SIZE_MIN = 5
+AUTO_POOL_SIZE_MAX = 64
+
+
+# Defaults set by each settings.profile, as snap options. Options set with
+# snap set take precedence over them.
+PROFILES: dict[str, dict[str, dict[str, typing.Any]]] = {
+    "default": {},
+    # large sequential copies, on nodes dedicated to data migrations
+    "throughput": {
+        "data-copy": {"engine": "parallel"},
+        "database": {"expected-copies": 8, "max-overflow": 100},
+        "messaging": {
+            "executor-thread-pool-size": 128,
+            "rpc-conn-pool-size": 60,
+            "qos-prefetch-count": 128,
+        },
+        "nfs": {"nconnect": 8, "rsize": "1MiB", "wsize": "1MiB"},
+        "cephfs": {"rasize": "64MiB", "client-readahead-max-bytes": "64MiB"},
+    },
+    # quick answers to the RPC requests, copies leave the handlers room
+    "low-latency": {
+        "database": {"expected-copies": 2, "pool-timeout": 10},
+        "messaging": {
+            "qos-prefetch-count": 1,
+            "rpc-response-timeout": 60,
+            "conn-pool-min-size": 10,
+        },
+    },
+    # small nodes, fewer processes, threads, connections and caches
+    "low-memory": {
+        "settings": {"workers": 1},
+        "data-copy": {"workers": 2},
+        "database": {"max-pool-size": 5, "max-overflow": 10},
+        "messaging": {
+            "executor-thread-pool-size": 16,
+            "rpc-conn-pool-size": 10,
+            "qos-prefetch-count": 16,
+        },
+        "cephfs": {
+            "client-oc-size": "32MiB",
+            "client-readahead-max-bytes": "4MiB",
+        },
+    },
+}
+
+# Locations a strictly confined daemon can write to: the snap data
+# directories, and /mnt and /media with the removable-media interface.
+SCRATCH_LOCATIONS = ("/var/snap/", "/mnt/", "/media/", "/run/media/")
+
+# options holding credentials, masked when dumped
+SECRET_OPTIONS = ("database.url", "database.slave-connection", "rabbitmq.url")
+
 
 def to_kebab(value: str) -> str:
     return pydantic.alias_generators.to_snake(value).replace("_", "-")
@@ -37,22 +97,292 @@ class ParentConfig(pydantic.BaseModel):
     )
 
 
+def apply_profile(raw: typing.Mapping[str, typing.Any]) -> dict[str, typing.Any]:
+    """Fill the snap options with the defaults of the selected profile.
+
+    :param raw: the snap options, as returned by snapctl
+    :type raw: Mapping
+    :return: the snap options, completed by the profile
+    :rtype: dict
+    """
+    settings = raw.get("settings")
+    profile = settings.get("profile") if isinstance(settings, dict) else None
+    # an unknown profile is rejected when validating the settings
+    defaults = PROFILES.get(profile or "default", {})
+    options = dict(raw)
+    for namespace, values in defaults.items():
+        current = options.get(namespace) or {}
+        if isinstance(current, dict):
+            options[namespace] = {**values, **current}
+    return options
+
+
+def _mask(value: str) -> str:
+    """Hide the passwords of the URLs of a connection string."""
+    return re.sub(r"(//|,)([^:/@,]*):[^@/]*@", r"\1\2:***@", value)
+
+
+def effective_options(
+    config: "Configuration", raw: typing.Mapping[str, typing.Any]
+) -> dict[str, dict[str, typing.Any]]:
+    """Values applied for every option, and where they come from.
+
+    :param config: the validated configuration
+    :type config: Configuration
+    :param raw: the snap options, as returned by snapctl
+    :type raw: Mapping
+    :return: value and source (snap set, profile or default) by option
+    :rtype: dict
+    """
+    defaults = PROFILES.get(config.settings.profile, {})
+    options = {}
+    for name in type(config).model_fields:
+        namespace = to_kebab(name)
+        section = getattr(config, name)
+        values = section.model_dump(mode="json")
+        for field in type(section).model_fields:
+            key = to_kebab(field)
+            if key in (raw.get(namespace) or {}):
+                source = "snap set"
+            elif key in defaults.get(namespace, {}):
+                source = "profile"
+            else:
+                source = "default"
+            value = values[field]
+            if f"{namespace}.{key}" in SECRET_OPTIONS and isinstance(value, str):
+                value = _mask(value)
+            options[f"{namespace}.{key}"] = {"value": value, "source": source}
+    return options
+
+
+def cpu_count() -> int:
+    """Number of CPUs usable by this process."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def auto_pool_size(expected_copies: int) -> int:
+    """Derive a database pool size from the expected number of copies.
+
+    Every running copy job periodically reports its progress to the database,
+    on top of the connections used by the RPC handlers, which scale with the
+    number of usable CPUs.
+    """
+    size = expected_copies + cpu_count()
+    return max(AUTO_POOL_SIZE_MIN, min(size, AUTO_POOL_SIZE_MAX))
+
+
 class DatabaseConfiguration(ParentConfig):
     url: str
+    slave_connection: str | None = None
+    max_pool_size: pydantic.PositiveInt | typing.Literal["auto"] = "auto"
+    # copy jobs expected to run at the same time, only sizes the auto pool
+    expected_copies: pydantic.PositiveInt = 4
+    max_overflow: pydantic.NonNegativeInt = 50
+    pool_timeout: pydantic.PositiveInt = 30
+    connection_recycle_time: pydantic.PositiveInt = 20
+
+    @pydantic.model_validator(mode="after")
+    def _resolve_pool_size(self) -> "DatabaseConfiguration":
+        if self.max_pool_size == "auto":
+            self.max_pool_size = auto_pool_size(self.expected_copies)
+        return self
 
 
 class RabbitMQConfiguration(ParentConfig):
     url: str
 
 
+class MessagingConfiguration(ParentConfig):
+    """oslo.messaging tuning, defaults sized for busy data nodes."""
+
+    executor_thread_pool_size: pydantic.PositiveInt = 64
+    rpc_response_timeout: pydantic.PositiveInt = 120
+    rpc_conn_pool_size: pydantic.PositiveInt = 30
+    conn_pool_min_size: pydantic.PositiveInt = 2
+    conn_pool_ttl: pydantic.PositiveInt = 1200
+    qos_prefetch_count: pydantic.NonNegativeInt = 64
+    heartbeat_timeout_threshold: pydantic.NonNegativeInt = 60
+    heartbeat_rate: pydantic.PositiveInt = 3
+    quorum_delivery_limit: pydantic.NonNegativeInt = 5
+
+    @pydantic.model_validator(mode="after")
+    def _check_pool_sizes(self) -> "MessagingConfiguration":
+        if self.conn_pool_min_size > self.rpc_conn_pool_size:
+            raise ValueError("conn-pool-min-size exceeds rpc-conn-pool-size")
+        return self
+
+
+def _split_options(options: str | None) -> list[str]:
+    return [o.strip() for o in (options or "").split(",") if o.strip()]
+
+
+class NFSMountConfiguration(ParentConfig):
+    """Options of the NFS mounts of the shares being copied."""
+
+    version: typing.Literal["3", "4", "4.0", "4.1", "4.2"] | None = None
+    nconnect: typing.Annotated[int, pydantic.Field(ge=1, le=16)] | None = None
+    rsize: pydantic.ByteSize | None = None
+    wsize: pydantic.ByteSize | None = None
+    async_writes: bool | None = None
+    # extra comma separated mount options
+    options: str | None = None
+
+    @pydantic.field_validator("version", mode="before")
+    @classmethod
+    def _version_string(cls, value: typing.Any) -> typing.Any:
+        # snapctl returns nfs.version=3 or 4.1 as JSON numbers
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+        return value
+
+    @pydantic.computed_field  # type: ignore[prop-decorator]
+    @property
+    def mount_options(self) -> list[str]:
+        options = []
+        if self.version:
+            options.append(f"vers={self.version}")
+        if self.nconnect:
+            options.append(f"nconnect={self.nconnect}")
+        if self.rsize:
+            options.append(f"rsize={self.rsize}")
+        if self.wsize:
+            options.append(f"wsize={self.wsize}")
+        if self.async_writes is not None:
+            options.append("async" if self.async_writes else "sync")
+        return options + _split_options(self.options)
+
+
+class CephFSMountConfiguration(ParentConfig):
+    """Options of the CephFS mounts and of the Ceph client."""
+
+    rsize: pydantic.ByteSize | None = None
+    wsize: pydantic.ByteSize | None = None
+    # kernel client readahead
+    rasize: pydantic.ByteSize | None = None
+    # extra comma separated mount options
+    options: str | None = None
+    # userspace client object cacher and readahead, set in ceph.conf
+    client_oc: bool = True
+    client_oc_size: pydantic.ByteSize | None = None
+    client_readahead_max_bytes: pydantic.ByteSize | None = None
+
+    @pydantic.computed_field  # type: ignore[prop-decorator]
+    @property
+    def mount_options(self) -> list[str]:
+        options = [
+            f"{name}={value}"
+            for name, value in (
+                ("rsize", self.rsize),
+                ("wsize", self.wsize),
+                ("rasize", self.rasize),
+            )
+            if value
+        ]
+        return options + _split_options(self.options)
+
+
+class DataCopyConfiguration(ParentConfig):
+    engine: typing.Literal["cp", "parallel"] = "cp"
+    workers: pydantic.PositiveInt | typing.Literal["auto"] = "auto"
+    # where shares are mounted and locks are taken, such as a tmpfs
+    scratch_path: str | None = None
+    # bytes per second, for all the copies of the node and for each copy
+    bandwidth_limit: pydantic.ByteSize | None = None
+    job_bandwidth_limit: pydantic.ByteSize | None = None
+
+    @pydantic.field_validator("scratch_path")
+    @classmethod
+    def _check_scratch_path(cls, value: str | None) -> str | None:
+        if value is None:
+            return None
+        if not os.path.isabs(value):
+            raise ValueError("scratch-path must be an absolute path")
+        path = os.path.normpath(value)
+        if not any((path + "/").startswith(p) for p in SCRATCH_LOCATIONS):
+            locations = ", ".join(SCRATCH_LOCATIONS)
+            raise ValueError(f"scratch-path must be under one of {locations}")
+        return path
+
+    @pydantic.model_validator(mode="after")
+    def _resolve_workers(self) -> "DataCopyConfiguration":
+        if self.workers == "auto":
+            self.workers = cpu_count()
+        return self
+
+    @pydantic.model_validator(mode="after")
+    def _check_bandwidth_limits(self) -> "DataCopyConfiguration":
+        limited = self.bandwidth_limit or self.job_bandwidth_limit
+        if limited and self.engine != "parallel":
+            raise ValueError("bandwidth limits require the parallel engine")
+        return self
+
+
+class VerifyConfiguration(ParentConfig):
+    mode: typing.Literal["off", "sampled", "full"] = "off"
+    algorithm: typing.Literal["sha256", "blake2b", "blake2s"] = "sha256"
+
+
+class ResourcesConfiguration(ParentConfig):
+    cpuset: str | None = None
+    pin_workers: bool = False
+    nice: typing.Annotated[int, pydantic.Field(ge=-20, le=19)] = 0
+    ioprio_class: typing.Literal["none", "realtime", "best-effort", "idle"] = "none"
+    ioprio_level: typing.Annotated[int, pydantic.Field(ge=0, le=7)] = 4
+
+    @pydantic.field_validator("cpuset")
+    @classmethod
+    def _check_cpuset(cls, value: str | None) -> str | None:
+        if value is not None:
+            resources.parse_cpuset(value)
+        return value
+
+
+class MetricsConfiguration(ParentConfig):
+    enabled: bool = False
+    port: typing.Annotated[int, pydantic.Field(ge=1024, le=65535)] = 9469
+
+
 class Settings(ParentConfig):
+    profile: typing.Literal["default", "throughput", "low-latency", "low-memory"] = (
+        "default"
+    )
     debug: bool = False
     enable_telemetry_notifications: bool = False
+    workers: pydantic.PositiveInt = 1
+    launch: typing.Literal["auto", "exec", "supervise"] = "auto"
+    drain_timeout: typing.Annotated[int, pydantic.Field(ge=1, le=600)] = 30
+    rootwrap: typing.Literal["rootwrap", "direct"] = "rootwrap"
+    restart: typing.Literal["immediate", "deferred"] = "immediate"
+    restart_deadline: typing.Annotated[int, pydantic.Field(ge=60, le=86400)] = 3600
+    copy_mode: typing.Literal["full", "delta", "checksum"] = "full"
 
 
 class Configuration(ParentConfig):
     """Configuration class."""
 
     settings: Settings = Settings()
+    data_copy: DataCopyConfiguration = DataCopyConfiguration()
+    verify: VerifyConfiguration = VerifyConfiguration()
+    resources: ResourcesConfiguration = ResourcesConfiguration()
+    metrics: MetricsConfiguration = MetricsConfiguration()
+    messaging: MessagingConfiguration = MessagingConfiguration()
+    nfs: NFSMountConfiguration = NFSMountConfiguration()
+    cephfs: CephFSMountConfiguration = CephFSMountConfiguration()
     database: DatabaseConfiguration
     rabbitmq: RabbitMQConfiguration
+
+    @pydantic.model_validator(mode="before")
+    @classmethod
+    def _apply_profile(cls, data: typing.Any) -> typing.Any:
+        if isinstance(data, dict):
+            return apply_profile(data)
+        return data
+
+    @pydantic.model_validator(mode="after")
+    def _check_copy_mode(self) -> "Configuration":
+        if self.settings.copy_mode != "full" and self.data_copy.engine != "parallel":
+            raise ValueError("delta copies require the parallel engine")
+        return self
@@ -14,6 +14,7 @@
 
 import abc
 import pathlib
+import socket
 import typing
 
 from snaphelpers import Snap
@@ -48,3 +49,29 @@ class SnapPathContext(Context):
         return {
             name: getattr(self.snap.paths, name) for name in self.snap.paths.__slots__
         }
+
+
+class SnapInstanceContext(Context):
+    """Identity of the snap instance, for parallel installs.
+
+    Parallel installs are named <snap>_<key>, such as manila-data_a. Each of
+    them registers with its own host, the host name suffixed with the key,
+    and keeps its own scratch directories.
+    """
+
+    namespace = "snap_instance"
+
+    def __init__(self, snap: Snap):
+        self.snap = snap
+
+    def context(self) -> typing.Mapping[str, typing.Any]:
+        name = self.snap.instance_name
+        key = name.partition("_")[2]
+        hostname = socket.gethostname()
+        return {
+            "name": name,
+            "key": key,
+            # manila's host is an opaque service identifier, not a DNS
+            # name, the underscore of the instance name is kept
+            "host": f"{hostname}_{key}" if key else hostname,
+        }
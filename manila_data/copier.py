@@ -0,0 +1,798 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Parallel copy engine used for host-assisted share migration.
+
+The engine walks a source tree and spreads the copies across a pool of
+worker processes. Small files are grouped in batches to amortise the cost of
+dispatching work to the pool, large files are streamed in big chunks.
+
+manila copies a share one file at a time, running cp for each of them. When
+the engine is handed a single file, the workers are threads copying the
+chunks of the file at once instead.
+
+This module is executed for every copy handed over by the cp shim, it must
+only depend on the standard library to keep its start up time low.
+"""
+
+import concurrent.futures
+import dataclasses
+import errno
+import hashlib
+import mmap
+import os
+import stat
+import threading
+import typing
+from pathlib import Path
+
+from . import checksum, delta, error, journal, progress, rendered, throttle
+
+SECTION = "snap_copy"
+
+# Files up to this size are copied in batches.
+SMALL_FILE_SIZE = 1024 * 1024
+# Flush a batch of small files when reaching any of these limits.
+BATCH_FILES = 256
+BATCH_SIZE = 32 * 1024 * 1024
+# Size of the chunks large files are streamed with.
+CHUNK_SIZE = 64 * 1024 * 1024
+# Number of batches queued per worker before the walk waits for the pool.
+QUEUE_DEPTH = 4
+
+# copy_file_range(2) is not available across all filesystem combinations,
+# the copy falls back to plain reads and writes on these errors.
+_FALLBACK_ERRNOS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP)
+
+
+class CopyError(error.ManilaError):
+    """Raised when the copy of a file or tree fails."""
+
+
+@dataclasses.dataclass(frozen=True)
+class CopyOptions:
+    """Tunables of the copy engine."""
+
+    workers: int = 1
+    # threads copying the chunks of a single large file, set by Copier.copy
+    range_workers: int = 1
+    preserve: bool = True
+    small_file_size: int = SMALL_FILE_SIZE
+    chunk_size: int = CHUNK_SIZE
+    verify: checksum.VerifyOptions = checksum.VerifyOptions()
+    # where source digests computed while copying are recorded
+    digest_cache: Path | None = None
+    # where the progress of the copies is recorded
+    progress_dir: Path | None = None
+    # where the bandwidth limits are read and the token buckets kept
+    bandwidth: throttle.ThrottleOptions | None = None
+    # where the journals of the copies are kept
+    journal_dir: Path | None = None
+    # journal of the copy in progress, set by Copier.copy
+    journal: Path | None = None
+    # whether files unchanged since they were copied are skipped
+    mode: delta.Mode = "full"
+    # where the indexes of the destination shares are kept
+    index_dir: Path | None = None
+    # index of the destination of the copy in progress, set by Copier.copy
+    index: Path | None = None
+    # where manila mounts the shares it copies
+    mounts_dir: Path | None = None
+
+    @classmethod
+    def from_config(cls, path: Path, **overrides: typing.Any) -> "CopyOptions":
+        """Load the options rendered into manila.conf.
+
+        :param path: the rendered manila.conf
+        :type path: Path
+        :param overrides: options taking precedence over the rendered ones
+        :return: the copy options
+        :rtype: CopyOptions
+        """
+        section = rendered.read_section(path, SECTION)
+        mounts_dir = rendered.read_section(path, "DEFAULT").get("mount_tmp_location")
+        options = {
+            "workers": int(section.get("workers", cls.workers)),
+            "mode": typing.cast(delta.Mode, section.get("mode", cls.mode)),
+            "verify": checksum.VerifyOptions.from_config(path),
+            "mounts_dir": Path(mounts_dir) if mounts_dir else None,
+        }
+        return cls(**{**options, **overrides})
+
+    def share_roots(self, src: Path, dest: Path) -> tuple[Path, Path]:
+        """Source and destination the state of a copy is kept for.
+
+        manila mounts the shares under mounts_dir and copies them one file
+        at a time, the copies of these files are keyed on the shares they
+        belong to. Other copies are keyed on their own paths.
+
+        :param src: the source of the copy
+        :type src: Path
+        :param dest: the destination of the copy
+        :type dest: Path
+        :rtype: tuple[Path, Path]
+        """
+        if self.mounts_dir is None:
+            return src, dest
+        roots = []
+        for path in (src, dest):
+            try:
+                relative = Path(os.path.abspath(path)).relative_to(self.mounts_dir)
+            except ValueError:
+                return src, dest
+            if not relative.parts:
+                return src, dest
+            roots.append(self.mounts_dir / relative.parts[0])
+        return roots[0], roots[1]
+
+    def hash_on_copy(self, size: int) -> bool:
+        """Whether the source digest is computed while copying."""
+        return self.verify.mode == "full" and size >= checksum.LARGE_FILE_SIZE
+
+
+@dataclasses.dataclass
+class CopyStats:
+    """Counters of a copy operation."""
+
+    files: int = 0
+    size: int = 0
+
+    def add(self, other: "CopyStats") -> None:
+        self.files += other.files
+        self.size += other.size
+
+
+def _write_all(fd: int, data: memoryview) -> None:
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+# called with the size of every chunk copied
+ChunkHook = typing.Callable[[int], None]
+
+
+def _stream(
+    src_fd: int,
+    dest_fd: int,
+    chunk_size: int,
+    on_chunk: ChunkHook | None = None,
+) -> int:
+    """Copy src_fd into dest_fd from their offsets, returns the bytes copied."""
+    copied = 0
+    try:
+        while n := os.copy_file_range(src_fd, dest_fd, chunk_size):
+            copied += n
+            if on_chunk is not None:
+                on_chunk(n)
+        return copied
+    except OSError as e:
+        if copied or e.errno not in _FALLBACK_ERRNOS:
+            raise
+
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    while n := os.readv(src_fd, [buf]):
+        _write_all(dest_fd, view[:n])
+        copied += n
+        if on_chunk is not None:
+            on_chunk(n)
+    return copied
+
+
+def _copy_range(src_fd: int, dest_fd: int, offset: int, length: int) -> int:
+    """Copy a range of src_fd at the same offset of dest_fd.
+
+    The offsets of the file descriptors are left alone, ranges can be copied
+    by several threads at once. Returns the bytes copied, fewer than length
+    when the source is shorter.
+    """
+    end = offset + length
+    start = offset
+    try:
+        while offset < end:
+            n = os.copy_file_range(src_fd, dest_fd, end - offset, offset, offset)
+            if not n:
+                return offset - start
+            offset += n
+        return length
+    except OSError as e:
+        if e.errno not in _FALLBACK_ERRNOS:
+            raise
+
+    while offset < end:
+        data = os.pread(src_fd, end - offset, offset)
+        if not data:
+            break
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(dest_fd, view, offset)
+            view = view[written:]
+            offset += written
+    return offset - start
+
+
+def _stream_ranges(
+    src_fd: int,
+    dest_fd: int,
+    start: int,
+    size: int,
+    chunk_size: int,
+    workers: int,
+    on_chunk: ChunkHook | None = None,
+) -> int:
+    """Copy src_fd into dest_fd from start with several threads.
+
+    Each thread copies whole chunks, on_chunk is called as the data copied
+    without gaps from start grows. Data appended to the source past size is
+    streamed once the chunks are done. Returns the bytes copied.
+    """
+    chunks: typing.Iterator[int] = iter(range(start, size, chunk_size))
+    lock = threading.Lock()
+    done: set[int] = set()
+    position = start
+    copied = 0
+
+    def run() -> None:
+        nonlocal chunks, position, copied
+        while True:
+            with lock:
+                offset = next(chunks, None)
+            if offset is None:
+                return
+            try:
+                length = min(chunk_size, size - offset)
+                n = _copy_range(src_fd, dest_fd, offset, length)
+            except BaseException:
+                with lock:
+                    # the other threads stop after their current chunk
+                    chunks = iter(())
+                raise
+            with lock:
+                copied += n
+                done.add(offset)
+                contiguous = position
+                while position in done:
+                    done.remove(position)
+                    position = min(position + chunk_size, size)
+                if on_chunk is not None and position > contiguous:
+                    on_chunk(position - contiguous)
+
+    count = min(workers, -(-(size - start) // chunk_size))
+    with concurrent.futures.ThreadPoolExecutor(count) as pool:
+        futures = [pool.submit(run) for _ in range(count)]
+    for future in futures:
+        future.result()
+    os.lseek(src_fd, size, os.SEEK_SET)
+    os.lseek(dest_fd, size, os.SEEK_SET)
+    return copied + _stream(src_fd, dest_fd, chunk_size, on_chunk)
+
+
+def _stream_hashed(
+    src_fd: int,
+    dest_fd: int,
+    chunk_size: int,
+    hasher: "hashlib._Hash",
+    start: int = 0,
+    on_chunk: ChunkHook | None = None,
+) -> int:
+    """Copy src_fd into dest_fd from start, hashing the whole source."""
+    size = os.fstat(src_fd).st_size
+    if not size:
+        return 0
+    with mmap.mmap(src_fd, size, access=mmap.ACCESS_READ) as mm:
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+        with memoryview(mm) as view:
+            for offset in range(0, size, chunk_size):
+                with view[offset : offset + chunk_size] as chunk:
+                    hasher.update(chunk)
+                    # the start of a resumed file is only hashed
+                    if offset + len(chunk) <= start:
+                        continue
+                    with chunk[max(start - offset, 0) :] as rest:
+                        _write_all(dest_fd, rest)
+                        if on_chunk is not None:
+                            on_chunk(len(rest))
+    return size - start
+
+
+_digest_caches: dict[Path, checksum.DigestCache] = {}
+
+
+def _digest_cache(path: Path) -> checksum.DigestCache:
+    """Digest cache shared by all the copies of this process."""
+    if path not in _digest_caches:
+        _digest_caches[path] = checksum.DigestCache(path)
+    return _digest_caches[path]
+
+
+_throttles: dict[throttle.ThrottleOptions, throttle.Throttle] = {}
+
+
+def _throttle(options: throttle.ThrottleOptions) -> throttle.Throttle:
+    """Throttle shared by all the copies of a job in this process."""
+    if options not in _throttles:
+        _throttles[options] = throttle.Throttle(options)
+    return _throttles[options]
+
+
+_journals: dict[Path, journal.Journal] = {}
+
+
+def _journal(path: Path) -> journal.Journal:
+    """Journal of a copy, shared by all the files this process copies."""
+    if path not in _journals:
+        _journals[path] = journal.Journal(path)
+    return _journals[path]
+
+
+def _close_journal(path: Path) -> None:
+    """Close the journal of a copy, if this process opened it."""
+    if path in _journals:
+        _journals.pop(path).close()
+
+
+_indexes: dict[Path, delta.Index] = {}
+
+
+def _index(path: Path) -> delta.Index:
+    """Index of a destination share, shared by the copies of this process."""
+    if path not in _indexes:
+        _indexes[path] = delta.Index(path)
+    return _indexes[path]
+
+
+def _unchanged(
+    src: str, dest: str, src_stat: os.stat_result, options: CopyOptions
+) -> bool:
+    """Whether a file is unchanged since it was copied into the destination."""
+    if options.index is None:
+        return False
+    record = _index(options.index).lookup(dest)
+    if record is None:
+        return False
+    try:
+        dest_stat = os.lstat(dest)
+    except FileNotFoundError:
+        return False
+    if not record.matches(src_stat, dest_stat):
+        return False
+    if options.mode == "checksum":
+        if record.algorithm is None or record.digest is None:
+            return False
+        return checksum.file_digest(src, record.algorithm) == record.digest
+    return True
+
+
+def _chunk_hook(
+    src: str,
+    src_stat: os.stat_result,
+    dest_fd: int,
+    start: int,
+    options: CopyOptions,
+    limiter: throttle.Throttle | None,
+) -> ChunkHook | None:
+    """Throttle the copy of a file and record its checkpoints."""
+    if limiter is None and (
+        options.journal is None or src_stat.st_size <= journal.CHECKPOINT_SIZE
+    ):
+        return None
+    position = start
+    checkpoint = start + journal.CHECKPOINT_SIZE
+
+    def on_chunk(n: int) -> None:
+        nonlocal position, checkpoint
+        if limiter is not None:
+            limiter.consume(n)
+        position += n
+        if options.journal is not None and position >= checkpoint:
+            # the offset must not get ahead of the data
+            os.fdatasync(dest_fd)
+            _journal(options.journal).record([(src, src_stat, position, False)])
+            checkpoint = position + journal.CHECKPOINT_SIZE
+
+    return on_chunk
+
+
+def copy_metadata(src: str, dest: str, src_stat: os.stat_result) -> None:
+    """Copy ownership, mode, extended attributes and timestamps.
+
+    :param src: the source path
+    :param dest: the destination path
+    :param src_stat: result of lstat on the source
+    """
+    is_link = stat.S_ISLNK(src_stat.st_mode)
+    # ownership first, chown clears the setuid and setgid bits
+    os.chown(dest, src_stat.st_uid, src_stat.st_gid, follow_symlinks=False)
+    if not is_link:
+        os.chmod(dest, stat.S_IMODE(src_stat.st_mode))
+        try:
+            for name in os.listxattr(src, follow_symlinks=False):
+                value = os.getxattr(src, name, follow_symlinks=False)
+                os.setxattr(dest, name, value, follow_symlinks=False)
+        except OSError as e:
+            if e.errno not in (errno.ENOTSUP, errno.EPERM):
+                raise
+    os.utime(
+        dest,
+        ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns),
+        follow_symlinks=False,
+    )
+
+
+def copy_file(src: str, dest: str, options: CopyOptions, start: int = 0) -> CopyStats:
+    """Copy a single file, symlink or special file.
+
+    :param src: the source path
+    :param dest: the destination path
+    :param options: the copy options
+    :param start: bytes already copied into the destination, which are kept
+    :return: the copy counters
+    :rtype: CopyStats
+    """
+    return _copy_file(src, dest, options, start)[0]
+
+
+def _copy_file(
+    src: str, dest: str, options: CopyOptions, start: int = 0
+) -> tuple[CopyStats, os.stat_result, delta.Record | None]:
+    """Copy a file, also returning its index record in delta mode."""
+    src_stat = os.lstat(src)
+    size = 0
+    digest = None
+    if (
+        stat.S_ISREG(src_stat.st_mode)
+        and not start
+        and _unchanged(src, dest, src_stat, options)
+    ):
+        if options.preserve:
+            # ownership and mode changes leave the modification time alone
+            copy_metadata(src, dest, src_stat)
+        return CopyStats(files=1, size=src_stat.st_size), src_stat, None
+    if stat.S_ISLNK(src_stat.st_mode):
+        if os.path.lexists(dest):
+            os.unlink(dest)
+        os.symlink(os.readlink(src), dest)
+    elif stat.S_ISREG(src_stat.st_mode):
+        # without preserve, new files get the source mode minus the umask
+        mode = 0o600 if options.preserve else stat.S_IMODE(src_stat.st_mode)
+        limiter = None
+        chunk_size = options.chunk_size
+        if options.bandwidth is not None:
+            limiter = _throttle(options.bandwidth)
+            chunk_size = limiter.chunk_size(chunk_size)
+        src_fd = os.open(src, os.O_RDONLY)
+        try:
+            flags = os.O_WRONLY | os.O_CREAT | (0 if start else os.O_TRUNC)
+            dest_fd = os.open(dest, flags, mode)
+            try:
+                if start:
+                    os.ftruncate(dest_fd, start)
+                    os.lseek(src_fd, start, os.SEEK_SET)
+                    os.lseek(dest_fd, start, os.SEEK_SET)
+                on_chunk = _chunk_hook(src, src_stat, dest_fd, start, options, limiter)
+                cache = bool(options.digest_cache) and options.hash_on_copy(
+                    src_stat.st_size
+                )
+                indexed = options.index is not None and options.mode == "checksum"
+                if cache or indexed:
+                    hasher = hashlib.new(options.verify.algorithm)
+                    size = start + _stream_hashed(
+                        src_fd, dest_fd, chunk_size, hasher, start, on_chunk
+                    )
+                    digest = hasher.hexdigest()
+                    if options.digest_cache and cache:
+                        _digest_cache(options.digest_cache).store(
+                            src, src_stat, options.verify.algorithm, digest
+                        )
+                elif (
+                    options.range_workers > 1 and src_stat.st_size - start > chunk_size
+                ):
+                    size = start + _stream_ranges(
+                        src_fd,
+                        dest_fd,
+                        start,
+                        src_stat.st_size,
+                        chunk_size,
+                        options.range_workers,
+                        on_chunk,
+                    )
+                else:
+                    size = start + _stream(src_fd, dest_fd, chunk_size, on_chunk)
+            finally:
+                os.close(dest_fd)
+        finally:
+            os.close(src_fd)
+    else:
+        os.mknod(dest, src_stat.st_mode, src_stat.st_rdev)
+
+    if options.preserve:
+        copy_metadata(src, dest, src_stat)
+    record = None
+    if options.index is not None and stat.S_ISREG(src_stat.st_mode):
+        dest_stat = os.lstat(dest)
+        record = delta.Record(
+            src_size=src_stat.st_size,
+            src_mtime_ns=src_stat.st_mtime_ns,
+            dest_size=dest_stat.st_size,
+            dest_mtime_ns=dest_stat.st_mtime_ns,
+            algorithm=options.verify.algorithm if digest else None,
+            digest=digest,
+        )
+    return CopyStats(files=1, size=size), src_stat, record
+
+
+def _copy_batch(
+    batch: typing.Sequence[tuple[str, str, int]], options: CopyOptions
+) -> CopyStats:
+    stats = CopyStats()
+    done = []
+    records = []
+    try:
+        for src, dest, start in batch:
+            try:
+                file_stats, src_stat, record = _copy_file(src, dest, options, start)
+            except OSError as e:
+                raise CopyError(f"cannot copy '{src}' to '{dest}': {e}") from e
+            stats.add(file_stats)
+            done.append((src, src_stat, file_stats.size, True))
+            if record is not None:
+                records.append((dest, record))
+    finally:
+        if options.journal is not None:
+            _journal(options.journal).record(done)
+        if options.index is not None:
+            _index(options.index).record(records)
+    return stats
+
+
+def _resume_from(
+    dest: str, src_stat: os.stat_result, entry: journal.Entry | None
+) -> int | None:
+    """Offset the copy of a file resumes from, None when it is finished."""
+    if entry is None or not entry.matches(src_stat):
+        return 0
+    try:
+        dest_size = os.lstat(dest).st_size
+    except FileNotFoundError:
+        return 0
+    if entry.done:
+        # a destination truncated or rewritten since is copied again
+        return None if dest_size == entry.size else 0
+    return entry.offset if dest_size >= entry.offset else 0
+
+
+def _skipped(src_stat: os.stat_result) -> CopyStats:
+    """Counters of a file copied by a previous run of the copy."""
+    size = src_stat.st_size if stat.S_ISREG(src_stat.st_mode) else 0
+    return CopyStats(files=1, size=size)
+
+
+class Copier:
+    """Copy trees with a pool of worker processes."""
+
+    def __init__(self, options: CopyOptions):
+        self.options = options
+
+    def copy(self, src: Path, dest: Path) -> CopyStats:
+        """Copy a file or a tree.
+
+        :param src: the file or directory to copy
+        :type src: Path
+        :param dest: the destination, created if it does not exist
+        :type dest: Path
+        :return: the copy counters
+        :rtype: CopyStats
+        """
+        options = self.options
+        roots = options.share_roots(src, dest)
+        if options.bandwidth is not None:
+            # the files of a share copied one at a time share their bucket
+            key = None
+            if roots != (src, dest):
+                key = f"{roots[0]}\0{roots[1]}"
+            job = throttle.new_job(options.bandwidth, key)
+            options = dataclasses.replace(options, bandwidth=job)
+        tree = src.is_dir() and not src.is_symlink()
+        resume: dict[str, journal.Entry] = {}
+        entry = None
+        if options.journal_dir is not None:
+            options.journal_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+            journal.expire(options.journal_dir)
+            path = journal.journal_path(options.journal_dir, *roots)
+            if tree:
+                # the workers are forked, they must not inherit the connection
+                previous = journal.Journal(path)
+                try:
+                    resume = previous.resume()
+                finally:
+                    previous.close()
+            else:
+                entry = _journal(path).lookup(str(src))
+            options = dataclasses.replace(options, journal=path)
+        if options.mode != "full" and options.index_dir is not None:
+            options.index_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+            delta.expire(options.index_dir)
+            # the files of a share copied one at a time share its index
+            index = delta.index_path(options.index_dir, roots[1])
+            # the age of the index is the time since the last copy into the share
+            index.touch(mode=0o600)
+            options = dataclasses.replace(options, index=index)
+        report = None
+        if options.progress_dir is not None:
+            report = progress.ProgressFile(options.progress_dir, *roots)
+        stats = CopyStats()
+        try:
+            if not tree:
+                start: int | None = 0
+                if entry is not None:
+                    src_stat = os.lstat(src)
+                    start = _resume_from(str(dest), src_stat, entry)
+                if start is None:
+                    stats.add(_skipped(src_stat))
+                else:
+                    # the workers copy the chunks of the file instead
+                    single = dataclasses.replace(options, range_workers=options.workers)
+                    stats.add(_copy_batch([(str(src), str(dest), start)], single))
+            else:
+                Copier(options).copy_tree(src, dest, stats, report, resume)
+        except BaseException:
+            if options.journal is not None:
+                _close_journal(options.journal)
+            raise
+        else:
+            if options.journal is not None:
+                _close_journal(options.journal)
+                # the copy is complete, nothing left to resume, the journal
+                # of a share is kept for the copies of its other files
+                if roots == (src, dest):
+                    journal.remove(options.journal)
+        finally:
+            if report is not None:
+                report.update(stats.files, stats.size, done=True)
+            if options.index is not None and options.index in _indexes:
+                _indexes.pop(options.index).close()
+            if options.bandwidth is not None:
+                limiter = _throttles.pop(options.bandwidth, None)
+                if limiter is not None:
+                    limiter.close()
+                throttle.end_job(options.bandwidth)
+        return stats
+
+    def copy_tree(
+        self,
+        src: Path,
+        dest: Path,
+        stats: CopyStats | None = None,
+        report: progress.ProgressFile | None = None,
+        resume: typing.Mapping[str, journal.Entry] | None = None,
+    ) -> CopyStats:
+        """Copy the directory tree src into dest.
+
+        :param src: the directory to copy
+        :type src: Path
+        :param dest: the destination directory, created if it does not exist
+        :type dest: Path
+        :param stats: the counters to update, new ones if unset
+        :type stats: CopyStats or None
+        :param report: where the progress of the copy is recorded
+        :type report: ProgressFile or None
+        :param resume: journal entries of a previous run of the copy
+        :type resume: Mapping[str, Entry] or None
+        :return: the copy counters
+        :rtype: CopyStats
+        """
+        if stats is None:
+            stats = CopyStats()
+        directories: list[tuple[str, str, os.stat_result]] = []
+        # hard links are recreated once the first copy of the inode is done
+        inodes: dict[tuple[int, int], str] = {}
+        hardlinks: list[tuple[str, str]] = []
+        pending: set[concurrent.futures.Future[CopyStats]] = set()
+
+        def collect(wait_for: int) -> None:
+            nonlocal pending
+            while len(pending) > wait_for:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    stats.add(future.result())
+                if report is not None:
+                    report.update(stats.files, stats.size)
+
+        with concurrent.futures.ProcessPoolExecutor(self.options.workers) as pool:
+            max_pending = self.options.workers * QUEUE_DEPTH
+            batch: list[tuple[str, str, int]] = []
+            batch_size = 0
+
+            def submit(items: list[tuple[str, str, int]]) -> None:
+                collect(max_pending)
+                pending.add(pool.submit(_copy_batch, items, self.options))
+
+            try:
+                for src_path, dest_path, entry_stat in self._walk(src, dest):
+                    mode = entry_stat.st_mode
+                    if stat.S_ISDIR(mode):
+                        directories.append((src_path, dest_path, entry_stat))
+                        continue
+                    if not stat.S_ISLNK(mode) and entry_stat.st_nlink > 1:
+                        inode = (entry_stat.st_dev, entry_stat.st_ino)
+                        if inode in inodes:
+                            hardlinks.append((inodes[inode], dest_path))
+                            continue
+                        inodes[inode] = dest_path
+                    start = 0
+                    if resume:
+                        entry = resume.get(src_path)
+                        resumed = _resume_from(dest_path, entry_stat, entry)
+                        if resumed is None:
+                            stats.add(_skipped(entry_stat))
+                            continue
+                        start = resumed
+                    if entry_stat.st_size > self.options.small_file_size:
+                        submit([(src_path, dest_path, start)])
+                        continue
+                    batch.append((src_path, dest_path, start))
+                    batch_size += entry_stat.st_size
+                    if len(batch) >= BATCH_FILES or batch_size >= BATCH_SIZE:
+                        submit(batch)
+                        batch, batch_size = [], 0
+                if batch:
+                    submit(batch)
+                collect(0)
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+
+        try:
+            for target, link in hardlinks:
+                if os.path.lexists(link):
+                    os.unlink(link)
+                os.link(target, link)
+                stats.files += 1
+            # children first, writing into a directory updates its mtime
+            umask = os.umask(0)
+            os.umask(umask)
+            for src_path, dest_path, entry_stat in reversed(directories):
+                if self.options.preserve:
+                    copy_metadata(src_path, dest_path, entry_stat)
+                else:
+                    os.chmod(dest_path, stat.S_IMODE(entry_stat.st_mode) & ~umask)
+        except OSError as e:
+            raise CopyError(f"cannot copy '{src}' to '{dest}': {e}") from e
+        return stats
+
+    def _walk(
+        self, src: Path, dest: Path
+    ) -> typing.Iterator[tuple[str, str, os.stat_result]]:
+        """Yield every entry of src, creating the destination directories."""
+        stack = [(str(src), str(dest))]
+        while stack:
+            src_dir, dest_dir = stack.pop()
+            try:
+                os.makedirs(dest_dir, mode=0o700, exist_ok=True)
+                yield src_dir, dest_dir, os.lstat(src_dir)
+                with os.scandir(src_dir) as entries:
+                    for entry in entries:
+                        dest_path = os.path.join(dest_dir, entry.name)
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append((entry.path, dest_path))
+                        else:
+                            yield entry.path, dest_path, entry.stat(
+                                follow_symlinks=False
+                            )
+            except OSError as e:
+                raise CopyError(f"cannot copy '{src_dir}': {e}") from e
@@ -0,0 +1,153 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Index of the files copied into a share, for delta copies.
+
+In delta mode, the copy engine records the size and modification time of
+each file it copies, on both sides, in an index of the destination share. A
+later copy into the same share skips the files whose source and destination
+both still match the index. In checksum mode, the digest of the source is
+recorded too, and a file is only skipped when the source still hashes the
+same, which catches changes that kept the size and modification time.
+
+Like the copy engine, this module only depends on the standard library.
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+import typing
+from pathlib import Path
+
+from . import journal
+
+Mode = typing.Literal["full", "delta", "checksum"]
+
+# relative to the common path
+DIRECTORY = Path("lib/manila/delta")
+# Indexes of the shares not copied into within this delay are removed.
+INDEX_TTL = 30 * 24 * 60 * 60
+
+
+class Record(typing.NamedTuple):
+    """State of a copied file, when it was copied."""
+
+    src_size: int
+    src_mtime_ns: int
+    dest_size: int
+    dest_mtime_ns: int
+    algorithm: str | None
+    digest: str | None
+
+    def matches(self, src_stat: os.stat_result, dest_stat: os.stat_result) -> bool:
+        """Whether neither side changed since the file was copied."""
+        return (
+            self.src_size,
+            self.src_mtime_ns,
+            self.dest_size,
+            self.dest_mtime_ns,
+        ) == (
+            src_stat.st_size,
+            src_stat.st_mtime_ns,
+            dest_stat.st_size,
+            dest_stat.st_mtime_ns,
+        )
+
+
+def index_path(directory: Path, destination: Path) -> Path:
+    """Path of the index of a destination share.
+
+    :param directory: where the indexes are kept
+    :type directory: Path
+    :param destination: the destination of the copy
+    :type destination: Path
+    :rtype: Path
+    """
+    key = os.path.abspath(destination)
+    return directory / f"{hashlib.sha256(key.encode()).hexdigest()}.sqlite"
+
+
+def expire(directory: Path, ttl: float = INDEX_TTL) -> None:
+    """Remove the indexes of the shares not copied into for a while.
+
+    :param directory: where the indexes are kept
+    :type directory: Path
+    :param ttl: age of the indexes to remove, in seconds
+    :type ttl: float
+    """
+    deadline = time.time() - ttl
+    for path in directory.glob("*.sqlite"):
+        try:
+            if path.stat().st_mtime < deadline:
+                journal.remove(path)
+        except FileNotFoundError:
+            continue
+
+
+class Index:
+    """Index of a destination share, shared by the processes copying into it.
+
+    Each process opens its own connection, writes are serialized by SQLite.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " path TEXT PRIMARY KEY, src_size INTEGER, src_mtime_ns INTEGER,"
+                " dest_size INTEGER, dest_mtime_ns INTEGER, algorithm TEXT,"
+                " digest TEXT)"
+            )
+        return self._conn
+
+    def lookup(self, dest: str) -> Record | None:
+        """Record of a destination file, None when it was not indexed.
+
+        :param dest: the destination path
+        :type dest: str
+        :rtype: Record or None
+        """
+        row = self.conn.execute(
+            "SELECT src_size, src_mtime_ns, dest_size, dest_mtime_ns, algorithm,"
+            " digest FROM files WHERE path = ?",
+            (dest,),
+        ).fetchone()
+        return Record(*row) if row is not None else None
+
+    def record(self, records: typing.Iterable[tuple[str, Record]]) -> None:
+        """Record copied files, in a single transaction.
+
+        :param records: destination paths and their records
+        """
+        rows = [(dest, *record) for dest, record in records]
+        if not rows:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,381 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""OpenMetrics exporter of the data copy throughput and daemon resources.
+
+Every scrape samples the manila-data processes from /proc, the share mounts
+from the mount table and the progress of the copies run by the parallel copy
+engine. The I/O counters of a process include the ones of its children once
+they exited, such as the cp and copy engine processes run for each copy.
+"""
+
+import dataclasses
+import http.server
+import logging
+import os
+import typing
+from pathlib import Path
+
+from . import progress, rendered
+
+SECTION = "snap_metrics"
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PROC = Path("/proc")
+# filesystem types of the mounted shares
+SHARE_FSTYPES = ("nfs", "nfs4", "ceph", "fuse.ceph-fuse")
+
+MetricType = typing.Literal["counter", "gauge"]
+
+
+@dataclasses.dataclass(frozen=True)
+class ExporterOptions:
+    """Options of the metrics exporter."""
+
+    enabled: bool = False
+    # only local scrapers, such as a node agent, are served
+    address: str = "127.0.0.1"
+    port: int = 9469
+
+    @classmethod
+    def from_config(cls, path: Path) -> "ExporterOptions":
+        """Load the options rendered into the [snap_metrics] section.
+
+        :param path: the rendered manila.conf
+        :type path: Path
+        :return: the exporter options
+        :rtype: ExporterOptions
+        """
+        section = rendered.read_section(path, SECTION)
+        return cls(
+            enabled=section.get("enabled", "False") == "True",
+            port=int(section.get("port", cls.port)),
+        )
+
+
+@dataclasses.dataclass
+class Metric:
+    """A metric family and its samples."""
+
+    name: str
+    kind: MetricType
+    doc: str
+    samples: list[tuple[dict[str, str], float]] = dataclasses.field(
+        default_factory=list
+    )
+
+    def add(self, value: float, **labels: typing.Any) -> None:
+        self.samples.append(({k: str(v) for k, v in labels.items()}, value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(metrics: typing.Iterable[Metric]) -> str:
+    """Render metric families in the OpenMetrics text format.
+
+    :param metrics: the metric families
+    :return: the exposition, terminated by # EOF
+    :rtype: str
+    """
+    lines = []
+    for metric in metrics:
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.append(f"# HELP {metric.name} {_escape(metric.doc)}")
+        suffix = "_total" if metric.kind == "counter" else ""
+        for labels, value in metric.samples:
+            label_set = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            if label_set:
+                label_set = f"{{{label_set}}}"
+            lines.append(f"{metric.name}{suffix}{label_set} {value!r}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def find_processes(executable: Path, proc: Path = PROC) -> list[int]:
+    """Processes running an executable, directly or through its interpreter.
+
+    :param executable: the executable
+    :type executable: Path
+    :param proc: the proc filesystem
+    :type proc: Path
+    :return: the process ids
+    :rtype: list[int]
+    """
+    target = os.fsencode(executable)
+    pids = []
+    for entry in os.scandir(proc):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(os.path.join(entry.path, "cmdline"), "rb") as f:
+                argv = f.read().split(b"\0", 2)
+        except OSError:
+            continue
+        # scripts are run as "interpreter script ..."
+        if target in argv[:2]:
+            pids.append(int(entry.name))
+    return sorted(pids)
+
+
+def _read_fields(path: Path, separator: str) -> dict[str, str]:
+    fields = {}
+    for line in path.read_text().splitlines():
+        key, _, value = line.partition(separator)
+        fields[key] = value.strip()
+    return fields
+
+
+def process_sample(pid: int, proc: Path = PROC) -> dict[str, float]:
+    """Sample the I/O and memory counters of a process.
+
+    :param pid: the process id
+    :param proc: the proc filesystem
+    :return: the counters, io_ prefixed ones are only present when readable
+    :raises OSError: when the process is gone
+    """
+    base = proc / str(pid)
+    status = _read_fields(base / "status", ":")
+    sample: dict[str, float] = {
+        "rss": int(status.get("VmRSS", "0 kB").split()[0]) * 1024,
+        "threads": int(status.get("Threads", "1")),
+    }
+    # field 42 of stat, after the command which may contain spaces
+    stat = (base / "stat").read_text().rpartition(")")[2].split()
+    sample["blkio_delay"] = int(stat[39]) / os.sysconf("SC_CLK_TCK")
+    try:
+        io = _read_fields(base / "io", ":")
+    except PermissionError:
+        # needs the system-observe interface
+        return sample
+    for key in ("rchar", "wchar", "read_bytes", "write_bytes"):
+        sample[f"io_{key}"] = int(io[key])
+    return sample
+
+
+def count_mounts(mountinfo: Path) -> dict[str, int]:
+    """Number of share mounts per filesystem type.
+
+    :param mountinfo: the mountinfo file to read
+    :type mountinfo: Path
+    :rtype: dict[str, int]
+    """
+    mounts = dict.fromkeys(SHARE_FSTYPES, 0)
+    for line in mountinfo.read_text().splitlines():
+        fstype = line.partition(" - ")[2].split(" ", 1)[0]
+        if fstype in mounts:
+            mounts[fstype] += 1
+    return mounts
+
+
+class CopyJobs:
+    """Account the progress of the copies across scrapes.
+
+    Copies are counted as finished once their progress file says so, or
+    when the process running them is gone. The totals only ever grow, even
+    when a copy fails before recording its last progress.
+    """
+
+    def __init__(self, directory: Path, proc: Path = PROC):
+        self.directory = directory
+        self.proc = proc
+        self.finished_files = 0
+        self.finished_size = 0
+        self._seen: dict[Path, progress.Job] = {}
+
+    def scan(self) -> dict[Path, progress.Job]:
+        """Read the copies in progress, accounting the finished ones.
+
+        :return: the copies in progress, keyed by progress file
+        :rtype: dict[Path, Job]
+        """
+        active = {}
+        for path, job in progress.read_jobs(self.directory):
+            if job["done"] or not (self.proc / str(job["pid"])).exists():
+                self._finish(path, job)
+                path.unlink(missing_ok=True)
+            else:
+                active[path] = self._seen[path] = job
+        # removed behind our back
+        for path in self._seen.keys() - active.keys():
+            self._finish(path, None)
+        return active
+
+    def _finish(self, path: Path, job: progress.Job | None) -> None:
+        last = self._seen.pop(path, None)
+        files = max(job["files"] if job else 0, last["files"] if last else 0)
+        size = max(job["size"] if job else 0, last["size"] if last else 0)
+        self.finished_files += files
+        self.finished_size += size
+
+
+class Collector:
+    """Sample the metrics of the manila-data daemon."""
+
+    def __init__(self, executable: Path, progress_dir: Path, proc: Path = PROC):
+        self.executable = executable
+        self.proc = proc
+        self.jobs = CopyJobs(progress_dir, proc)
+
+    def collect(self) -> list[Metric]:
+        """Sample all the metrics.
+
+        :return: the metric families
+        :rtype: list[Metric]
+        """
+        return [*self._processes(), *self._mounts(), *self._copies()]
+
+    def _processes(self) -> list[Metric]:
+        processes = Metric(
+            "manila_data_processes", "gauge", "Running manila-data processes"
+        )
+        rss = Metric(
+            "manila_data_process_resident_memory_bytes",
+            "gauge",
+            "Resident memory of the process",
+        )
+        threads = Metric("manila_data_process_threads", "gauge", "Threads")
+        blkio = Metric(
+            "manila_data_process_io_wait_seconds",
+            "counter",
+            "Time spent waiting for block I/O",
+        )
+        io = {
+            "io_rchar": Metric(
+                "manila_data_process_read_bytes",
+                "counter",
+                "Bytes read, from files, sockets and pipes",
+            ),
+            "io_wchar": Metric(
+                "manila_data_process_written_bytes",
+                "counter",
+                "Bytes written, to files, sockets and pipes",
+            ),
+            "io_read_bytes": Metric(
+                "manila_data_process_storage_read_bytes",
+                "counter",
+                "Bytes read from local block devices",
+            ),
+            "io_write_bytes": Metric(
+                "manila_data_process_storage_written_bytes",
+                "counter",
+                "Bytes written to local block devices",
+            ),
+        }
+        count = 0
+        for pid in find_processes(self.executable, self.proc):
+            try:
+                sample = process_sample(pid, self.proc)
+            except (OSError, ValueError, IndexError):
+                # exited while sampled
+                continue
+            count += 1
+            rss.add(sample["rss"], pid=pid)
+            threads.add(sample["threads"], pid=pid)
+            blkio.add(sample["blkio_delay"], pid=pid)
+            for key, metric in io.items():
+                if key in sample:
+                    metric.add(sample[key], pid=pid)
+        processes.add(count)
+        return [processes, rss, threads, blkio, *io.values()]
+
+    def _mounts(self) -> list[Metric]:
+        mounts = Metric("manila_data_mounts", "gauge", "Mounted shares")
+        for fstype, count in count_mounts(self.proc / "self/mountinfo").items():
+            mounts.add(count, fstype=fstype)
+        return [mounts]
+
+    def _copies(self) -> list[Metric]:
+        active = self.jobs.scan()
+        jobs = Metric("manila_data_copy_jobs", "gauge", "Copies in progress")
+        files = Metric("manila_data_copied_files", "counter", "Files copied")
+        size = Metric("manila_data_copied_bytes", "counter", "Bytes copied")
+        job_files = Metric(
+            "manila_data_copy_job_files",
+            "gauge",
+            "Files copied by the copies in progress between two shares",
+        )
+        job_size = Metric(
+            "manila_data_copy_job_bytes",
+            "gauge",
+            "Bytes copied by the copies in progress between two shares",
+        )
+        job_started = Metric(
+            "manila_data_copy_job_start_time_seconds",
+            "gauge",
+            "Start time of the copies in progress between two shares",
+        )
+        job_rate = Metric(
+            "manila_data_copy_job_throughput_bytes_per_second",
+            "gauge",
+            "Average throughput of the copies in progress between two shares",
+        )
+        jobs.add(len(active))
+        files.add(self.jobs.finished_files + sum(j["files"] for j in active.values()))
+        size.add(self.jobs.finished_size + sum(j["size"] for j in active.values()))
+        # manila copies each file on its own, the series are kept per share
+        # pair to bound their number and leave the file names out
+        shares: dict[tuple[str, str], list[progress.Job]] = {}
+        for job in active.values():
+            key = (Path(job["source"]).name, Path(job["destination"]).name)
+            shares.setdefault(key, []).append(job)
+        for (source, destination), share_jobs in shares.items():
+            labels = {"source_share": source, "destination_share": destination}
+            copied = sum(j["size"] for j in share_jobs)
+            started = min(j["started"] for j in share_jobs)
+            elapsed = max(j["updated"] for j in share_jobs) - started
+            job_files.add(sum(j["files"] for j in share_jobs), **labels)
+            job_size.add(copied, **labels)
+            job_started.add(started, **labels)
+            job_rate.add(copied / elapsed if elapsed > 0 else 0, **labels)
+        return [jobs, files, size, job_files, job_size, job_started, job_rate]
+
+
+def make_server(
+    options: ExporterOptions, collector: Collector
+) -> http.server.HTTPServer:
+    """HTTP server exposing the metrics on /metrics.
+
+    Scrapes are served one at a time, the copy progress is accounted for by
+    a single collector.
+
+    :param options: the exporter options
+    :type options: ExporterOptions
+    :param collector: the collector sampled on every scrape
+    :type collector: Collector
+    :rtype: HTTPServer
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self) -> None:  # noqa: N802
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            try:
+                body = render(collector.collect()).encode()
+            except OSError:
+                logging.exception("Failed to collect the metrics")
+                self.send_error(500)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt: str, *args: typing.Any) -> None:
+            logging.debug(fmt, *args)
+
+    return http.server.HTTPServer((options.address, options.port), Handler)
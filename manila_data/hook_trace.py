@@ -0,0 +1,108 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Timing of the phases of the hooks.
+
+Every hook run appends one JSON line to the trace file, with the time the
+process took to start and to import the hook entry point, and the duration
+of each phase of the hook. The file is rotated once it reaches MAX_BYTES.
+"""
+
+import contextlib
+import datetime
+import json
+import logging
+import os
+import time
+import typing
+from pathlib import Path
+
+# relative to the common path
+TRACE_FILE = Path("hooks-trace.jsonl")
+# Size of the trace file before it is rotated, a single rotated file is kept.
+MAX_BYTES = 1024 * 1024
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+def process_age() -> float | None:
+    """Seconds since the calling process started, None if unknown."""
+    try:
+        stat = Path("/proc/self/stat").read_text().rpartition(")")[2].split()
+        uptime = float(Path("/proc/uptime").read_text().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    # field 22 of stat, in clock ticks since boot
+    return uptime - int(stat[19]) / os.sysconf("SC_CLK_TCK")
+
+
+class Tracer:
+    """Record the duration of nested spans."""
+
+    def __init__(self) -> None:
+        self.origin = time.perf_counter()
+        self.spans: list[dict[str, typing.Any]] = []
+        self._stack: list[str] = []
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes: typing.Any) -> typing.Iterator[dict]:
+        """Time the enclosed block.
+
+        :param name: name of the span
+        :type name: str
+        :param attributes: attributes recorded with the span
+        :return: the span record, attributes may be added to it
+        """
+        start = time.perf_counter()
+        record: dict[str, typing.Any] = {
+            "name": name,
+            "parent": self._stack[-1] if self._stack else None,
+            "start_ms": _ms(start - self.origin),
+            **attributes,
+        }
+        self._stack.append(name)
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            self._stack.pop()
+            record["duration_ms"] = _ms(time.perf_counter() - start)
+            self.spans.append(record)
+
+    def write(self, path: Path, **fields: typing.Any) -> None:
+        """Append the spans to the trace file, as a single JSON line.
+
+        Failures are logged, tracing never fails a hook.
+
+        :param path: the trace file
+        :type path: Path
+        :param fields: fields recorded with the spans, such as the hook name
+        """
+        entry = {
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            **fields,
+            "total_ms": _ms(time.perf_counter() - self.origin),
+            "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+        }
+        try:
+            if path.exists() and path.stat().st_size >= MAX_BYTES:
+                os.replace(path, path.with_name(path.name + ".1"))
+            with path.open("a") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+        except OSError:
+            logging.warning("Failed to write the trace to %s", path, exc_info=True)
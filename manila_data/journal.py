@@ -0,0 +1,218 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checkpoints of the copies, letting an interrupted copy resume.
+
+Each copy of a source into a destination keeps a journal of the files it
+finished and of the offset reached in the large files it streams. When the
+same copy is started again, after a restart of the daemon, finished files
+are skipped and partial ones continued. The journal is removed once the copy
+succeeds. manila copies a share one file at a time, these copies share the
+journal of their shares, which is kept until it expires.
+
+Entries are only trusted when the source file did not change since, and the
+journal of a previous boot is discarded: data written before a host crash
+may not have reached the destination.
+
+Like the copy engine, this module only depends on the standard library.
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+import typing
+from pathlib import Path
+
+# relative to the common path
+DIRECTORY = Path("lib/manila/journal")
+# Offset reached in a large file is recorded every CHECKPOINT_SIZE bytes.
+CHECKPOINT_SIZE = 1024 * 1024 * 1024
+# Journals of copies not resumed within this delay are removed.
+JOURNAL_TTL = 7 * 24 * 60 * 60
+
+BOOT_ID = Path("/proc/sys/kernel/random/boot_id")
+
+
+class Entry(typing.NamedTuple):
+    """Progress of the copy of a file."""
+
+    size: int
+    mtime_ns: int
+    offset: int
+    done: bool
+
+    def matches(self, st: os.stat_result) -> bool:
+        """Whether the source file is unchanged since the entry was recorded."""
+        return (self.size, self.mtime_ns) == (st.st_size, st.st_mtime_ns)
+
+
+def boot_id() -> str:
+    """Identifier of the current boot, empty when unknown."""
+    try:
+        return BOOT_ID.read_text().strip()
+    except OSError:
+        return ""
+
+
+def journal_path(directory: Path, source: Path, destination: Path) -> Path:
+    """Path of the journal of a copy.
+
+    :param directory: where the journals are kept
+    :type directory: Path
+    :param source: the source of the copy
+    :type source: Path
+    :param destination: the destination of the copy
+    :type destination: Path
+    :rtype: Path
+    """
+    key = f"{os.path.abspath(source)}\0{os.path.abspath(destination)}"
+    return directory / f"{hashlib.sha256(key.encode()).hexdigest()}.sqlite"
+
+
+def remove(path: Path) -> None:
+    """Remove a journal and its write-ahead log.
+
+    :param path: the journal
+    :type path: Path
+    """
+    for suffix in ("", "-wal", "-shm"):
+        path.with_name(path.name + suffix).unlink(missing_ok=True)
+
+
+def expire(directory: Path, ttl: float = JOURNAL_TTL) -> None:
+    """Remove the journals of the copies not resumed for a while.
+
+    :param directory: where the journals are kept
+    :type directory: Path
+    :param ttl: age of the journals to remove, in seconds
+    :type ttl: float
+    """
+    deadline = time.time() - ttl
+    for path in directory.glob("*.sqlite"):
+        try:
+            if path.stat().st_mtime < deadline:
+                remove(path)
+        except FileNotFoundError:
+            continue
+
+
+class Journal:
+    """Journal of a copy, shared by the processes running it.
+
+    Each process opens its own connection, writes are serialized by SQLite.
+    Commits are not synced to disk, which the boot check makes up for.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # writes of a batch are committed as a single transaction
+            self._conn = sqlite3.connect(self.path, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER,"
+                " offset INTEGER, done INTEGER)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+        return self._conn
+
+    def resume(self) -> dict[str, Entry]:
+        """Read the entries left by a previous run of the copy.
+
+        Entries of a previous boot are dropped. Called by the process
+        starting the copy, before any other process writes to the journal.
+
+        :return: the entries, keyed by source path
+        :rtype: dict[str, Entry]
+        """
+        if not self._same_boot():
+            return {}
+        entries = {
+            path: Entry(size, mtime_ns, offset, bool(done))
+            for path, size, mtime_ns, offset, done in self.conn.execute(
+                "SELECT path, size, mtime_ns, offset, done FROM files"
+            )
+        }
+        # fold the log of the previous run into the journal
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return entries
+
+    def lookup(self, path: str) -> Entry | None:
+        """Read the entry of a single file left by a previous run.
+
+        Entries of a previous boot are dropped. Used by the copies of single
+        files, which do not need the entries of the whole share.
+
+        :param path: the source path
+        :type path: str
+        :return: the entry, None when the file was not recorded
+        :rtype: Entry or None
+        """
+        if not self._same_boot():
+            return None
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, offset, done FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, offset, done = row
+        return Entry(size, mtime_ns, offset, bool(done))
+
+    def _same_boot(self) -> bool:
+        """Drop the entries of a previous boot, whether any were kept."""
+        current_boot = boot_id()
+        row = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'boot_id'"
+        ).fetchone()
+        if row is not None and row[0] == current_boot:
+            return True
+        with self.conn:
+            self.conn.execute("DELETE FROM files")
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('boot_id', ?)", (current_boot,)
+            )
+        return False
+
+    def record(
+        self, entries: typing.Iterable[tuple[str, os.stat_result, int, bool]]
+    ) -> None:
+        """Record the progress of files, in a single transaction.
+
+        :param entries: source path, its stat taken before copying it, offset
+            reached and whether the file is finished
+        """
+        rows = [
+            (path, st.st_size, st.st_mtime_ns, offset, done)
+            for path, st, offset, done in entries
+        ]
+        if not rows:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
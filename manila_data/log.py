@@ -12,21 +12,79 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
+import gzip
 import logging
+import logging.handlers
+import os
+import queue
+import shutil
 from pathlib import Path
 
+# Size of a log file before it is rotated, and number of rotated files kept.
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
 
-def setup_logging(logfile: Path | str) -> None:
+FORMAT = "%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s"
+DATEFMT = "%H:%M:%S"
+
+_listener: logging.handlers.QueueListener | None = None
+_queue_handler: logging.handlers.QueueHandler | None = None
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+class CompressedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Size based rotating file handler, compressing the rotated files."""
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count)
+        self.namer = lambda name: name + ".gz"
+        self.rotator = _gzip_rotator
+
+
+def setup_logging(logfile: Path | str, debug: bool = False) -> None:
     """Sets up the logging for the specified logfile.
 
+    Records are handed over to a queue and written to the file by a
+    background thread, logging never waits for the disk. The file is
+    rotated and compressed once it reaches MAX_BYTES.
+
     :param logfile: the file to record logging information to
     :type logfile: Path or str
+    :param debug: whether to record debug messages
+    :type debug: bool
     :return: None
     """
-    logging.basicConfig(
-        filename=str(logfile),
-        filemode="a",
-        format="%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s",
-        datefmt="%H:%M:%S",
-        level=logging.DEBUG,
-    )
+    global _listener, _queue_handler
+
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG if debug else logging.INFO)
+    if _listener is not None:
+        return
+
+    handler = CompressedRotatingFileHandler(str(logfile), MAX_BYTES, BACKUP_COUNT)
+    handler.setFormatter(logging.Formatter(FORMAT, datefmt=DATEFMT))
+    records: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    _queue_handler = logging.handlers.QueueHandler(records)
+    root.addHandler(_queue_handler)
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Write the pending records and close the log file."""
+    global _listener, _queue_handler
+
+    if _listener is None or _queue_handler is None:
+        return
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = _queue_handler = None
@@ -0,0 +1,247 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Manifest of the rendered templates.
+
+For every template, the manifest records a digest of everything the
+rendering depends on and a digest of the rendered file. When the inputs did
+not change and the file on disk is still the one rendered last time, the
+hooks skip rendering it altogether.
+"""
+
+import configparser
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import typing
+from pathlib import Path
+
+VERSION = 1
+
+
+class Record(typing.TypedDict):
+    """Manifest entry of a rendered file."""
+
+    # digest of the template source
+    source: str
+    # namespaces referenced by the template, None when they cannot be known
+    namespaces: list[str] | None
+    # digest of the inputs of the rendering
+    inputs: str
+    # digest, size and modification time of the rendered file
+    output: str
+    size: int
+    mtime_ns: int
+    # digest of every "section.option" of the file, None if not an ini file
+    options: dict[str, str] | None
+
+
+def digest(data: bytes) -> str:
+    """Stable digest of data."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def inputs_digest(data: typing.Mapping[str, typing.Any]) -> str:
+    """Stable digest of the JSON serialization of data."""
+    serialized = json.dumps(data, sort_keys=True, default=str)
+    return digest(serialized.encode())
+
+
+def option_digests(content: str) -> dict[str, str] | None:
+    """Digest of every option of an ini file, keyed by "section.option".
+
+    :param content: the content of the file
+    :return: the option digests, None if the content is not an ini file
+    """
+    parser = configparser.ConfigParser(
+        interpolation=None, default_section="__snap_no_default__", strict=False
+    )
+    try:
+        parser.read_string(content)
+    except configparser.Error:
+        return None
+    return {
+        f"{section}.{option}": digest(value.encode())
+        for section in parser.sections()
+        for option, value in parser.items(section)
+    }
+
+
+def write_atomic(path: Path, content: str, mode: int) -> None:
+    """Replace the content of a file atomically.
+
+    The content is written to a temporary file in the same directory which
+    is then renamed over path, readers never see a partially written file.
+
+    :param path: the file to write
+    :type path: Path
+    :param content: the new content
+    :type content: str
+    :param mode: permission bits of the file
+    :type mode: int
+    """
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fchmod(f.fileno(), mode)
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class RenderManifest:
+    """Persistent manifest of the rendered templates."""
+
+    def __init__(self, path: Path, records: dict[str, Record] | None = None):
+        self.path = path
+        self.records: dict[str, Record] = records or {}
+        self.changed = False
+
+    @classmethod
+    def load(cls, path: Path) -> "RenderManifest":
+        """Load the manifest, an unreadable manifest is considered empty.
+
+        :param path: the manifest file
+        :type path: Path
+        :return: the manifest
+        :rtype: RenderManifest
+        """
+        try:
+            data = json.loads(path.read_text())
+        except FileNotFoundError:
+            return cls(path)
+        except (OSError, ValueError):
+            logging.warning("Ignoring unreadable manifest %s", path, exc_info=True)
+            return cls(path)
+        if data.get("version") != VERSION:
+            return cls(path)
+        return cls(path, data.get("records", {}))
+
+    def save(self) -> None:
+        """Write the manifest to disk, if it changed."""
+        if not self.changed:
+            return
+        data = {"version": VERSION, "records": self.records}
+        write_atomic(self.path, json.dumps(data, indent=2), 0o600)
+        self.changed = False
+
+    def namespaces(self, key: str, source: str) -> list[str] | None:
+        """Namespaces recorded for a template source, if still current.
+
+        :param key: the rendered file, relative to its location
+        :param source: digest of the template source
+        :return: the recorded namespaces, None if the source changed
+        """
+        record = self.records.get(key)
+        if record is None or record["source"] != source:
+            return None
+        return record["namespaces"]
+
+    def _matches(self, record: Record, dest: Path) -> bool:
+        """Whether dest is still the file recorded."""
+        try:
+            st = dest.stat()
+        except FileNotFoundError:
+            return False
+        return st.st_size == record["size"] and st.st_mtime_ns == record["mtime_ns"]
+
+    def is_current(self, key: str, inputs: str, dest: Path) -> bool:
+        """Whether dest was rendered from the same inputs and left untouched.
+
+        :param key: the rendered file, relative to its location
+        :param inputs: digest of the rendering inputs
+        :param dest: the rendered file
+        """
+        record = self.records.get(key)
+        if record is None or record["namespaces"] is None:
+            return False
+        return record["inputs"] == inputs and self._matches(record, dest)
+
+    def is_unchanged(self, key: str, output: str, dest: Path) -> bool:
+        """Whether dest already holds the rendered output.
+
+        :param key: the rendered file, relative to its location
+        :param output: digest of the rendered content
+        :param dest: the rendered file
+        """
+        record = self.records.get(key)
+        if record is not None and self._matches(record, dest):
+            return record["output"] == output
+        # unknown or touched file, compare its content
+        try:
+            return digest(dest.read_bytes()) == output
+        except FileNotFoundError:
+            return False
+
+    def changed_options(
+        self, key: str, options: dict[str, str] | None, dest: Path
+    ) -> set[str] | None:
+        """Options that differ from the ones last rendered into dest.
+
+        :param key: the rendered file, relative to its location
+        :param options: digests of the options about to be rendered
+        :param dest: the rendered file
+        :return: the changed options, None if they cannot be known
+        """
+        record = self.records.get(key)
+        if record is None or not self._matches(record, dest):
+            return None
+        previous = record.get("options")
+        if previous is None or options is None:
+            return None
+        return {
+            option
+            for option in previous.keys() | options.keys()
+            if previous.get(option) != options.get(option)
+        }
+
+    def record(
+        self,
+        key: str,
+        source: str,
+        namespaces: list[str] | None,
+        inputs: str,
+        output: str,
+        dest: Path,
+        options: dict[str, str] | None = None,
+    ) -> None:
+        """Record the rendering of a file.
+
+        :param key: the rendered file, relative to its location
+        :param source: digest of the template source
+        :param namespaces: namespaces referenced by the template
+        :param inputs: digest of the rendering inputs
+        :param output: digest of the rendered content
+        :param dest: the rendered file
+        :param options: digests of the options of the rendered file
+        """
+        st = dest.stat()
+        record = Record(
+            source=source,
+            namespaces=namespaces,
+            inputs=inputs,
+            output=output,
+            size=st.st_size,
+            mtime_ns=st.st_mtime_ns,
+            options=options,
+        )
+        if self.records.get(key) != record:
+            self.records[key] = record
+            self.changed = True
@@ -13,18 +13,47 @@
 # limitations under the License.
 
 import abc
+import functools
 import inspect
+import json
 import logging
+import time
 import typing
 from pathlib import Path
 
 import jinja2
+import jinja2.meta
 import pydantic
 from snaphelpers import Snap
 
-from . import configuration, context, error, log, services, template
+from . import (
+    IMPORT_START,
+    configuration,
+    context,
+    error,
+    hook_trace,
+    log,
+    manifest,
+    restart,
+    services,
+    template,
+)
 
 ETC_MANILA = Path("etc/manila")
+ETC_CEPH = Path("etc/ceph")
+ROOTWRAP_D = ETC_MANILA / "rootwrap.d"
+MANIFEST = Path("render-manifest.json")
+# digests of the configuration last applied by the configure hook
+APPLIED_CONFIG = Path("applied-config.json")
+# values applied for every option, for auditing the profiles
+EFFECTIVE_CONFIG = Path("effective-config.json")
+# bytecode of the override templates, relative to the common path
+BYTECODE_CACHE = Path("cache/templates")
+# bundled templates compiled at build time, next to the module of the class
+COMPILED_TEMPLATES = "compiled_templates"
+# options of every jinja environment, the bundled templates are compiled
+# with them
+JINJA_OPTIONS: dict[str, typing.Any] = {"keep_trailing_newline": True}
 
 
 CONF = typing.TypeVar("CONF", bound=configuration.Configuration)
@@ -33,60 +62,174 @@ CONF = typing.TypeVar("CONF", bound=configuration.Configuration)
 class ManilaData(typing.Generic[CONF], abc.ABC):
     def __init__(self) -> None:
         self._contexts: typing.Sequence[context.Context] | None = None
+        self._raw_config: dict[str, typing.Any] | None = None
+        # changed options of the rendered files, None when not known
+        self._changed_options: dict[Path, set[str] | None] = {}
+        self._render_failed = False
+        self.tracer = hook_trace.Tracer()
 
     @classmethod
     def install_hook(cls, snap: Snap) -> None:
-        log.setup_logging(snap.paths.common / "hooks.log")
-        cls().install(snap)
+        manila_data = cls()
+        log.setup_logging(snap.paths.common / "hooks.log", manila_data.debug(snap))
+        try:
+            manila_data.install(snap)
+        finally:
+            manila_data.write_trace(snap, "install")
 
     @classmethod
     def configure_hook(cls, snap: Snap) -> None:
-        log.setup_logging(snap.paths.common / "hooks.log")
+        manila_data = cls()
+        log.setup_logging(snap.paths.common / "hooks.log", manila_data.debug(snap))
         try:
-            cls().configure(snap)
+            manila_data.configure(snap)
         except error.ManilaError:
             logging.warning("Configuration not complete", exc_info=True)
+        finally:
+            manila_data.write_trace(snap, "configure")
+
+    def write_trace(self, snap: Snap, hook: str) -> None:
+        """Record the timing of the hook in $SNAP_COMMON."""
+        age = hook_trace.process_age()
+        # the process started before the tracer, by its age at that time
+        startup = age - (time.perf_counter() - self.tracer.origin) if age else None
+        self.tracer.write(
+            snap.paths.common / hook_trace.TRACE_FILE,
+            hook=hook,
+            revision=str(snap.revision),
+            startup_ms=startup and round(startup * 1000, 3),
+            import_ms=round((LOADED - IMPORT_START) * 1000, 3),
+        )
 
     def install(self, snap: Snap) -> None:
-        self.setup_dirs(snap)
-        self.template(snap)
+        with self.tracer.span("setup_dirs"):
+            self.setup_dirs(snap)
+        with self.tracer.span("template"):
+            self.template(snap)
 
     def configure(self, snap: Snap) -> None:
-        self.setup_dirs(snap)
-        modified = self.template(snap)
-        self.start_services(snap, modified)
+        applied_path = snap.paths.common / APPLIED_CONFIG
+        with self.tracer.span("config_snapshot") as span:
+            snapshot = self.config_snapshot(snap)
+            changed = self.changed_namespaces(applied_path, snapshot)
+            span["changed"] = changed
+        if not changed:
+            logging.info("Configuration unchanged since last applied, skipping")
+            return
+        logging.debug("Configuration changed: %s", ", ".join(changed))
+
+        with self.tracer.span("setup_dirs"):
+            self.setup_dirs(snap)
+        with self.tracer.span("template"):
+            modified = self.template(snap)
+        with self.tracer.span("start_services"):
+            self.start_services(snap, modified)
+        if not self._render_failed:
+            # reported now, the restart applying the limits may be deferred
+            with self.tracer.span("check_limits"):
+                services.ManilaDataService().check_limits(snap)
+            with self.tracer.span("effective_config"):
+                self.write_effective_config(snap)
+            # the rendered files changed since the snapshot was taken
+            snapshot = self.config_snapshot(snap)
+            manifest.write_atomic(applied_path, json.dumps(snapshot, indent=2), 0o600)
 
     def start_services(
         self,
         snap: Snap,
         modified_tpl: typing.Sequence[template.Template],
     ) -> None:
+        changes = {}
+        for tpl in modified_tpl:
+            path = getattr(snap.paths, tpl.location) / tpl.dest_path()
+            changes[path] = self._changed_options.get(path)
+        service_classes = {cls.name: cls for cls in services.services()}
+        pending_file = snap.paths.common / restart.PENDING_FILE
+        pending = None
+
         snap_services = snap.services.list()
         for name, snap_service in snap_services.items():
-            logging.debug("Restarting service %s", name)
-            if modified_tpl:
+            # snapctl names services <snap>.<app>
+            service_class = service_classes.get(name.rpartition(".")[2])
+            if service_class is not None:
+                action = service_class.action(snap, changes)
+            else:
+                action = "restart" if modified_tpl else None
+
+            if action == "restart" and service_class is not None:
+                service = service_class()
+                delay = service.restart_delay(snap)
+                if delay is not None and service.busy(snap):
+                    logging.info("Deferring the restart of %s", name)
+                    pending = restart.defer(pending_file, service.name, delay)
+                    continue
+
+            if action == "restart":
+                logging.debug("Restarting service %s", name)
                 snap_service.restart()
+            elif action == "reload":
+                logging.debug("Reloading service %s", name)
+                snap_service.restart(reload=True)
             else:
+                logging.debug("Starting service %s", name)
                 snap_service.start()
 
+        if pending is not None:
+            restart.publish(snap, pending)
+            coordinator = (
+                f"{snap.instance_name}.{services.RestartCoordinatorService.name}"
+            )
+            if coordinator in snap_services:
+                snap_services[coordinator].start()
+
+    def write_effective_config(self, snap: Snap) -> None:
+        """Record the value applied for every option, and its source.
+
+        Credentials are masked, ``manila-data.effective-config`` prints it.
+        """
+        options = configuration.effective_options(
+            self.get_config(snap), self.get_raw_config(snap)
+        )
+        manifest.write_atomic(
+            snap.paths.common / EFFECTIVE_CONFIG, json.dumps(options, indent=2), 0o600
+        )
+
     @abc.abstractmethod
     def config_type(self) -> typing.Type[CONF]:
         raise NotImplementedError
 
-    def get_config(self, snap: Snap) -> CONF:
-        keys = self.config_type().model_fields.keys()
+    def get_raw_config(self, snap: Snap) -> dict[str, typing.Any]:
+        """Snap options of the configuration, as returned by snapctl."""
+        if self._raw_config is None:
+            # the whole tree in a single snapctl call, whatever keys are read
+            with self.tracer.span("get_raw_config"):
+                self._raw_config = snap.config.get_options().as_dict()
+        return self._raw_config
+
+    def debug(self, snap: Snap) -> bool:
+        """Whether debug logging is enabled, even if the config is incomplete."""
+        settings = self.get_raw_config(snap).get("settings") or {}
         try:
-            return self.config_type().model_validate(
-                snap.config.get_options(*keys).as_dict()
-            )
-        except pydantic.ValidationError as e:
-            raise error.ManilaError("Invalid configuration") from e
+            return configuration.Settings.model_validate(settings).debug
+        except pydantic.ValidationError:
+            return False
+
+    def get_config(self, snap: Snap) -> CONF:
+        raw_config = self.get_raw_config(snap)
+        with self.tracer.span("get_config"):
+            try:
+                return self.config_type().model_validate(raw_config)
+            except pydantic.ValidationError as e:
+                raise error.ManilaError("Invalid configuration") from e
 
     def directories(self) -> list[template.Directory]:
         """Directories to be created on the common path."""
         return [
             template.CommonDirectory("etc/manila"),
+            template.CommonDirectory("etc/manila/rootwrap.d"),
+            template.CommonDirectory("etc/ceph"),
             template.CommonDirectory("lib/manila"),
+            template.CommonDirectory(BYTECODE_CACHE, mode=0o700),
         ]
 
     def template_files(self) -> list[template.Template]:
@@ -94,6 +237,9 @@ class ManilaData(typing.Generic[CONF], abc.ABC):
         return [
             template.CommonTemplate("manila.conf", ETC_MANILA),
             template.CommonTemplate("rootwrap.conf", ETC_MANILA),
+            template.CommonTemplate("data-copy.filters", ROOTWRAP_D),
+            template.CommonTemplate("data-mounts.conf", ETC_MANILA),
+            template.CommonTemplate("ceph.conf", ETC_CEPH),
         ]
 
     def contexts(self, snap: Snap) -> typing.Sequence[context.Context]:
@@ -101,6 +247,7 @@ class ManilaData(typing.Generic[CONF], abc.ABC):
         if self._contexts is None:
             self._contexts = [
                 context.SnapPathContext(snap),
+                context.SnapInstanceContext(snap),
                 *(
                     context.ConfigContext(k, v)
                     for k, v in self.get_config(snap).model_dump().items()
@@ -108,13 +255,96 @@ class ManilaData(typing.Generic[CONF], abc.ABC):
             ]
         return self._contexts
 
+    def render_inputs(self, snap: Snap) -> dict[str, typing.Any]:
+        """Unvalidated inputs of the contexts, keyed by namespace.
+
+        Templates only referencing these namespaces are not rendered again
+        as long as their inputs do not change.
+        """
+        # the profile feeds the namespaces it sets defaults for
+        raw_config = configuration.apply_profile(self.get_raw_config(snap))
+        inputs = {
+            name: raw_config.get(configuration.to_kebab(name))
+            for name in self.config_type().model_fields
+        }
+        for ctx in (context.SnapPathContext(snap), context.SnapInstanceContext(snap)):
+            inputs[ctx.namespace] = ctx.context()
+        return inputs
+
+    def render_fingerprint(self, snap: Snap) -> dict[str, typing.Any]:
+        """Inputs shared by all templates, besides their context.
+
+        The revision covers changes of the code and bundled templates, the
+        CPU count feeds the automatically sized options.
+        """
+        return {
+            "revision": str(snap.revision),
+            "cpus": configuration.cpu_count(),
+        }
+
+    def config_snapshot(self, snap: Snap) -> dict[str, str]:
+        """Digests of everything the configure hook applies, by namespace.
+
+        Besides the render inputs, the snapshot covers the revision, the
+        template overrides and the rendered files, so that a local change
+        to any of them is applied again. Only digests are kept, the snapshot
+        holds no credentials.
+        """
+        overrides = snap.paths.common / "templates"
+        files = {}
+        for tpl in self.template_files():
+            path = getattr(snap.paths, tpl.location) / tpl.dest_path()
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            files[str(path)] = [st.st_size, st.st_mtime_ns]
+        inputs = {
+            **self.render_inputs(snap),
+            "fingerprint": self.render_fingerprint(snap),
+            "overrides": sorted(
+                [str(p), p.stat().st_mtime_ns]
+                for p in overrides.rglob("*")
+                if p.is_file()
+            ),
+            "files": files,
+        }
+        return {
+            namespace: manifest.inputs_digest({namespace: value})
+            for namespace, value in inputs.items()
+        }
+
+    def changed_namespaces(self, path: Path, snapshot: dict[str, str]) -> list[str]:
+        """Namespaces of a snapshot that differ from the last applied one.
+
+        :param path: the last applied snapshot
+        :type path: Path
+        :param snapshot: the current snapshot
+        :return: the changed namespaces, all of them without a valid snapshot
+        :rtype: list[str]
+        """
+        try:
+            applied = json.loads(path.read_text())
+        except FileNotFoundError:
+            applied = {}
+        except (OSError, ValueError):
+            logging.warning("Ignoring unreadable snapshot %s", path, exc_info=True)
+            applied = {}
+        return sorted(
+            namespace
+            for namespace in applied.keys() | snapshot.keys()
+            if applied.get(namespace) != snapshot.get(namespace)
+        )
+
     def render_context(
         self, snap: Snap
     ) -> typing.MutableMapping[str, typing.Mapping[str, str]]:
         context = {}
-        for ctx in self.contexts(snap):
-            logging.debug("Adding context: %s", ctx.namespace)
-            context[ctx.namespace] = ctx.context()
+        contexts = self.contexts(snap)
+        with self.tracer.span("render_context"):
+            for ctx in contexts:
+                logging.debug("Adding context: %s", ctx.namespace)
+                context[ctx.namespace] = ctx.context()
         return context
 
     def setup_dirs(self, snap: Snap) -> None:
@@ -126,78 +356,197 @@ class ManilaData(typing.Generic[CONF], abc.ABC):
             path.mkdir(parents=True, exist_ok=True)
             path.chmod(d.mode)
 
-    def templates_search_path(self, snap: Snap) -> list[Path]:
+    def _class_dir(self) -> Path | None:
         try:
-            extra = [Path(inspect.getfile(self.__class__)).parent / "templates"]
+            return Path(inspect.getfile(self.__class__)).parent
         except Exception:
             logging.error("Failed to get templates path from class", exc_info=True)
-            extra = []
-        return [
-            snap.paths.common / "templates",
-            *extra,
-            Path(__file__).parent / "templates",
+            return None
+
+    def bundled_templates_path(self) -> list[Path]:
+        """Directories of the templates shipped with the snap."""
+        class_dir = self._class_dir()
+        extra = [class_dir / "templates"] if class_dir else []
+        return [*extra, Path(__file__).parent / "templates"]
+
+    def templates_search_path(self, snap: Snap) -> list[Path]:
+        return [snap.paths.common / "templates", *self.bundled_templates_path()]
+
+    def compiled_templates_path(self) -> Path | None:
+        """Directory of the bundled templates compiled at build time."""
+        class_dir = self._class_dir()
+        return class_dir / COMPILED_TEMPLATES if class_dir else None
+
+    def compile_templates(self, target: Path) -> None:
+        """Compile the bundled templates into python modules.
+
+        :param target: the directory receiving the modules
+        :type target: Path
+        """
+        env = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(self.bundled_templates_path()),
+            **JINJA_OPTIONS,
+        )
+        env.compile_templates(
+            str(target),
+            zip=None,
+            filter_func=lambda name: name.endswith(".j2"),
+            ignore_errors=False,
+        )
+
+    def template_environment(self, snap: Snap) -> jinja2.Environment:
+        """Jinja environment the templates are rendered with.
+
+        Templates overridden in $SNAP_COMMON/templates come first, their
+        bytecode is cached across hook runs. The bundled templates are then
+        loaded from the modules compiled at build time, when available.
+        """
+        search_path = self.templates_search_path(snap)
+        loaders: list[jinja2.BaseLoader] = [
+            jinja2.FileSystemLoader(snap.paths.common / "templates")
         ]
+        compiled = self.compiled_templates_path()
+        if compiled is not None and compiled.is_dir():
+            loaders.append(jinja2.ModuleLoader(compiled))
+        loaders.append(jinja2.FileSystemLoader(searchpath=search_path))
+        return jinja2.Environment(
+            loader=jinja2.ChoiceLoader(loaders),
+            bytecode_cache=jinja2.FileSystemBytecodeCache(
+                str(snap.paths.common / BYTECODE_CACHE)
+            ),
+            **JINJA_OPTIONS,
+        )
+
+    def _template_source(
+        self, search_path: typing.Sequence[Path], template: template.Template
+    ) -> bytes:
+        """Read a template source, the way the jinja loader looks it up."""
+        template_file = template.template()
+        for name in (template_file, template_file + ".j2"):
+            for directory in search_path:
+                path = directory / name
+                if path.is_file():
+                    return path.read_bytes()
+        raise jinja2.exceptions.TemplateNotFound(template_file)
+
+    @staticmethod
+    def _template_namespaces(source: bytes) -> list[str] | None:
+        """Namespaces referenced by a template, None if it includes others."""
+        ast = jinja2.Environment().parse(source.decode())
+        if any(True for _ in jinja2.meta.find_referenced_templates(ast)):
+            return None
+        return sorted(jinja2.meta.find_undeclared_variables(ast))
 
     def _process_template(
         self,
         snap: Snap,
-        env: jinja2.Environment,
+        renderer: "_Renderer",
         template: template.Template,
-        context: typing.Mapping[str, typing.Mapping[str, str]],
+        render_manifest: manifest.RenderManifest,
     ) -> bool:
-        file_name = template.filename
-        dest_dir: Path = getattr(snap.paths, template.location) / template.dest
-        dest_dir.mkdir(parents=True, exist_ok=True)
-        dest_file = dest_dir / file_name.removesuffix(".j2")
-
-        original_hash = None
-        if dest_file.exists():
-            original_hash = hash(dest_file.read_text())
+        dest_file: Path = getattr(snap.paths, template.location) / template.dest_path()
+        dest_file.parent.mkdir(parents=True, exist_ok=True)
+        key = f"{template.location}/{template.dest_path()}"
+
+        source = self._template_source(renderer.search_path, template)
+        source_digest = manifest.digest(source)
+        namespaces = render_manifest.namespaces(key, source_digest)
+        if namespaces is None:
+            namespaces = self._template_namespaces(source)
+        if namespaces is not None and not set(namespaces) <= renderer.inputs.keys():
+            # depends on contexts that cannot be compared before rendering
+            namespaces = None
+
+        inputs = manifest.inputs_digest(
+            {
+                **renderer.fingerprint,
+                "source": source_digest,
+                "mode": template.mode,
+                "context": {ns: renderer.inputs[ns] for ns in namespaces or []},
+            }
+        )
+        if render_manifest.is_current(key, inputs, dest_file):
+            logging.debug("File %s inputs have not changed, skipping", dest_file)
+            return False
 
         tpl = None
         template_file = template.template()
         try:
-            tpl = env.get_template(template_file)
+            tpl = renderer.env.get_template(template_file)
         except jinja2.exceptions.TemplateNotFound:
             logging.debug("Template %s not found, trying with .j2", template_file)
-            tpl = env.get_template(template_file + ".j2")
+            tpl = renderer.env.get_template(template_file + ".j2")
 
-        rendered = tpl.render(**context)
+        rendered = tpl.render(**renderer.context)
         if len(rendered) > 0 and rendered[-1] != "\n":
             # ensure trailing new line
             rendered += "\n"
 
-        new_hash = hash(rendered)
-
-        if original_hash == new_hash:
+        output = manifest.digest(rendered.encode())
+        options = manifest.option_digests(rendered)
+        modified = not render_manifest.is_unchanged(key, output, dest_file)
+        if modified:
+            logging.debug("File %s has changed, writing new content", dest_file)
+            self._changed_options[dest_file] = render_manifest.changed_options(
+                key, options, dest_file
+            )
+            manifest.write_atomic(dest_file, rendered, template.mode)
+        else:
             logging.debug("File %s has not changed, skipping", dest_file)
-            return False
-
-        logging.debug("File %s has changed, writing new content", dest_file)
 
-        dest_file.write_text(rendered)
-        dest_file.chmod(template.mode)
-        return True
+        render_manifest.record(
+            key, source_digest, namespaces, inputs, output, dest_file, options
+        )
+        return modified
 
     def template(self, snap: Snap) -> list[template.Template]:
-        env = jinja2.Environment(
-            loader=jinja2.FileSystemLoader(searchpath=self.templates_search_path(snap)),
-            keep_trailing_newline=True,
-        )
         modified_templates: list[template.Template] = []
+        render_manifest = manifest.RenderManifest.load(snap.paths.common / MANIFEST)
         try:
-            context = self.render_context(snap)
+            renderer = _Renderer(self, snap)
+            # process general templates
+            for tpl in self.template_files():
+                key = f"{tpl.location}/{tpl.dest_path()}"
+                with self.tracer.span("process_template", template=key) as span:
+                    modified = self._process_template(
+                        snap, renderer, tpl, render_manifest
+                    )
+                    span["modified"] = modified
+                if modified:
+                    modified_templates.append(tpl)
         except Exception as e:
-            logging.error("Failed to render context: %s", e)
+            logging.error("Failed to render templates: %s", e)
+            self._render_failed = True
             return modified_templates
-        # process general templates
-        for tpl in self.template_files():
-            if self._process_template(snap, env, tpl, context):
-                modified_templates.append(tpl)
+        finally:
+            render_manifest.save()
 
         return modified_templates
 
 
+class _Renderer:
+    """Rendering state, the jinja environment and contexts are built lazily."""
+
+    def __init__(self, manila_data: ManilaData, snap: Snap):
+        self.manila_data = manila_data
+        self.snap = snap
+        self.search_path = manila_data.templates_search_path(snap)
+        self.inputs = manila_data.render_inputs(snap)
+        self.fingerprint = manila_data.render_fingerprint(snap)
+
+    @functools.cached_property
+    def env(self) -> jinja2.Environment:
+        return self.manila_data.template_environment(self.snap)
+
+    @functools.cached_property
+    def context(self) -> typing.Mapping[str, typing.Mapping[str, str]]:
+        return self.manila_data.render_context(self.snap)
+
+
 class GenericManilaData(ManilaData[configuration.Configuration]):
     def config_type(self) -> typing.Type[configuration.Configuration]:
         return configuration.Configuration
+
+
+# end of the import of the hook entry point
+LOADED = time.perf_counter()
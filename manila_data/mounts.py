@@ -0,0 +1,100 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cleanup of the share mounts left behind by a previous daemon.
+
+manila-data mounts the shares it copies under its mount location and
+unmounts them once done. When the daemon dies in the middle of a copy, the
+mounts stay, and an unreachable server makes any later access to them hang.
+The leftover mounts are found from the mount table, without accessing them,
+and lazily detached.
+"""
+
+import ctypes
+import logging
+import os
+from pathlib import Path
+
+MOUNTINFO = Path("/proc/self/mountinfo")
+
+# umount2(2) flag detaching the mount even when busy
+_MNT_DETACH = 2
+
+
+def _unescape(field: str) -> str:
+    """Decode the octal escapes of a mountinfo field, such as \\040."""
+    return field.encode().decode("unicode_escape").encode("latin-1").decode()
+
+
+def mount_points(mountinfo: Path = MOUNTINFO) -> list[str]:
+    """Mount points of the mount table.
+
+    :param mountinfo: the mountinfo file to read
+    :type mountinfo: Path
+    :rtype: list[str]
+    """
+    return [
+        _unescape(line.split(" ", 5)[4]) for line in mountinfo.read_text().splitlines()
+    ]
+
+
+def mounts_under(path: Path, mountinfo: Path = MOUNTINFO) -> list[str]:
+    """Mount points below a directory, deepest first.
+
+    :param path: the directory
+    :type path: Path
+    :param mountinfo: the mountinfo file to read
+    :type mountinfo: Path
+    :rtype: list[str]
+    """
+    prefix = os.path.join(os.path.normpath(path), "")
+    found = {point for point in mount_points(mountinfo) if point.startswith(prefix)}
+    return sorted(found, key=lambda point: (point.count("/"), point), reverse=True)
+
+
+def lazy_unmount(path: str) -> None:
+    """Detach a mount, the way umount -l does.
+
+    :param path: the mount point
+    :type path: str
+    :raises OSError: when the mount cannot be detached
+    """
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.umount2(os.fsencode(path), _MNT_DETACH) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), path)
+
+
+def reap(path: Path, mountinfo: Path = MOUNTINFO) -> list[str]:
+    """Detach every mount left below a directory.
+
+    Failures are logged and skipped, the service is started regardless.
+
+    :param path: the mount location of the daemon
+    :type path: Path
+    :param mountinfo: the mountinfo file to read
+    :type mountinfo: Path
+    :return: the mount points detached
+    :rtype: list[str]
+    """
+    detached = []
+    for point in mounts_under(path, mountinfo):
+        logging.warning("Detaching leftover mount %s", point)
+        try:
+            lazy_unmount(point)
+        except OSError:
+            logging.warning("Failed to detach %s", point, exc_info=True)
+            continue
+        detached.append(point)
+    return detached
@@ -0,0 +1,119 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Progress of the copies run by the parallel copy engine.
+
+Every copy records its counters in a JSON file of the progress directory,
+which the metrics exporter reads. The files are only written while the
+directory exists, that is while the exporter is enabled, and the exporter
+removes the ones of finished copies once they are accounted for.
+
+Like the copy engine, this module must only depend on the standard library.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import time
+import typing
+from pathlib import Path
+
+# relative to the common path
+DIRECTORY = Path("lib/manila/copies")
+# Minimum delay between two writes of the progress of a copy.
+INTERVAL = 1.0
+
+
+class Job(typing.TypedDict):
+    """Progress of a copy."""
+
+    pid: int
+    # share roots of the copy, the paths of the copy outside of shares
+    source: str
+    destination: str
+    files: int
+    size: int
+    # wall clock times
+    started: float
+    updated: float
+    done: bool
+
+
+class ProgressFile:
+    """Progress file of a copy."""
+
+    def __init__(self, directory: Path, source: Path, destination: Path):
+        pid = os.getpid()
+        # a process may run several copies in a row
+        self.path = directory / f"{pid}-{time.monotonic_ns()}.json"
+        now = time.time()
+        self.job = Job(
+            pid=pid,
+            source=str(source),
+            destination=str(destination),
+            files=0,
+            size=0,
+            started=now,
+            updated=now,
+            done=False,
+        )
+        self._written = 0.0
+
+    def update(self, files: int, size: int, done: bool = False) -> None:
+        """Record the counters of the copy, at most once per interval.
+
+        :param files: number of files copied so far
+        :param size: number of bytes copied so far
+        :param done: whether the copy is over, always recorded
+        """
+        now = time.monotonic()
+        if not done and now - self._written < INTERVAL:
+            return
+        self._written = now
+        self.job["files"] = files
+        self.job["size"] = size
+        self.job["updated"] = time.time()
+        self.job["done"] = done
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=".", suffix=".tmp")
+        except FileNotFoundError:
+            # the exporter is disabled
+            return
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.job, f)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+def read_jobs(directory: Path) -> list[tuple[Path, Job]]:
+    """Read the progress of the copies recorded in a directory.
+
+    :param directory: the progress directory
+    :type directory: Path
+    :return: the progress files and their content
+    :rtype: list[tuple[Path, Job]]
+    """
+    jobs = []
+    for path in sorted(directory.glob("*.json")):
+        try:
+            jobs.append((path, typing.cast(Job, json.loads(path.read_text()))))
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError):
+            logging.warning("Ignoring unreadable progress file %s", path)
+    return jobs
@@ -0,0 +1,67 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Read back the configuration rendered by the hooks.
+
+Processes running outside of the hooks, such as the service wrapper or the
+copy engine, read the snap specific sections of the rendered manila.conf
+instead of querying and validating the whole snap configuration.
+"""
+
+import configparser
+import os
+from pathlib import Path
+
+MANILA_CONF = Path("etc/manila/manila.conf")
+
+
+def common() -> Path:
+    """The SNAP_COMMON path, read from the environment."""
+    return Path(os.environ.get("SNAP_COMMON", "/"))
+
+
+def manila_conf(common_path: Path | None = None) -> Path:
+    """Path of the rendered manila.conf.
+
+    :param common_path: the SNAP_COMMON path, read from the environment if unset
+    :type common_path: Path or None
+    :return: the path to manila.conf
+    :rtype: Path
+    """
+    if common_path is None:
+        common_path = common()
+    return common_path / MANILA_CONF
+
+
+def read_section(path: Path, section: str) -> dict[str, str]:
+    """Read a section of a rendered configuration file.
+
+    Missing files or sections are returned as an empty mapping, callers are
+    expected to fall back to their defaults.
+
+    :param path: the configuration file to read
+    :type path: Path
+    :param section: name of the section, DEFAULT is read like any other
+    :type section: str
+    :return: the options set in the section
+    :rtype: dict[str, str]
+    """
+    # do not merge [DEFAULT] into every other section
+    parser = configparser.ConfigParser(
+        interpolation=None, default_section="__snap_no_default__"
+    )
+    parser.read(path)
+    if not parser.has_section(section):
+        return {}
+    return dict(parser.items(section))
@@ -0,0 +1,187 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""CPU, I/O and memory limits of the service processes.
+
+The limits are applied by the service wrapper to itself before it starts the
+workers, which inherit them. Only the CPU pinning of each worker is applied
+in the worker process, right before it executes the service.
+
+Under strict confinement, raising the priority of the service needs the
+process-control interface. Memory is limited with snap quota groups instead,
+the service cannot write to its own cgroup.
+"""
+
+import ctypes
+import dataclasses
+import logging
+import os
+import platform
+import typing
+from pathlib import Path
+
+from . import rendered
+
+SECTION = "snap_resources"
+
+IoprioClass = typing.Literal["none", "realtime", "best-effort", "idle"]
+
+# values of the I/O scheduling classes, see ioprio_set(2)
+_IOPRIO_CLASSES = {"none": 0, "realtime": 1, "best-effort": 2, "idle": 3}
+_IOPRIO_CLASS_SHIFT = 13
+_IOPRIO_WHO_PROCESS = 1
+# ioprio_set has no libc wrapper, its number depends on the architecture
+_SYS_IOPRIO_SET = {
+    "x86_64": 251,
+    "aarch64": 30,
+    "riscv64": 30,
+    "ppc64le": 273,
+    "s390x": 282,
+    "armv7l": 314,
+    "armv8l": 314,
+}
+
+# interface allowing the service to raise its own CPU and I/O priority
+INTERFACE = "process-control"
+
+
+def parse_cpuset(value: str) -> set[int]:
+    """Parse a cpuset list, such as 0-3,8,10-11.
+
+    :param value: the cpuset list
+    :type value: str
+    :return: the CPUs of the list
+    :rtype: set[int]
+    :raises ValueError: when the list is not valid
+    """
+    cpus: set[int] = set()
+    for item in value.split(","):
+        start, sep, end = item.strip().partition("-")
+        first = int(start)
+        last = int(end) if sep else first
+        if first < 0 or last < first:
+            raise ValueError(f"invalid CPU range {item!r}")
+        cpus.update(range(first, last + 1))
+    return cpus
+
+
+def worker_cpus(cpus: typing.Collection[int], index: int, workers: int) -> set[int]:
+    """CPUs a worker is pinned to, when sharing cpus with the other workers.
+
+    The CPUs are split in contiguous slices of about the same size. With
+    more workers than CPUs, workers share CPUs in turn.
+
+    :param cpus: the CPUs of all the workers
+    :param index: index of the worker
+    :param workers: number of workers
+    :return: the CPUs of the worker
+    :rtype: set[int]
+    """
+    ordered = sorted(cpus)
+    if workers >= len(ordered):
+        return {ordered[index % len(ordered)]}
+    start = index * len(ordered) // workers
+    end = (index + 1) * len(ordered) // workers
+    return set(ordered[start:end])
+
+
+@dataclasses.dataclass(frozen=True)
+class ResourceLimits:
+    """Limits of the service processes."""
+
+    cpus: frozenset[int] | None = None
+    pin_workers: bool = False
+    nice: int = 0
+    ioprio_class: IoprioClass = "none"
+    ioprio_level: int = 4
+
+    @classmethod
+    def from_config(cls, path: Path) -> "ResourceLimits":
+        """Load the limits rendered into the [snap_resources] section.
+
+        :param path: the rendered manila.conf
+        :type path: Path
+        :return: the resource limits
+        :rtype: ResourceLimits
+        """
+        section = rendered.read_section(path, SECTION)
+        cpuset = section.get("cpuset")
+        return cls(
+            cpus=frozenset(parse_cpuset(cpuset)) if cpuset else None,
+            pin_workers=section.get("pin_workers", "False") == "True",
+            nice=int(section.get("nice", cls.nice)),
+            ioprio_class=typing.cast(
+                IoprioClass, section.get("ioprio_class", cls.ioprio_class)
+            ),
+            ioprio_level=int(section.get("ioprio_level", cls.ioprio_level)),
+        )
+
+    def worker_cpus(self, index: int, workers: int) -> set[int] | None:
+        """CPUs a worker is pinned to, None when not pinned."""
+        if not self.pin_workers or not self.cpus:
+            return None
+        return worker_cpus(self.cpus, index, workers)
+
+    def privileged(self) -> list[str]:
+        """Options raising the priority of the service, which need INTERFACE."""
+        options = []
+        if self.nice < 0:
+            options.append("resources.nice")
+        if self.ioprio_class == "realtime":
+            options.append("resources.ioprio-class")
+        return options
+
+
+def set_ioprio(ioprio_class: IoprioClass, level: int, pid: int = 0) -> None:
+    """Set the I/O scheduling class and level of a process.
+
+    :param ioprio_class: the scheduling class
+    :param level: the level within the class, from 0 (highest) to 7
+    :param pid: the process, 0 for the calling process
+    :raises OSError: when the priority cannot be set
+    """
+    nr = _SYS_IOPRIO_SET.get(platform.machine())
+    if nr is None:
+        raise OSError(f"ioprio_set is not supported on {platform.machine()}")
+    value = (_IOPRIO_CLASSES[ioprio_class] << _IOPRIO_CLASS_SHIFT) | level
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.syscall(nr, _IOPRIO_WHO_PROCESS, pid, value) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def apply(limits: ResourceLimits) -> None:
+    """Apply the limits to the calling process, which children inherit.
+
+    Limits that cannot be applied are logged and skipped, the service is
+    started regardless.
+
+    :param limits: the limits to apply
+    :type limits: ResourceLimits
+    """
+    if limits.cpus:
+        try:
+            os.sched_setaffinity(0, limits.cpus)
+        except OSError:
+            logging.warning("Failed to set the CPU affinity", exc_info=True)
+    if limits.nice:
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, limits.nice)
+        except OSError:
+            logging.warning("Failed to set the nice level", exc_info=True)
+    if limits.ioprio_class != "none":
+        try:
+            set_ioprio(limits.ioprio_class, limits.ioprio_level)
+        except OSError:
+            logging.warning("Failed to set the I/O priority", exc_info=True)
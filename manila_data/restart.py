@@ -0,0 +1,166 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Restarts deferred until the copies in progress are over.
+
+With deferred restarts, the configure hook records the services to restart
+in a pending file instead of restarting them while they copy data. The
+restart coordinator service restarts them once their copies drained, or
+when the deadline of the oldest request passed. The services keep taking
+new copies from the message queue meanwhile, the deadline bounds the wait.
+The pending state is mirrored into the pending-restart snap option, shown
+by snap get.
+"""
+
+import contextlib
+import datetime
+import fcntl
+import json
+import logging
+import os
+import time
+import typing
+from pathlib import Path
+
+from snaphelpers import Snap, SnapCtlError
+
+from . import manifest
+
+# relative to the common path
+PENDING_FILE = Path("restart-pending.json")
+# snap option mirroring the pending restart
+OPTION = "pending-restart"
+# Delay between two checks of the copies in progress.
+POLL_INTERVAL = 10.0
+
+
+class Pending(typing.TypedDict):
+    """Services waiting for a restart."""
+
+    services: list[str]
+    # wall clock times
+    requested: float
+    deadline: float
+
+
+@contextlib.contextmanager
+def locked(path: Path) -> typing.Iterator[None]:
+    """Serialize the updates of the pending file, by the hook and coordinator.
+
+    :param path: the pending file
+    :type path: Path
+    """
+    fd = os.open(path.with_name(path.name + ".lock"), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def read(path: Path) -> Pending | None:
+    """Read the pending restart.
+
+    :param path: the pending file
+    :type path: Path
+    :return: the pending restart, None when there is none
+    :rtype: Pending or None
+    """
+    try:
+        return typing.cast(Pending, json.loads(path.read_text()))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logging.warning("Ignoring unreadable pending restart %s", path)
+        return None
+
+
+def defer(path: Path, service: str, delay: float) -> Pending:
+    """Record a service to restart.
+
+    The deadline of a restart already pending is kept, new requests do not
+    push it back.
+
+    :param path: the pending file
+    :type path: Path
+    :param service: name of the service
+    :type service: str
+    :param delay: seconds after which the service is restarted regardless
+    :type delay: float
+    :return: the pending restart
+    :rtype: Pending
+    """
+    with locked(path):
+        pending = read(path)
+        if pending is None:
+            now = time.time()
+            pending = Pending(services=[], requested=now, deadline=now + delay)
+        if service not in pending["services"]:
+            pending["services"].append(service)
+        manifest.write_atomic(path, json.dumps(pending), 0o600)
+    return pending
+
+
+def complete(path: Path, services: typing.Collection[str]) -> Pending | None:
+    """Remove restarted services from the pending restart.
+
+    :param path: the pending file
+    :type path: Path
+    :param services: names of the restarted services
+    :return: the restart still pending, None when there is none
+    :rtype: Pending or None
+    """
+    with locked(path):
+        pending = read(path)
+        if pending is None:
+            return None
+        pending["services"] = [s for s in pending["services"] if s not in services]
+        if not pending["services"]:
+            path.unlink(missing_ok=True)
+            return None
+        manifest.write_atomic(path, json.dumps(pending), 0o600)
+    return pending
+
+
+def _isoformat(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat(
+        timespec="seconds"
+    )
+
+
+def publish(snap: Snap, pending: Pending | None) -> None:
+    """Mirror the pending restart into the snap configuration.
+
+    Failures are logged, the pending file remains the reference.
+
+    :param snap: the snap context
+    :type snap: Snap
+    :param pending: the pending restart, None when there is none
+    :type pending: Pending or None
+    """
+    try:
+        if pending is None:
+            snap.config.unset([OPTION])
+        else:
+            snap.config.set(
+                {
+                    OPTION: {
+                        "services": ",".join(pending["services"]),
+                        "requested": _isoformat(pending["requested"]),
+                        "deadline": _isoformat(pending["deadline"]),
+                    }
+                }
+            )
+    except SnapCtlError:
+        logging.warning("Failed to publish the pending restart", exc_info=True)
@@ -0,0 +1,47 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compile the bundled templates at build time.
+
+The hooks then load the compiled modules instead of parsing the templates on
+every run.
+"""
+
+import argparse
+import sys
+import typing
+from pathlib import Path
+
+from manila_data import manila_data
+
+
+def main(argv: typing.Sequence[str] | None = None) -> int:
+    """Compile the templates shipped with the snap."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--target",
+        type=Path,
+        help="directory receiving the compiled templates "
+        "(default: next to the installed package)",
+    )
+    args = parser.parse_args(argv)
+
+    data = manila_data.GenericManilaData()
+    target = args.target or data.compiled_templates_path()
+    if target is None:
+        print("Cannot determine the compiled templates directory", file=sys.stderr)
+        return 1
+    data.compile_templates(target)
+    print(f"Compiled templates into {target}")
+    return 0
@@ -0,0 +1,103 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""cp compatible front end of the parallel copy engine.
+
+Only the subset of cp used by manila is understood, any other invocation is
+handed over to the real cp unchanged.
+"""
+
+import os
+import sys
+import typing
+from pathlib import Path
+
+from manila_data import checksum, copier, delta, journal, progress, rendered, throttle
+
+REAL_CP = "/usr/bin/cp"
+
+_PRESERVE_FLAGS = {"-p", "-a", "--archive"}
+_RECURSIVE_FLAGS = {"-r", "-R", "--recursive", "-a", "--archive"}
+_IGNORED_FLAGS = {"-P", "-d", "--no-dereference", "-f", "--force"}
+
+
+class CpArgs(typing.NamedTuple):
+    sources: list[Path]
+    dest: Path
+    recursive: bool
+    preserve: bool
+
+
+def parse_cp_args(argv: typing.Sequence[str]) -> CpArgs | None:
+    """Parse cp arguments, None when they are not supported by the engine."""
+    paths: list[str] = []
+    recursive = preserve = False
+    options_done = False
+    for arg in argv:
+        if options_done or not arg.startswith("-") or arg == "-":
+            paths.append(arg)
+        elif arg == "--":
+            options_done = True
+        elif arg.startswith("--preserve"):
+            preserve = True
+        elif arg in _PRESERVE_FLAGS | _RECURSIVE_FLAGS | _IGNORED_FLAGS:
+            preserve = preserve or arg in _PRESERVE_FLAGS
+            recursive = recursive or arg in _RECURSIVE_FLAGS
+        else:
+            return None
+    if len(paths) < 2:
+        return None
+    return CpArgs(
+        sources=[Path(p) for p in paths[:-1]],
+        dest=Path(paths[-1]),
+        recursive=recursive,
+        preserve=preserve,
+    )
+
+
+def main(argv: typing.Sequence[str] | None = None) -> int:
+    """Copy files the way cp does, through the parallel copy engine."""
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parse_cp_args(argv)
+    if args is None or (
+        not args.recursive and any(src.is_dir() for src in args.sources)
+    ):
+        os.execv(REAL_CP, ["cp", *argv])
+
+    options = copier.CopyOptions.from_config(
+        rendered.manila_conf(),
+        preserve=args.preserve,
+        digest_cache=rendered.common() / checksum.DIGEST_CACHE,
+        progress_dir=rendered.common() / progress.DIRECTORY,
+        journal_dir=rendered.common() / journal.DIRECTORY,
+        index_dir=rendered.common() / delta.DIRECTORY,
+        bandwidth=throttle.ThrottleOptions(
+            rendered.manila_conf(), rendered.common() / throttle.DIRECTORY
+        ),
+    )
+    engine = copier.Copier(options)
+    dest_is_dir = args.dest.is_dir()
+    if len(args.sources) > 1 and not dest_is_dir:
+        print(f"cp: target '{args.dest}' is not a directory", file=sys.stderr)
+        return 1
+
+    for src in args.sources:
+        dest = args.dest / src.name if dest_is_dir else args.dest
+        try:
+            engine.copy(src, dest)
+        except copier.CopyError as e:
+            print(f"cp: {e}", file=sys.stderr)
+            return 1
+    return 0
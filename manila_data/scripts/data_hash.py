@@ -0,0 +1,63 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""sha256sum compatible front end of the data verifier.
+
+manila only compares the digests of the source and the destination of a
+copy, so large files may be hashed with a faster algorithm or sampled as
+configured, as long as both sides are hashed the same way. The files are
+hashed one after the other: manila hashes a single file per call.
+"""
+
+import os
+import sys
+import typing
+from pathlib import Path
+
+from manila_data import checksum, rendered
+
+REAL_SHA256SUM = "/usr/bin/sha256sum"
+
+
+def _hash(
+    path: str, options: checksum.VerifyOptions, cache_path: Path
+) -> tuple[str | None, str | None]:
+    """Return the digest of path, or the error preventing to compute it."""
+    try:
+        cache = checksum.DigestCache(cache_path) if cache_path.exists() else None
+        return checksum.digest(path, options, cache), None
+    except OSError as e:
+        return None, e.strerror
+
+
+def main(argv: typing.Sequence[str] | None = None) -> int:
+    """Print the digests of files the way sha256sum does."""
+    if argv is None:
+        argv = sys.argv[1:]
+    conf = rendered.manila_conf()
+    options = checksum.VerifyOptions.from_config(conf)
+    if options.mode == "off" or not argv or any(a.startswith("-") for a in argv):
+        os.execv(REAL_SHA256SUM, ["sha256sum", *argv])
+
+    cache_path = rendered.common() / checksum.DIGEST_CACHE
+    results = [_hash(path, options, cache_path) for path in argv]
+
+    status = 0
+    for path, (hexdigest, err) in zip(argv, results):
+        if hexdigest is None:
+            print(f"sha256sum: {path}: {err}", file=sys.stderr)
+            status = 1
+        else:
+            print(f"{hexdigest}  {path}")
+    return status
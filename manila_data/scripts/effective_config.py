@@ -0,0 +1,54 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Print the configuration values applied by the configure hook.
+
+Each option is printed with its source: set with snap set, by the selected
+settings.profile, or left to its default. Credentials are masked.
+"""
+
+import argparse
+import json
+import sys
+import typing
+
+from manila_data import manila_data, rendered
+
+
+def main(argv: typing.Sequence[str] | None = None) -> int:
+    """Print the effective value of every option."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", action="store_true", help="print as JSON")
+    parser.add_argument(
+        "--source",
+        choices=["snap set", "profile", "default"],
+        help="only print the options of this source",
+    )
+    args = parser.parse_args(argv)
+
+    path = rendered.common() / manila_data.EFFECTIVE_CONFIG
+    try:
+        options = json.loads(path.read_text())
+    except FileNotFoundError:
+        print("The configuration has not been applied yet", file=sys.stderr)
+        return 1
+    if args.source:
+        options = {k: v for k, v in options.items() if v["source"] == args.source}
+
+    if args.json:
+        print(json.dumps(options, indent=2))
+        return 0
+    for key, option in options.items():
+        print(f"{key} = {json.dumps(option['value'])}  ({option['source']})")
+    return 0
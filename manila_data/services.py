@@ -12,19 +12,42 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import configparser
 import functools
 import logging
-import subprocess
+import os
+import shutil
 import sys
+import time
 import typing
 from pathlib import Path
 
-from snaphelpers import Snap
+from snaphelpers import Snap, SnapCtl
 
-from . import log
+from . import (
+    checksum,
+    copier,
+    exporter,
+    log,
+    mounts,
+    progress,
+    rendered,
+    resources,
+    restart,
+    supervisor,
+    throttle,
+)
 
 _SERVICES: list[typing.Type["OpenStackService"]] = []
 
+# manila.conf section holding the options of the service wrapper
+SECTION = "snap_service"
+
+LaunchMode = typing.Literal["auto", "exec", "supervise"]
+
+# What a service needs to pick up a configuration change.
+Action = typing.Literal["restart", "reload"]
+
 
 def entry_point(service_class):
     """Entry point wrapper for services."""
@@ -43,6 +66,11 @@ class OpenStackService:
     # only fully specified configuration files will trigger a restart
     # on modification
     configuration_files: typing.Sequence[Path] = []
+    # "section.option" of the configuration files applied on reload (SIGHUP)
+    reloadable_options: typing.Collection[str] = frozenset()
+    # "section.option" read by the service helpers on every use, a change
+    # does not need any action
+    live_options: typing.Collection[str] = frozenset()
 
     name: str
     executable: Path
@@ -52,17 +80,48 @@ class OpenStackService:
         super().__init_subclass__(**kwargs)
         _SERVICES.append(cls)
 
+    @classmethod
+    def action(
+        cls, snap: Snap, changes: typing.Mapping[Path, typing.Collection[str] | None]
+    ) -> Action | None:
+        """Action needed for the service to apply configuration changes.
+
+        :param snap: the snap context
+        :type snap: Snap
+        :param changes: changed options of the rendered files, keyed by
+            path, None when the changed options are not known
+        :return: restart, reload or None when no action is needed
+        """
+        action: Action | None = None
+        for conf_file in cls.configuration_files:
+            path = snap.paths.common / conf_file
+            if path not in changes:
+                continue
+            options = changes[path]
+            if options is None:
+                return "restart"
+            options = set(options).difference(cls.live_options)
+            if options.difference(cls.reloadable_options):
+                return "restart"
+            if options:
+                action = "reload"
+        return action
+
     def run(self, snap: Snap) -> int:
         """Runs the OpenStack service.
 
-        Invoked when this service is started.
+        Invoked when this service is started. A single worker replaces the
+        wrapper process, several workers are run under supervision.
 
         :param snap: the snap context
         :type snap: Snap
         :return: exit code of the process
         :rtype: int
         """
-        log.setup_logging(snap.paths.common / f"{self.executable.name}-{snap.name}.log")
+        log.setup_logging(
+            snap.paths.common / f"{self.executable.name}-{snap.instance_name}.log",
+            self.debug(snap),
+        )
 
         args = []
         for conf_file in self.configuration_files:
@@ -73,23 +132,456 @@ class OpenStackService:
                 ]
             )
 
+        self.prepare(snap)
         executable = snap.paths.snap / self.executable
 
         cmd = [str(executable)]
         cmd.extend(args)
-        completed_process = subprocess.run(cmd)
+        env = self.environment(snap)
+        limits = self.resource_limits(snap)
+        if limits.privileged():
+            self.check_limits(snap)
+        resources.apply(limits)
+        count = self.workers(snap)
+        workers = []
+        for index in range(count):
+            cpus = limits.worker_cpus(index, count)
+            workers.append(
+                supervisor.Worker(
+                    index,
+                    cmd + self.worker_args(snap, index),
+                    self.worker_environment(snap, index, env),
+                    setup=(
+                        functools.partial(os.sched_setaffinity, 0, cpus)
+                        if cpus
+                        else None
+                    ),
+                )
+            )
+
+        launch = self.launch(snap)
+        if launch == "exec" and count > 1:
+            logging.warning("Cannot exec %d workers, supervising them", count)
+        elif launch == "exec" or (launch == "auto" and count == 1):
+            [worker] = workers
+            self.exec_in_place(worker)
+
+        returncode = supervisor.Supervisor(
+            workers, stop_timeout=self.drain_timeout(snap)
+        ).run()
+
+        logging.info(f"Exiting with code {returncode}")
+        return returncode
+
+    def exec_in_place(self, worker: supervisor.Worker) -> typing.NoReturn:
+        """Replace the current process with the service executable.
+
+        The service then receives the signals from snapd directly and the
+        memory of the wrapper is released.
+
+        :param worker: the worker to execute
+        :type worker: Worker
+        """
+        logging.info("Executing %s", worker.cmd[0])
+        if worker.setup is not None:
+            worker.setup()
+        log.stop_logging()
+        os.execve(worker.cmd[0], worker.cmd, worker.env or os.environ)
+
+    def prepare(self, snap: Snap) -> None:
+        """Prepare the host before the service processes are started.
+
+        :param snap: the snap context
+        :type snap: Snap
+        """
+
+    def restart_delay(self, snap: Snap) -> float | None:
+        """How long a restart may wait for the copies in progress.
+
+        :param snap: the snap context
+        :type snap: Snap
+        :return: the delay in seconds, None when restarts are not deferred
+        :rtype: float or None
+        """
+        return None
+
+    def busy(self, snap: Snap) -> bool:
+        """Whether a restart would interrupt copies in progress.
+
+        :param snap: the snap context
+        :type snap: Snap
+        :rtype: bool
+        """
+        return False
 
-        logging.info(f"Exiting with code {completed_process.returncode}")
-        return completed_process.returncode
+    def launch(self, snap: Snap) -> LaunchMode:
+        """How the service executable is launched.
+
+        exec replaces the wrapper with the executable, supervise keeps the
+        wrapper running to restart the workers, auto only supervises when
+        running more than one worker.
+
+        :param snap: the snap context
+        :type snap: Snap
+        :rtype: str
+        """
+        return "auto"
+
+    def drain_timeout(self, snap: Snap) -> float:
+        """Delay given to the supervised workers to exit when stopping.
+
+        :param snap: the snap context
+        :type snap: Snap
+        :return: the delay in seconds
+        :rtype: float
+        """
+        return supervisor.STOP_TIMEOUT
+
+    def debug(self, snap: Snap) -> bool:
+        """Whether the wrapper records debug messages.
+
+        Follows the debug option rendered into manila.conf.
+
+        :param snap: the snap context
+        :type snap: Snap
+        :rtype: bool
+        """
+        section = rendered.read_section(
+            rendered.manila_conf(snap.paths.common), "DEFAULT"
+        )
+        return section.get("debug") == "True"
+
+    def workers(self, snap: Snap) -> int:
+        """Number of worker processes to run.
+
+        :param snap: the snap context
+        :type snap: Snap
+        :return: the number of workers
+        :rtype: int
+        """
+        return 1
+
+    def resource_limits(self, snap: Snap) -> resources.ResourceLimits:
+        """Limits applied to the service processes.
+
+        :param snap: the snap context
+        :type snap: Snap
+        :return: the resource limits
+        :rtype: ResourceLimits
+        """
+        return resources.ResourceLimits()
+
+    def check_limits(self, snap: Snap) -> None:
+        """Report the resource limits the confinement prevents from applying.
+
+        The service only logs the limits it fails to apply, the snap health
+        names the interface to connect instead. Checked by the configure hook
+        when the limits change, and when the service starts once connected.
+
+        :param snap: the snap context
+        :type snap: Snap
+        """
+        options = self.resource_limits(snap).privileged()
+        if options and not SnapCtl(env=snap.environ).is_connected(resources.INTERFACE):
+            message = f"connect {resources.INTERFACE} for {', '.join(options)}"
+            logging.warning("Cannot apply the resource limits: %s", message)
+            snap.health.blocked(message, code=resources.INTERFACE)
+        else:
+            snap.health.okay()
+
+    def worker_args(self, snap: Snap, index: int) -> list[str]:
+        """Extra arguments of a worker process.
+
+        :param snap: the snap context
+        :type snap: Snap
+        :param index: index of the worker
+        :type index: int
+        :return: the arguments appended to the command
+        :rtype: list[str]
+        """
+        return []
+
+    def worker_environment(
+        self, snap: Snap, index: int, env: dict[str, str]
+    ) -> dict[str, str]:
+        """Environment of a worker process.
+
+        :param snap: the snap context
+        :type snap: Snap
+        :param index: index of the worker
+        :type index: int
+        :param env: the environment of the service
+        :type env: dict[str, str]
+        :return: the environment of the worker
+        :rtype: dict[str, str]
+        """
+        return env
+
+    def environment(self, snap: Snap) -> dict[str, str]:
+        """Environment variables the service executable runs with.
+
+        :param snap: the snap context
+        :type snap: Snap
+        :return: the environment of the service process
+        :rtype: dict[str, str]
+        """
+        return dict(os.environ)
 
 
 class ManilaDataService(OpenStackService):
     configuration_files = [
         Path("etc/manila/manila.conf"),
+        Path("etc/manila/data-mounts.conf"),
         Path("etc/manila/rootwrap.conf"),
     ]
+    ceph_conf = Path("etc/ceph/ceph.conf")
+    # manila.service.serve launches the service with restart_method="mutate",
+    # SIGHUP updates the mutable options in place
+    reloadable_options = frozenset({"DEFAULT.debug"})
+    live_options = frozenset(
+        {
+            f"{copier.SECTION}.workers",
+            f"{copier.SECTION}.mode",
+            f"{throttle.SECTION}.bandwidth_limit",
+            f"{throttle.SECTION}.job_bandwidth_limit",
+            f"{checksum.SECTION}.algorithm",
+            # only read by the exporter, copies record their progress while
+            # its directory exists
+            f"{exporter.SECTION}.enabled",
+            f"{exporter.SECTION}.port",
+            # read by the configure hook and the restart coordinator
+            f"{SECTION}.restart",
+            f"{SECTION}.restart_deadline",
+        }
+    )
     name = "manila-data"
-    executable = Path("usr/bin/manila-data")
+    executable = Path("bin/manila-data")
+    copy_executable = Path("bin/manila-data-copy")
+    libexec = Path("usr/libexec/manila-data")
+    # relative to the scratch location
+    mounts_dir = Path("mnt")
+    locks_dir = Path("tmp")
+    # per worker state
+    workers_dir = Path("workers")
+
+    def workers(self, snap: Snap) -> int:
+        """Number of workers, as rendered into manila.conf."""
+        section = rendered.read_section(
+            rendered.manila_conf(snap.paths.common), SECTION
+        )
+        return int(section.get("workers", 1))
+
+    def launch(self, snap: Snap) -> LaunchMode:
+        """Launch mode rendered into manila.conf."""
+        section = rendered.read_section(
+            rendered.manila_conf(snap.paths.common), SECTION
+        )
+        return typing.cast(LaunchMode, section.get("launch", "auto"))
+
+    def drain_timeout(self, snap: Snap) -> float:
+        """Drain timeout rendered into manila.conf."""
+        section = rendered.read_section(
+            rendered.manila_conf(snap.paths.common), SECTION
+        )
+        return float(section.get("drain_timeout", supervisor.STOP_TIMEOUT))
+
+    def resource_limits(self, snap: Snap) -> resources.ResourceLimits:
+        """Limits rendered into manila.conf."""
+        return resources.ResourceLimits.from_config(
+            rendered.manila_conf(snap.paths.common)
+        )
+
+    def scratch_path(self, snap: Snap) -> Path:
+        """Where shares are mounted and locks taken, as rendered into manila.conf."""
+        section = rendered.read_section(
+            rendered.manila_conf(snap.paths.common), SECTION
+        )
+        default = snap.paths.common / "lib/manila"
+        return Path(section.get("scratch_path", default))
+
+    def restart_delay(self, snap: Snap) -> float | None:
+        """Restart deadline rendered into manila.conf, when deferred."""
+        section = rendered.read_section(
+            rendered.manila_conf(snap.paths.common), SECTION
+        )
+        if section.get("restart", "immediate") != "deferred":
+            return None
+        return float(section.get("restart_deadline", 3600))
+
+    def busy(self, snap: Snap) -> bool:
+        """Whether shares are mounted for copies, or the copy engine runs."""
+        try:
+            if mounts.mounts_under(self.scratch_path(snap) / self.mounts_dir):
+                return True
+        except OSError:
+            logging.warning("Failed to read the mount table", exc_info=True)
+        return bool(exporter.find_processes(snap.paths.snap / self.copy_executable))
+
+    def prepare(self, snap: Snap) -> None:
+        """Create the scratch directories, detach the mounts left behind.
+
+        A pending restart of the service is complete once it starts again.
+        """
+        scratch_path = self.scratch_path(snap)
+        for directory in (self.mounts_dir, self.locks_dir):
+            (scratch_path / directory).mkdir(mode=0o750, parents=True, exist_ok=True)
+        try:
+            mounts.reap(scratch_path / self.mounts_dir)
+        except OSError:
+            logging.warning("Failed to read the mount table", exc_info=True)
+        pending_file = snap.paths.common / restart.PENDING_FILE
+        pending = restart.read(pending_file)
+        if pending is not None and self.name in pending["services"]:
+            restart.publish(snap, restart.complete(pending_file, [self.name]))
+
+    def worker_dir(self, snap: Snap, index: int) -> Path:
+        """Private directory of a worker, holding its locks and temp files."""
+        return self.scratch_path(snap) / self.workers_dir / str(index)
+
+    def worker_args(self, snap: Snap, index: int) -> list[str]:
+        """Point the worker to its own lock directory.
+
+        The option is set in an extra configuration file, later files take
+        precedence over the ones rendered by the hooks.
+        """
+        worker_dir = self.worker_dir(snap, index)
+        for name in ("lock", "tmp"):
+            (worker_dir / name).mkdir(mode=0o750, parents=True, exist_ok=True)
+        parser = configparser.ConfigParser(interpolation=None)
+        parser["oslo_concurrency"] = {"lock_path": str(worker_dir / "lock")}
+        worker_conf = worker_dir / "worker.conf"
+        with worker_conf.open("w") as f:
+            parser.write(f)
+        return ["--config-file", str(worker_conf)]
+
+    def worker_environment(
+        self, snap: Snap, index: int, env: dict[str, str]
+    ) -> dict[str, str]:
+        """Give the worker its own temporary directory."""
+        return {**env, "TMPDIR": str(self.worker_dir(snap, index) / "tmp")}
+
+    def environment(self, snap: Snap) -> dict[str, str]:
+        """Point to the snap ceph.conf, put the enabled command shims in PATH.
+
+        The rootwrap mode and enabled shims are passed on to the sudo and
+        command shims, which are run too often to read manila.conf.
+        """
+        env = super().environment(snap)
+        manila_conf = rendered.manila_conf(snap.paths.common)
+        engine = rendered.read_section(manila_conf, copier.SECTION).get("engine", "cp")
+        verify = checksum.VerifyOptions.from_config(manila_conf).mode
+        # ceph tools would otherwise look for the host /etc/ceph/ceph.conf
+        env["CEPH_CONF"] = str(snap.paths.common / self.ceph_conf)
+        env["MANILA_DATA_COPY_ENGINE"] = engine
+        env["MANILA_DATA_VERIFY"] = verify
+        # read by the sudo shim on every privileged command
+        service = rendered.read_section(manila_conf, SECTION)
+        env["MANILA_DATA_ROOTWRAP"] = service.get("rootwrap", "rootwrap")
+        if engine == "parallel" or verify != "off":
+            env["PATH"] = os.pathsep.join(
+                [str(snap.paths.snap / self.libexec), env.get("PATH", os.defpath)]
+            )
+        return env
+
+
+class MetricsExporterService(OpenStackService):
+    """OpenMetrics exporter of the manila-data daemon."""
+
+    configuration_files = [rendered.MANILA_CONF]
+    name = "manila-data-exporter"
+    executable = Path("bin/manila-data-exporter")
+
+    @classmethod
+    def action(
+        cls, snap: Snap, changes: typing.Mapping[Path, typing.Collection[str] | None]
+    ) -> Action | None:
+        """Only restart on changes of the exporter options."""
+        path = rendered.manila_conf(snap.paths.common)
+        if path not in changes:
+            return None
+        options = changes[path]
+        if options is None or any(
+            option == "DEFAULT.debug" or option.startswith(f"{exporter.SECTION}.")
+            for option in options
+        ):
+            return "restart"
+        return None
+
+    def run(self, snap: Snap) -> int:
+        """Serve the metrics until stopped, exit at once when disabled.
+
+        :param snap: the snap context
+        :type snap: Snap
+        :return: exit code of the process
+        :rtype: int
+        """
+        log.setup_logging(
+            snap.paths.common / f"{self.executable.name}-{snap.instance_name}.log",
+            self.debug(snap),
+        )
+        options = exporter.ExporterOptions.from_config(
+            rendered.manila_conf(snap.paths.common)
+        )
+        progress_dir = snap.paths.common / progress.DIRECTORY
+        if not options.enabled:
+            logging.info("Metrics exporter disabled")
+            # stops the copies from recording their progress
+            shutil.rmtree(progress_dir, ignore_errors=True)
+            return 0
+
+        progress_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        collector = exporter.Collector(
+            snap.paths.snap / ManilaDataService.executable, progress_dir
+        )
+        server = exporter.make_server(options, collector)
+        logging.info("Serving metrics on %s:%d", options.address, options.port)
+        server.serve_forever()
+        return 0
+
+
+class RestartCoordinatorService(OpenStackService):
+    """Restart the services whose restart was deferred, once they drained."""
+
+    name = "manila-data-restart"
+    executable = Path("bin/manila-data-restart")
+
+    def run(self, snap: Snap) -> int:
+        """Wait for the services to drain or the deadline, then restart them.
+
+        Exits at once when no restart is pending.
+
+        :param snap: the snap context
+        :type snap: Snap
+        :return: exit code of the process
+        :rtype: int
+        """
+        log.setup_logging(
+            snap.paths.common / f"{self.executable.name}-{snap.instance_name}.log",
+            self.debug(snap),
+        )
+        service_classes = {cls.name: cls for cls in services()}
+        pending_file = snap.paths.common / restart.PENDING_FILE
+        while (pending := restart.read(pending_file)) is not None:
+            busy = [
+                name
+                for name in pending["services"]
+                if name in service_classes and service_classes[name]().busy(snap)
+            ]
+            if busy and time.time() < pending["deadline"]:
+                time.sleep(restart.POLL_INTERVAL)
+                continue
+            if busy:
+                logging.warning(
+                    "Restart deadline passed, interrupting %s", ", ".join(busy)
+                )
+            snap_services = snap.services.list()
+            for name in pending["services"]:
+                logging.info("Restarting %s", name)
+                snap_services[f"{snap.instance_name}.{name}"].restart()
+            restart.publish(snap, restart.complete(pending_file, pending["services"]))
+        return 0
 
 
 manila_data = functools.partial(entry_point, ManilaDataService)
+manila_data_exporter = functools.partial(entry_point, MetricsExporterService)
+manila_data_restart = functools.partial(entry_point, RestartCoordinatorService)
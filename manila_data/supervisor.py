@@ -0,0 +1,201 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Supervision of the worker processes of a service.
+
+The supervisor starts every worker, restarts the ones exiting unexpectedly
+with an exponential backoff and stops them all when asked to. Signals are
+handled from the main loop through a wakeup pipe, the signal handlers
+themselves do nothing.
+"""
+
+import dataclasses
+import logging
+import os
+import select
+import signal
+import subprocess
+import time
+import typing
+
+# Delay before restarting a worker, doubled on every consecutive crash.
+BACKOFF_INITIAL = 1.0
+BACKOFF_MAX = 60.0
+# A worker running for this long is considered healthy again.
+STABLE_AFTER = 60.0
+# Delay given to the workers to drain and exit before they are killed.
+STOP_TIMEOUT = 30.0
+
+# Signals requesting the workers to stop.
+STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+# Signals forwarded as is to the workers: reload and oslo reports.
+FORWARD_SIGNALS = (signal.SIGHUP, signal.SIGUSR1, signal.SIGUSR2)
+
+
+@dataclasses.dataclass
+class Worker:
+    """A worker process and its restart state."""
+
+    index: int
+    cmd: list[str]
+    env: dict[str, str] | None = None
+    # run in the worker process before executing the command
+    setup: typing.Callable[[], None] | None = None
+    process: subprocess.Popen | None = None
+    started: float = 0.0
+    # consecutive crashes, reset once the worker ran long enough
+    crashes: int = 0
+    # monotonic time at which the worker is due to start
+    start_at: float = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+
+class Supervisor:
+    """Run and supervise a set of worker processes."""
+
+    def __init__(
+        self,
+        workers: typing.Sequence[Worker],
+        backoff_initial: float = BACKOFF_INITIAL,
+        backoff_max: float = BACKOFF_MAX,
+        stable_after: float = STABLE_AFTER,
+        stop_timeout: float = STOP_TIMEOUT,
+    ):
+        self.workers = list(workers)
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.stop_timeout = stop_timeout
+        self._stop_deadline: float | None = None
+
+    def run(self) -> int:
+        """Run the workers until a stop signal is received.
+
+        :return: 0 when all the workers exited cleanly on stop, 1 otherwise
+        :rtype: int
+        """
+        rfd, wfd = os.pipe()
+        for fd in (rfd, wfd):
+            os.set_blocking(fd, False)
+        signals = (*STOP_SIGNALS, *FORWARD_SIGNALS, signal.SIGCHLD)
+        previous_handlers = {
+            signum: signal.signal(signum, lambda signum, frame: None)
+            for signum in signals
+        }
+        previous_wakeup_fd = signal.set_wakeup_fd(wfd)
+        try:
+            return self._loop(rfd)
+        finally:
+            signal.set_wakeup_fd(previous_wakeup_fd)
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+            os.close(rfd)
+            os.close(wfd)
+
+    def stop(self) -> None:
+        """Ask all the workers to stop."""
+        if self._stop_deadline is not None:
+            return
+        logging.info("Stopping %d workers", len(self.workers))
+        self._stop_deadline = time.monotonic() + self.stop_timeout
+        self._signal_workers(signal.SIGTERM)
+
+    def _loop(self, rfd: int) -> int:
+        clean = True
+        while True:
+            now = time.monotonic()
+            timeout: float | None
+            for worker in self.workers:
+                if worker.process is not None and worker.process.poll() is not None:
+                    clean = self._reap(worker, now) and clean
+
+            if self._stop_deadline is not None:
+                if not any(worker.running for worker in self.workers):
+                    return 0 if clean else 1
+                if now >= self._stop_deadline:
+                    logging.warning("Workers did not stop in time, killing them")
+                    self._signal_workers(signal.SIGKILL)
+                    self._stop_deadline = now + self.stop_timeout
+                timeout = self._stop_deadline - now
+            else:
+                for worker in self.workers:
+                    if worker.process is None and worker.start_at <= now:
+                        self._start(worker, now)
+                pending = [w.start_at for w in self.workers if w.process is None]
+                timeout = max(min(pending) - now, 0) if pending else None
+
+            for signum in self._wait(rfd, timeout):
+                if signum in STOP_SIGNALS:
+                    self.stop()
+                elif signum in FORWARD_SIGNALS:
+                    self._signal_workers(signal.Signals(signum))
+
+    @staticmethod
+    def _wait(rfd: int, timeout: float | None) -> list[int]:
+        """Wait for signals, returns the ones received."""
+        readable, _, _ = select.select([rfd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            return list(os.read(rfd, 512))
+        except BlockingIOError:
+            return []
+
+    def _start(self, worker: Worker, now: float) -> None:
+        logging.info("Starting worker %d", worker.index)
+        try:
+            worker.process = subprocess.Popen(
+                worker.cmd, env=worker.env, preexec_fn=worker.setup
+            )
+        except (OSError, subprocess.SubprocessError):
+            logging.exception("Failed to start worker %d", worker.index)
+            self._schedule_restart(worker, now)
+            return
+        worker.started = now
+
+    def _reap(self, worker: Worker, now: float) -> bool:
+        """Handle the exit of a worker, returns whether it exited cleanly."""
+        assert worker.process is not None
+        returncode = worker.process.returncode
+        worker.process = None
+        if self._stop_deadline is not None:
+            logging.info("Worker %d exited with code %d", worker.index, returncode)
+            # terminated by our SIGTERM
+            return returncode in (0, -signal.SIGTERM)
+
+        logging.warning(
+            "Worker %d exited unexpectedly with code %d", worker.index, returncode
+        )
+        if now - worker.started >= self.stable_after:
+            worker.crashes = 0
+        self._schedule_restart(worker, now)
+        return True
+
+    def _schedule_restart(self, worker: Worker, now: float) -> None:
+        delay = min(self.backoff_initial * 2**worker.crashes, self.backoff_max)
+        worker.crashes += 1
+        worker.start_at = now + delay
+        logging.info("Restarting worker %d in %.1fs", worker.index, delay)
+
+    def _signal_workers(self, signum: signal.Signals) -> None:
+        for worker in self.workers:
+            if worker.running:
+                assert worker.process is not None
+                try:
+                    worker.process.send_signal(signum)
+                except ProcessLookupError:
+                    pass
@@ -63,6 +63,10 @@ class Template:
     def rel_path(self) -> Path:
         return self.dest / self.template()
 
+    def dest_path(self) -> Path:
+        """Path of the rendered file, relative to its location."""
+        return self.dest / self.filename.removesuffix(".j2")
+
     def template(self) -> str:
         return self.template_name or self.filename
 
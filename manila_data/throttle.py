@@ -0,0 +1,251 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bandwidth limits of the copy engine.
+
+The copies running on the node draw from a host wide token bucket, and each
+copy from its own bucket. A bucket is a file of the throttle directory
+holding the theoretical arrival time of the next byte on the monotonic
+clock, shared by all processes of the host. Consuming bytes pushes that time
+forward, and the consumer sleeps for as long as it is ahead of the burst
+allowance. The files are updated under an fcntl lock. The monotonic clock
+starts over on every boot, the time recorded under another boot is ignored.
+
+The limits are read again from the rendered manila.conf while copying, new
+values apply to the copies in progress.
+
+Like the copy engine, this module must only depend on the standard library.
+"""
+
+import dataclasses
+import fcntl
+import hashlib
+import os
+import struct
+import time
+from pathlib import Path
+
+from . import journal, rendered
+
+# rendered along with the other copy engine options
+SECTION = "snap_copy"
+
+# relative to the common path
+DIRECTORY = Path("lib/manila/throttle")
+HOST_BUCKET = "host"
+# Buckets shared by several copies, such as the files of a share manila
+# copies one at a time, are named after their key.
+SHARED_PREFIX = "shared-"
+# Shared buckets not drawn from within this delay are removed, in seconds.
+SHARED_TTL = 60 * 60
+# Bytes a bucket lets through at once, in seconds of its rate.
+BURST = 0.5
+# Longest wait queued up in a bucket, in seconds, on top of the bytes drawn.
+MAX_BACKLOG = 60.0
+# Size of the chunks copied between two draws from the buckets.
+CHUNK_SIZE = 1024 * 1024
+# Minimum delay between two reads of the limits.
+RELOAD_INTERVAL = 1.0
+
+# boot the arrival time was recorded under, and that time
+_STATE = struct.Struct("=36sd")
+
+
+@dataclasses.dataclass(frozen=True)
+class Limits:
+    """Bandwidth limits in bytes per second, 0 when unlimited."""
+
+    host: int = 0
+    job: int = 0
+
+    @classmethod
+    def from_config(cls, path: Path) -> "Limits":
+        """Load the limits rendered into the [snap_copy] section.
+
+        :param path: the rendered manila.conf
+        :type path: Path
+        :return: the bandwidth limits
+        :rtype: Limits
+        """
+        section = rendered.read_section(path, SECTION)
+        return cls(
+            host=int(section.get("bandwidth_limit", 0)),
+            job=int(section.get("job_bandwidth_limit", 0)),
+        )
+
+
+@dataclasses.dataclass(frozen=True)
+class ThrottleOptions:
+    """Where the limits and the buckets of a copy are found."""
+
+    # the rendered manila.conf
+    config: Path
+    directory: Path
+    # name of the bucket of the copy
+    job: str | None = None
+
+
+class TokenBucket:
+    """Token bucket shared by the processes of the host through a file."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd: int | None = None
+        self._boot_id = journal.boot_id().encode()
+
+    def consume(self, size: int, rate: int) -> float:
+        """Draw bytes from the bucket.
+
+        :param size: number of bytes
+        :type size: int
+        :param rate: rate of the bucket, in bytes per second
+        :type rate: int
+        :return: delay to wait for before going on, in seconds
+        :rtype: float
+        """
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            data = os.pread(self._fd, _STATE.size, 0)
+            now = time.monotonic()
+            due = now
+            if len(data) == _STATE.size:
+                boot_id, recorded = _STATE.unpack(data)
+                if boot_id.rstrip(b"\0") == self._boot_id:
+                    due = min(max(recorded, now), now + MAX_BACKLOG)
+            due += size / rate
+            os.pwrite(self._fd, _STATE.pack(self._boot_id, due), 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        return max(due - now - BURST, 0.0)
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class Throttle:
+    """Hold the copies back to the configured bandwidth limits."""
+
+    def __init__(self, options: ThrottleOptions):
+        self.options = options
+        self.host = TokenBucket(options.directory / HOST_BUCKET)
+        self.job = None
+        if options.job is not None:
+            self.job = TokenBucket(options.directory / options.job)
+        self._limits = Limits()
+        self._checked = -RELOAD_INTERVAL
+        self._stamp: tuple[int, int] | None = None
+
+    def limits(self) -> Limits:
+        """Current limits, read again when manila.conf was rendered again.
+
+        :rtype: Limits
+        """
+        now = time.monotonic()
+        if now - self._checked < RELOAD_INTERVAL:
+            return self._limits
+        self._checked = now
+        try:
+            st = os.stat(self.options.config)
+        except FileNotFoundError:
+            self._limits, self._stamp = Limits(), None
+            return self._limits
+        # the hooks replace the file when rendering it
+        stamp = (st.st_ino, st.st_mtime_ns)
+        if stamp != self._stamp:
+            self._limits = Limits.from_config(self.options.config)
+            self._stamp = stamp
+        return self._limits
+
+    def chunk_size(self, chunk_size: int) -> int:
+        """Size of the chunks to copy with, smaller while throttled.
+
+        :param chunk_size: the chunk size when not throttled
+        :type chunk_size: int
+        :rtype: int
+        """
+        limits = self.limits()
+        if limits.host or (limits.job and self.job is not None):
+            return min(chunk_size, CHUNK_SIZE)
+        return chunk_size
+
+    def consume(self, size: int) -> None:
+        """Account copied bytes, sleeping while over the limits.
+
+        :param size: number of bytes copied
+        :type size: int
+        """
+        limits = self.limits()
+        delay = 0.0
+        if limits.host:
+            delay = self.host.consume(size, limits.host)
+        if limits.job and self.job is not None:
+            delay = max(delay, self.job.consume(size, limits.job))
+        if delay:
+            time.sleep(delay)
+
+    def close(self) -> None:
+        self.host.close()
+        if self.job is not None:
+            self.job.close()
+
+
+def new_job(options: ThrottleOptions, key: str | None = None) -> ThrottleOptions:
+    """Create the bucket of a new copy.
+
+    Copies with the same key draw from the same bucket, which is kept once
+    they finish. Buckets of the copies whose process is gone, and shared
+    buckets left unused, are removed on the way.
+
+    :param options: the throttle options, without job
+    :type options: ThrottleOptions
+    :param key: key of the bucket shared with other copies, if any
+    :type key: str or None
+    :return: the throttle options of the copy
+    :rtype: ThrottleOptions
+    """
+    options.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+    deadline = time.time() - SHARED_TTL
+    for entry in os.scandir(options.directory):
+        pid = entry.name.partition("-")[0]
+        try:
+            if pid.isdigit():
+                stale = not os.path.exists(f"/proc/{pid}")
+            else:
+                shared = entry.name.startswith(SHARED_PREFIX)
+                stale = shared and entry.stat().st_mtime < deadline
+        except FileNotFoundError:
+            continue
+        if stale:
+            Path(entry.path).unlink(missing_ok=True)
+    if key is not None:
+        job = SHARED_PREFIX + hashlib.sha256(key.encode()).hexdigest()
+    else:
+        # a process may run several copies in a row
+        job = f"{os.getpid()}-{time.monotonic_ns()}"
+    (options.directory / job).touch(mode=0o600)
+    return dataclasses.replace(options, job=job)
+
+
+def end_job(options: ThrottleOptions) -> None:
+    """Remove the bucket of a finished copy, unless it is shared.
+
+    :param options: the throttle options of the copy
+    :type options: ThrottleOptions
+    """
+    if options.job is not None and not options.job.startswith(SHARED_PREFIX):
+        (options.directory / options.job).unlink(missing_ok=True)
@@ -0,0 +1 @@
+"""Benchmarks for Manila Data Snap."""
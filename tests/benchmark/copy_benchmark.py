@@ -0,0 +1,420 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Throughput benchmark of the data copy and verify path.
+
+A synthetic share tree is generated on a local directory, a tmpfs or a
+loopback ext4 filesystem, then copied and verified with the settings of a
+rendered manila.conf. Every phase runs in its own process, optionally under
+strace, and the results are printed as JSON to compare snap revisions. The
+copy and verify phases call the copy engine and the verifier directly, the
+shims phase runs the commands manila runs for each file, through the snap's
+sudo, cp and sha256sum shims:
+
+    python -m tests.benchmark.copy_benchmark --profile mixed \
+        --config /var/snap/manila-data/common/etc/manila/manila.conf
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+from pathlib import Path
+
+from manila_data import checksum, copier, rendered, services
+
+KiB = 1024
+MiB = 1024 * KiB
+GiB = 1024 * MiB
+
+# files of a tree are spread over directories of this many entries
+FILES_PER_DIR = 100
+# content of the generated files is cut from a random block of this size
+BLOCK_SIZE = 4 * MiB
+
+
+class Bucket(typing.NamedTuple):
+    """Files of a tree with sizes uniformly distributed in a range."""
+
+    count: int
+    min_size: int
+    max_size: int
+
+
+PROFILES: dict[str, list[Bucket]] = {
+    "tiny": [Bucket(20000, 0, 4 * KiB)],
+    "mixed": [
+        Bucket(5000, 0, 64 * KiB),
+        Bucket(500, 64 * KiB, 4 * MiB),
+        Bucket(20, 16 * MiB, 128 * MiB),
+    ],
+    "huge": [Bucket(4, 1 * GiB, 1 * GiB)],
+}
+
+
+class TreeStats(typing.NamedTuple):
+    """Number and total size of the files of a tree."""
+
+    files: int
+    size: int
+
+
+def build_tree(
+    root: Path, buckets: typing.Sequence[Bucket], scale: float, seed: int
+) -> TreeStats:
+    """Generate a share tree following a size distribution.
+
+    :param root: the directory receiving the tree
+    :param buckets: the size distribution
+    :param scale: factor applied to the number of files of each bucket
+    :param seed: seed of the sizes and content of the files
+    :return: the number and total size of the files
+    """
+    rng = random.Random(seed)
+    block = rng.randbytes(BLOCK_SIZE)
+    files = size = 0
+    for bucket in buckets:
+        for _ in range(max(1, math.ceil(bucket.count * scale))):
+            directory = root / f"d{files // FILES_PER_DIR:05d}"
+            if files % FILES_PER_DIR == 0:
+                directory.mkdir(parents=True)
+            file_size = rng.randint(bucket.min_size, bucket.max_size)
+            with open(directory / f"f{files:07d}", "wb") as f:
+                remaining = file_size
+                while remaining:
+                    offset = rng.randrange(BLOCK_SIZE)
+                    end = offset + remaining
+                    chunk = block[offset:end]
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            files += 1
+            size += file_size
+    return TreeStats(files, size)
+
+
+@contextlib.contextmanager
+def filesystem(kind: str, workdir: Path, size: int) -> typing.Iterator[Path]:
+    """Provide an empty directory on the requested kind of filesystem.
+
+    tmpfs and loop filesystems are mounted for the benchmark only, which
+    requires root privileges.
+    """
+    mountpoint = workdir / "fs"
+    mountpoint.mkdir()
+    if kind == "dir":
+        yield mountpoint
+        return
+
+    if kind == "tmpfs":
+        options = f"size={size}"
+        subprocess.run(
+            ["mount", "-t", "tmpfs", "-o", options, "tmpfs", mountpoint],
+            check=True,
+        )
+    else:
+        image = workdir / "fs.img"
+        with open(image, "wb") as f:
+            f.truncate(size)
+        subprocess.run(["mkfs.ext4", "-q", "-F", image], check=True)
+        subprocess.run(["mount", "-o", "loop", image, mountpoint], check=True)
+    try:
+        yield mountpoint
+    finally:
+        subprocess.run(["umount", mountpoint], check=False)
+
+
+def parse_strace(path: Path) -> dict[str, int]:
+    """Read the calls per syscall of a strace -c summary."""
+    calls = {}
+    for line in path.read_text().splitlines():
+        fields = line.split()
+        if len(fields) < 5 or not fields[3].isdigit() or fields[-1] == "total":
+            continue
+        calls[fields[-1]] = int(fields[3])
+    return calls
+
+
+def run_phase(
+    name: str, args: typing.Sequence[str], stats: TreeStats, strace: bool
+) -> dict[str, typing.Any]:
+    """Run a phase in a child process and collect its metrics."""
+    # __name__ is __main__ when run with -m
+    module = __spec__.name if __spec__ else __name__
+    cmd = [sys.executable, "-m", module, "--phase", name, *args]
+    strace_out = None
+    if strace:
+        fd, strace_path = tempfile.mkstemp(prefix="strace-")
+        os.close(fd)
+        strace_out = Path(strace_path)
+        cmd = ["strace", "-f", "-c", "-o", strace_path, *cmd]
+
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    assert process.stdout is not None
+    output = process.stdout.read()
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise RuntimeError(
+            f"phase {name} failed with code {process.returncode}",
+        )
+
+    result = json.loads(output)
+    seconds = result.pop("seconds")
+    syscalls = None
+    if strace_out is not None:
+        syscalls = parse_strace(strace_out)
+        strace_out.unlink()
+    return {
+        "name": name,
+        "seconds": round(seconds, 3),
+        "files_per_second": round(stats.files / seconds, 1),
+        "mb_per_second": round(stats.size / MiB / seconds, 1),
+        # maximum of the phase process and its workers
+        "peak_rss_kib": rusage.ru_maxrss,
+        "syscalls": syscalls and sum(syscalls.values()),
+        "syscalls_by_name": syscalls,
+        **result,
+    }
+
+
+def _copy_phase(src: Path, dest: Path, config: Path, cache: Path) -> dict:
+    engine = rendered.read_section(config, copier.SECTION).get("engine", "cp")
+    start = time.monotonic()
+    if engine == "parallel":
+        options = copier.CopyOptions.from_config(config, digest_cache=cache)
+        copier.Copier(options).copy(src, dest)
+    else:
+        subprocess.run(["cp", "-a", src, dest], check=True)
+    return {"seconds": time.monotonic() - start, "engine": engine}
+
+
+def _verify_phase(src: Path, dest: Path, config: Path, cache: Path) -> dict:
+    options = checksum.VerifyOptions.from_config(config)
+    digest_cache = checksum.DigestCache(cache)
+    mismatches = 0
+    start = time.monotonic()
+    # manila hashes the source and the destination of each file in turn
+    for directory, _, files in os.walk(src):
+        for name in files:
+            src_file = os.path.join(directory, name)
+            dest_file = os.path.join(dest, os.path.relpath(src_file, src))
+            src_digest = checksum.digest(src_file, options, digest_cache)
+            if src_digest != checksum.digest(dest_file, options):
+                mismatches += 1
+    return {
+        "seconds": time.monotonic() - start,
+        "mode": options.mode,
+        "algorithm": options.algorithm,
+        "mismatches": mismatches,
+    }
+
+
+def _shims_phase(src: Path, dest: Path, config: Path, cache: Path) -> dict:
+    snap = Path(os.environ.get("SNAP", "/snap/manila-data/current"))
+    engine = rendered.read_section(config, copier.SECTION).get("engine", "cp")
+    verify = checksum.VerifyOptions.from_config(config)
+    service = rendered.read_section(config, services.SECTION)
+    # as set by ManilaDataService.environment
+    libexec = snap / services.ManilaDataService.libexec
+    path = [str(libexec), str(snap / "usr/bin"), str(snap / "bin")]
+    env = {
+        **os.environ,
+        "SNAP_COMMON": str(config.parents[2]),
+        "MANILA_DATA_COPY_ENGINE": engine,
+        "MANILA_DATA_VERIFY": verify.mode,
+        "MANILA_DATA_ROOTWRAP": service.get("rootwrap", "rootwrap"),
+        "PATH": os.pathsep.join([*path, os.environ.get("PATH", "")]),
+    }
+    rootwrap_conf = config.with_name("rootwrap.conf")
+    root_helper = ["sudo", "manila-rootwrap", str(rootwrap_conf)]
+
+    def execute(*cmd: str) -> str:
+        process = subprocess.run(
+            [*root_helper, *cmd],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        return process.stdout
+
+    commands = mismatches = 0
+    start = time.monotonic()
+    # manila.data.utils.Copy creates each directory, then copies and hashes
+    # the files one at a time
+    for directory, _, files in os.walk(src):
+        dest_dir = os.path.join(dest, os.path.relpath(directory, src))
+        execute("mkdir", "-p", dest_dir)
+        commands += 1
+        for name in files:
+            src_file = os.path.join(directory, name)
+            dest_file = os.path.join(dest_dir, name)
+            execute("cp", "-P", "--preserve=all", src_file, dest_file)
+            commands += 1
+            if verify.mode == "off":
+                continue
+            src_digest = execute("sha256sum", src_file).split()[0]
+            if src_digest != execute("sha256sum", dest_file).split()[0]:
+                mismatches += 1
+            commands += 2
+    return {
+        "seconds": time.monotonic() - start,
+        "engine": engine,
+        "mode": verify.mode,
+        "commands": commands,
+        "mismatches": mismatches,
+    }
+
+
+PHASES = {"copy": _copy_phase, "verify": _verify_phase, "shims": _shims_phase}
+
+
+def main(argv: typing.Sequence[str] | None = None) -> int:
+    """Run the benchmark and print its results as JSON."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the data copy and verify path"
+    )
+    parser.add_argument(
+        "--profile",
+        choices=sorted(PROFILES),
+        default="mixed",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="factor applied to file counts",
+    )
+    parser.add_argument(
+        "--fs",
+        choices=("dir", "tmpfs", "loop"),
+        default="dir",
+    )
+    parser.add_argument(
+        "--fs-size",
+        type=int,
+        help="size in bytes of tmpfs and loop filesystems "
+        "(default: three times the tree size)",
+    )
+    parser.add_argument(
+        "--workdir",
+        type=Path,
+        help="where the trees are created",
+    )
+    parser.add_argument(
+        "--config",
+        type=Path,
+        default=rendered.manila_conf(),
+        help="rendered manila.conf holding the copy and verify settings",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--strace",
+        action=argparse.BooleanOptionalAction,
+        default=shutil.which("strace") is not None,
+        help="count syscalls with strace (default: when installed)",
+    )
+    parser.add_argument(
+        "--shims",
+        action=argparse.BooleanOptionalAction,
+        default="SNAP" in os.environ,
+        help="copy and verify each file through the snap's command shims, "
+        "from $SNAP (default: when run within the snap)",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help="write the results to a file",
+    )
+    parser.add_argument(
+        "--phase",
+        choices=sorted(PHASES),
+        help=argparse.SUPPRESS,
+    )
+    parser.add_argument("--src", type=Path, help=argparse.SUPPRESS)
+    parser.add_argument("--dest", type=Path, help=argparse.SUPPRESS)
+    parser.add_argument("--cache", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.phase:
+        phase = PHASES[args.phase]
+        result = phase(args.src, args.dest, args.config, args.cache)
+        json.dump(result, sys.stdout)
+        return 0
+
+    buckets = PROFILES[args.profile]
+    expected = 0
+    for b in buckets:
+        count = max(1, math.ceil(b.count * args.scale))
+        expected += count * (b.min_size + b.max_size) // 2
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmp:
+        workdir = Path(tmp)
+        fs_size = args.fs_size or 3 * expected + GiB
+        with filesystem(args.fs, workdir, fs_size) as fs:
+            src = fs / "src"
+            stats = build_tree(src, buckets, args.scale, args.seed)
+            os.sync()
+            names = ["copy"]
+            if checksum.VerifyOptions.from_config(args.config).mode != "off":
+                names.append("verify")
+            if args.shims:
+                names.append("shims")
+            phases = []
+            for name in names:
+                # the shims copy the tree a second time
+                dest = fs / ("shims" if name == "shims" else "dest")
+                phase_args = [
+                    f"--src={src}",
+                    f"--dest={dest}",
+                    f"--config={args.config}",
+                    f"--cache={workdir / 'digests.sqlite'}",
+                ]
+                phases.append(run_phase(name, phase_args, stats, args.strace))
+
+    results = {
+        "revision": os.environ.get("SNAP_REVISION"),
+        "profile": args.profile,
+        "scale": args.scale,
+        "filesystem": args.fs,
+        "host": {
+            "cpus": len(os.sched_getaffinity(0)),
+            "machine": platform.machine(),
+            "python": platform.python_version(),
+        },
+        "settings": {
+            section: rendered.read_section(args.config, section)
+            for section in (copier.SECTION, checksum.SECTION)
+        },
+        "tree": stats._asdict(),
+        "phases": phases,
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
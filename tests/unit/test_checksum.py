@@ -0,0 +1,127 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the data verification."""
+
+import hashlib
+import io
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from manila_data import checksum, copier
+from manila_data.scripts import data_hash
+
+
+@mock.patch.object(checksum, "LARGE_FILE_SIZE", 1024)
+class TestChecksum(unittest.TestCase):
+    """manila_data.checksum tests."""
+
+    def setUp(self):
+        """Test setup."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.tmpdir = pathlib.Path(tmp_dir)
+
+        self.data = os.urandom(64 * 1024)
+        self.src = self.tmpdir / "src"
+        self.src.write_bytes(self.data)
+        self.cache = checksum.DigestCache(self.tmpdir / "digests.sqlite")
+
+    def test_file_digest(self):
+        """Tests the whole file is hashed."""
+        self.assertEqual(
+            checksum.file_digest(str(self.src), "blake2b", chunk_size=1000),
+            hashlib.blake2b(self.data).hexdigest(),
+        )
+
+    def test_sampled_digest(self):
+        """Tests sampled digests detect corrupted samples."""
+        dest = self.tmpdir / "dest"
+        dest.write_bytes(self.data)
+        src_digest = checksum.sampled_digest(str(self.src), "sha256", 4, 1024)
+        self.assertEqual(
+            src_digest, checksum.sampled_digest(str(dest), "sha256", 4, 1024)
+        )
+
+        with dest.open("r+b") as f:
+            f.seek(len(self.data) - 1)
+            f.write(bytes([self.data[-1] ^ 0xFF]))
+        self.assertNotEqual(
+            src_digest, checksum.sampled_digest(str(dest), "sha256", 4, 1024)
+        )
+
+    def test_digest_small_file(self):
+        """Tests small files are always hashed with sha256."""
+        small = self.tmpdir / "small"
+        small.write_bytes(b"foo")
+        options = checksum.VerifyOptions(mode="full", algorithm="blake2b")
+
+        self.assertEqual(
+            checksum.digest(str(small), options),
+            hashlib.sha256(b"foo").hexdigest(),
+        )
+
+    def test_digest_cache(self):
+        """Tests digests recorded while copying are used once."""
+        options = checksum.VerifyOptions(mode="full", algorithm="blake2b")
+        self.cache.store(str(self.src), self.src.stat(), "blake2b", "cafe")
+
+        digest = checksum.digest(str(self.src), options, self.cache)
+        self.assertEqual(digest, "cafe")
+        self.assertEqual(
+            checksum.digest(str(self.src), options, self.cache),
+            hashlib.blake2b(self.data).hexdigest(),
+        )
+
+    def test_digest_cache_outdated(self):
+        """Tests digests of modified files are ignored."""
+        self.cache.store(str(self.src), self.src.stat(), "sha256", "cafe")
+        self.src.write_bytes(b"bar")
+
+        self.assertIsNone(self.cache.pop(str(self.src), "sha256"))
+
+    def test_copy_records_digest(self):
+        """Tests the copy engine hashes the source while copying."""
+        options = copier.CopyOptions(
+            verify=checksum.VerifyOptions(mode="full", algorithm="blake2b"),
+            digest_cache=self.cache.path,
+            chunk_size=1000,
+        )
+        dest = self.tmpdir / "dest"
+        copier.copy_file(str(self.src), str(dest), options)
+
+        self.assertEqual(dest.read_bytes(), self.data)
+        self.assertEqual(
+            self.cache.pop(str(self.src), "blake2b"),
+            hashlib.blake2b(self.data).hexdigest(),
+        )
+
+    @mock.patch("sys.stdout", new_callable=io.StringIO)
+    def test_data_hash_script(self, mock_stdout):
+        """Tests digests are printed the way sha256sum does."""
+        common = self.tmpdir / "common"
+        conf = common / "etc/manila/manila.conf"
+        conf.parent.mkdir(parents=True)
+        conf.write_text("[snap_verify]\nmode = full\nalgorithm = blake2s\n")
+
+        with mock.patch.dict("os.environ", {"SNAP_COMMON": str(common)}):
+            self.assertEqual(data_hash.main([str(self.src)]), 0)
+        self.assertEqual(
+            mock_stdout.getvalue(),
+            f"{hashlib.blake2s(self.data).hexdigest()}  {self.src}\n",
+        )
@@ -0,0 +1,523 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the parallel copy engine."""
+
+import concurrent.futures
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from manila_data import checksum, copier, delta, journal, progress, throttle
+from manila_data.scripts import data_copy
+
+ROOT = pathlib.Path(__file__).parents[2]
+CP_SHIM = ROOT / "libexec" / "cp"
+
+
+class TestCopier(unittest.TestCase):
+    """manila_data.copier tests."""
+
+    def setUp(self):
+        """Test setup."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.tmpdir = pathlib.Path(tmp_dir)
+
+        self.src = self.tmpdir / "src"
+        (self.src / "sub" / "deep").mkdir(parents=True)
+        (self.src / "small").write_bytes(b"a" * 10)
+        (self.src / "sub" / "large").write_bytes(os.urandom(4096))
+        (self.src / "sub" / "deep" / "empty").touch()
+        (self.src / "link").symlink_to("sub/large")
+        os.link(self.src / "small", self.src / "sub" / "hardlink")
+        (self.src / "sub").chmod(0o711)
+        os.utime(self.src / "sub", ns=(10**9, 10**9))
+
+        self.options = copier.CopyOptions(
+            workers=2, small_file_size=1024, chunk_size=1000
+        )
+
+    def test_copy_tree(self):
+        """Tests a tree is copied with its content and metadata."""
+        dest = self.tmpdir / "dest"
+        stats = copier.Copier(self.options).copy(self.src, dest)
+
+        self.assertEqual(stats.files, 5)
+        self.assertEqual(stats.size, 10 + 4096)
+        for name in ["small", "sub/large", "sub/deep/empty", "sub/hardlink"]:
+            content = (self.src / name).read_bytes()
+            self.assertEqual(content, (dest / name).read_bytes())
+        self.assertEqual(os.readlink(dest / "link"), "sub/large")
+        self.assertTrue(
+            os.path.samefile(dest / "small", dest / "sub/hardlink"),
+        )
+        self.assertEqual((dest / "sub").stat().st_mode & 0o777, 0o711)
+        self.assertEqual((dest / "sub").stat().st_mtime_ns, 10**9)
+
+    def test_copy_progress(self):
+        """Tests the progress of a copy is recorded when enabled."""
+        progress_dir = self.tmpdir / "copies"
+        options = copier.CopyOptions(workers=1, progress_dir=progress_dir)
+        copier.Copier(options).copy(self.src, self.tmpdir / "dest")
+        self.assertFalse(progress_dir.exists())
+
+        progress_dir.mkdir()
+        copier.Copier(options).copy(self.src, self.tmpdir / "dest")
+        [(path, job)] = progress.read_jobs(progress_dir)
+        self.assertTrue(path.name.startswith(f"{os.getpid()}-"))
+        self.assertEqual(job["source"], str(self.src))
+        self.assertEqual((job["files"], job["size"]), (5, 10 + 4096))
+        self.assertTrue(job["done"])
+
+    def test_copy_share_file_progress(self):
+        """Tests the progress of a file of a share names the shares."""
+        progress_dir = self.tmpdir / "copies"
+        progress_dir.mkdir()
+        mnt = self.tmpdir / "mnt"
+        src_share, dest_share = mnt / "src-id", mnt / "dest-id"
+        dest_share.mkdir(parents=True)
+        self.src.rename(src_share)
+        options = copier.CopyOptions(
+            workers=1,
+            progress_dir=progress_dir,
+            mounts_dir=mnt,
+        )
+        src = src_share / "sub" / "large"
+        copier.Copier(options).copy(src, dest_share / "large")
+
+        [(_, job)] = progress.read_jobs(progress_dir)
+        shares = (job["source"], job["destination"])
+        self.assertEqual(shares, (str(src_share), str(dest_share)))
+
+    def test_copy_throttled(self):
+        """Tests throttled copies draw from the host and job buckets."""
+        conf = self.tmpdir / "manila.conf"
+        conf.write_text("[snap_copy]\nbandwidth_limit = 4096\n")
+        throttle_dir = self.tmpdir / "throttle"
+        options = copier.CopyOptions(
+            workers=1,
+            bandwidth=throttle.ThrottleOptions(conf, throttle_dir),
+        )
+        with mock.patch("time.sleep") as mock_sleep:
+            copier.Copier(options).copy(
+                self.src / "sub/large",
+                self.tmpdir / "dest",
+            )
+
+        # 4096 bytes at 4096 bytes per second, minus the burst allowance
+        mock_sleep.assert_called_once()
+        self.assertAlmostEqual(mock_sleep.call_args.args[0], 0.5, delta=0.1)
+        # only the host bucket is left once the copy is over
+        self.assertEqual(os.listdir(throttle_dir), [throttle.HOST_BUCKET])
+
+    def test_copy_resume(self):
+        """Tests a copy skips finished files and continues partial ones."""
+        journal_dir = self.tmpdir / "journal"
+        journal_dir.mkdir()
+        dest = self.tmpdir / "dest"
+        (dest / "sub").mkdir(parents=True)
+        (dest / "small").write_bytes(b"b" * 10)
+        (dest / "sub" / "large").write_bytes(b"x" * 1000)
+        small = str(self.src / "small")
+        large = str(self.src / "sub" / "large")
+
+        path = journal.journal_path(journal_dir, self.src, dest)
+        previous = journal.Journal(path)
+        previous.resume()
+        previous.record(
+            [
+                (small, os.lstat(small), 10, True),
+                (large, os.lstat(large), 1000, False),
+            ]
+        )
+        previous.close()
+
+        options = copier.CopyOptions(
+            workers=2,
+            small_file_size=1024,
+            chunk_size=1000,
+            journal_dir=journal_dir,
+        )
+        stats = copier.Copier(options).copy(self.src, dest)
+
+        self.assertEqual((stats.files, stats.size), (5, 10 + 4096))
+        self.assertEqual((dest / "small").read_bytes(), b"b" * 10)
+        source = (self.src / "sub" / "large").read_bytes()
+        self.assertEqual(
+            (dest / "sub/large").read_bytes(),
+            b"x" * 1000 + source[1000:],
+        )
+        # removed once the copy succeeded
+        self.assertEqual(list(journal_dir.iterdir()), [])
+
+    def test_copy_share_file_resume(self):
+        """Tests the files of a share are journaled with the share."""
+        journal_dir = self.tmpdir / "journal"
+        mnt = self.tmpdir / "mnt"
+        src_share, dest_share = mnt / "src-id", mnt / "dest-id"
+        dest_share.mkdir(parents=True)
+        self.src.rename(src_share)
+        src = src_share / "sub" / "large"
+        dest = dest_share / "large"
+        dest.write_bytes(b"x" * 1000)
+        path = journal.journal_path(journal_dir, src_share, dest_share)
+        journal_dir.mkdir()
+        previous = journal.Journal(path)
+        previous.resume()
+        previous.record([(str(src), os.lstat(src), 1000, False)])
+        previous.close()
+
+        options = copier.CopyOptions(
+            workers=2,
+            chunk_size=1000,
+            journal_dir=journal_dir,
+            mounts_dir=mnt,
+        )
+        stats = copier.Copier(options).copy(src, dest)
+
+        self.assertEqual((stats.files, stats.size), (1, 4096))
+        content = b"x" * 1000 + src.read_bytes()[1000:]
+        self.assertEqual(dest.read_bytes(), content)
+        # kept for the other files of the share
+        kept = journal.Journal(path)
+        self.addCleanup(kept.close)
+        entry = kept.lookup(str(src))
+        self.assertEqual((entry.offset, entry.done), (4096, True))
+        self.assertEqual(list(journal_dir.glob("*.sqlite")), [path])
+
+    def test_copy_share_file_done(self):
+        """Tests a finished file is copied again if its copy was truncated."""
+        journal_dir = self.tmpdir / "journal"
+        mnt = self.tmpdir / "mnt"
+        src_share, dest_share = mnt / "src-id", mnt / "dest-id"
+        dest_share.mkdir(parents=True)
+        self.src.rename(src_share)
+        src = src_share / "sub" / "large"
+        dest = dest_share / "large"
+        path = journal.journal_path(journal_dir, src_share, dest_share)
+        journal_dir.mkdir()
+        previous = journal.Journal(path)
+        previous.resume()
+        previous.record([(str(src), os.lstat(src), 4096, True)])
+        previous.close()
+        options = copier.CopyOptions(
+            journal_dir=journal_dir,
+            mounts_dir=mnt,
+        )
+
+        dest.write_bytes(b"x" * 4096)
+        stats = copier.Copier(options).copy(src, dest)
+        # skipped, the destination has the size of the source
+        self.assertEqual((stats.files, stats.size), (1, 4096))
+        self.assertEqual(dest.read_bytes(), b"x" * 4096)
+
+        dest.write_bytes(b"x" * 1000)
+        copier.Copier(options).copy(src, dest)
+        self.assertEqual(dest.read_bytes(), src.read_bytes())
+
+    def test_copy_tree_fork(self):
+        """Tests no journal connection is inherited by the workers."""
+        options = copier.CopyOptions(
+            workers=2,
+            journal_dir=self.tmpdir / "journal",
+        )
+        process_pool = concurrent.futures.ProcessPoolExecutor
+        open_journals = []
+
+        def fork(*args, **kwargs):
+            open_journals.append(list(copier._journals))
+            return process_pool(*args, **kwargs)
+
+        with mock.patch("concurrent.futures.ProcessPoolExecutor", fork):
+            copier.Copier(options).copy(self.src, self.tmpdir / "dest")
+        self.assertEqual(open_journals, [[]])
+
+    def test_copy_journal_kept(self):
+        """Tests the journal of a failed copy is kept."""
+        journal_dir = self.tmpdir / "journal"
+        dest = self.tmpdir / "dest"
+        # the file cannot be written
+        (dest / "sub" / "large").mkdir(parents=True)
+        options = copier.CopyOptions(workers=1, journal_dir=journal_dir)
+
+        with self.assertRaises(copier.CopyError):
+            copier.Copier(options).copy(self.src, dest)
+        path = journal.journal_path(journal_dir, self.src, dest)
+        self.assertTrue(path.exists())
+
+    def _touch_up(self, path, data):
+        """Rewrite a file, keeping its size and modification time."""
+        st = path.stat()
+        path.write_bytes(data)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    def test_copy_delta(self):
+        """Tests a delta copy only copies the files changed since."""
+        options = copier.CopyOptions(
+            workers=2,
+            small_file_size=1024,
+            mode="delta",
+            index_dir=self.tmpdir / "delta",
+        )
+        dest = self.tmpdir / "dest"
+        copier.Copier(options).copy(self.src, dest)
+        [index] = (self.tmpdir / "delta").glob("*.sqlite")
+        self.assertEqual(index, delta.index_path(self.tmpdir / "delta", dest))
+
+        # not seen by a delta copy
+        self._touch_up(dest / "small", b"c" * 10)
+        (self.src / "sub" / "large").write_bytes(b"d" * 100)
+        stats = copier.Copier(options).copy(self.src, dest)
+
+        self.assertEqual(stats.files, 5)
+        self.assertEqual((dest / "small").read_bytes(), b"c" * 10)
+        self.assertEqual((dest / "sub/large").read_bytes(), b"d" * 100)
+
+    def test_copy_checksum(self):
+        """Tests a checksum copy catches changes keeping size and mtime."""
+        options = copier.CopyOptions(
+            workers=1, mode="checksum", index_dir=self.tmpdir / "delta"
+        )
+        dest = self.tmpdir / "dest"
+        copier.Copier(options).copy(self.src, dest)
+
+        self._touch_up(self.src / "small", b"e" * 10)
+        copier.Copier(options).copy(self.src, dest)
+        self.assertEqual((dest / "small").read_bytes(), b"e" * 10)
+
+    def test_copy_file(self):
+        """Tests a single file is streamed in chunks."""
+        dest = self.tmpdir / "large"
+        src = self.src / "sub" / "large"
+        stats = copier.Copier(self.options).copy(src, dest)
+
+        self.assertEqual(stats.files, 1)
+        self.assertEqual(dest.read_bytes(), src.read_bytes())
+
+    def test_copy_file_ranges(self):
+        """Tests the chunks of a file are reported once copied without gaps."""
+        src = self.src / "sub" / "large"
+        dest = self.tmpdir / "large"
+        dest.write_bytes(src.read_bytes()[:1000])
+        chunks = []
+        with open(src, "rb") as src_file, open(dest, "r+b") as dest_file:
+            copied = copier._stream_ranges(
+                src_file.fileno(),
+                dest_file.fileno(),
+                1000,
+                4096,
+                1000,
+                3,
+                chunks.append,
+            )
+
+        self.assertEqual(copied, 3096)
+        self.assertEqual(sum(chunks), 3096)
+        self.assertTrue(all(chunk % 1000 == 0 for chunk in chunks[:-1]))
+        self.assertEqual(dest.read_bytes(), src.read_bytes())
+
+        # every thread falls back to reads and writes
+        dest.unlink()
+        exdev = OSError(18, "EXDEV")
+        with mock.patch("os.copy_file_range", side_effect=exdev):
+            copier.Copier(self.options).copy(src, dest)
+        self.assertEqual(dest.read_bytes(), src.read_bytes())
+
+    @mock.patch("os.copy_file_range", side_effect=OSError(18, "EXDEV"))
+    def test_copy_file_fallback(self, mock_copy_file_range):
+        """Tests the copy falls back to reads and writes."""
+        dest = self.tmpdir / "large"
+        src = self.src / "sub" / "large"
+        copier.copy_file(str(src), str(dest), self.options)
+
+        self.assertEqual(dest.read_bytes(), src.read_bytes())
+
+    def test_copy_error(self):
+        """Tests failures are reported as CopyError."""
+        with self.assertRaises(copier.CopyError):
+            copier.Copier(self.options).copy(
+                self.src / "missing",
+                self.tmpdir / "dest",
+            )
+
+    def test_share_roots(self):
+        """Tests the files of mounted shares are keyed on their shares."""
+        mnt = self.tmpdir / "mnt"
+        options = copier.CopyOptions(mounts_dir=mnt)
+        self.assertEqual(
+            options.share_roots(mnt / "src-id/a/b", mnt / "dest-id/a/b"),
+            (mnt / "src-id", mnt / "dest-id"),
+        )
+        for src, dest in [
+            (mnt / "src-id/a", self.tmpdir / "elsewhere"),
+            (mnt, mnt / "dest-id"),
+        ]:
+            self.assertEqual(options.share_roots(src, dest), (src, dest))
+        self.assertEqual(
+            copier.CopyOptions().share_roots(mnt / "a", mnt / "b"),
+            (mnt / "a", mnt / "b"),
+        )
+
+    def test_options_from_config(self):
+        """Tests the options are read from the rendered configuration."""
+        conf = self.tmpdir / "manila.conf"
+        conf.write_text(
+            "[DEFAULT]\ndebug = True\nmount_tmp_location = /mnt/\n\n"
+            "[snap_copy]\nworkers = 3\n",
+        )
+
+        options = copier.CopyOptions.from_config(conf, preserve=False)
+        self.assertEqual(options.workers, 3)
+        self.assertEqual(options.mounts_dir, pathlib.Path("/mnt"))
+        self.assertFalse(options.preserve)
+
+
+class TestDataCopyScript(unittest.TestCase):
+    """manila_data.scripts.data_copy tests."""
+
+    def test_parse_cp_args(self):
+        """Tests the cp arguments used by manila are understood."""
+        args = data_copy.parse_cp_args(
+            ["-P", "--preserve=all", "-r", "a", "b"],
+        )
+        self.assertEqual(args.sources, [pathlib.Path("a")])
+        self.assertEqual(args.dest, pathlib.Path("b"))
+        self.assertTrue(args.recursive)
+        self.assertTrue(args.preserve)
+
+    def test_parse_cp_args_unsupported(self):
+        """Tests unsupported arguments are left to the real cp."""
+        self.assertIsNone(data_copy.parse_cp_args(["--reflink", "a", "b"]))
+        self.assertIsNone(data_copy.parse_cp_args(["-r", "a"]))
+
+    @mock.patch("os.execv")
+    def test_main_fallback(self, mock_execv):
+        """Tests the real cp runs for invocations it does not handle."""
+        mock_execv.side_effect = SystemExit
+        with self.assertRaises(SystemExit):
+            data_copy.main(["--reflink", "a", "b"])
+        mock_execv.assert_called_once_with(
+            data_copy.REAL_CP, ["cp", "--reflink", "a", "b"]
+        )
+
+
+class TestCpShim(unittest.TestCase):
+    """libexec/cp tests."""
+
+    def setUp(self):
+        """Test setup."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.tmpdir = pathlib.Path(tmp_dir)
+
+        self.src = self.tmpdir / "mnt" / "src"
+        (self.src / "sub" / "deep").mkdir(parents=True)
+        (self.src / "small").write_bytes(b"a" * 10)
+        large = os.urandom(checksum.LARGE_FILE_SIZE)
+        (self.src / "sub" / "large").write_bytes(large)
+        (self.src / "sub" / "deep" / "empty").touch()
+        (self.src / "link").symlink_to("sub/large")
+        self.dest = self.tmpdir / "mnt" / "dest"
+        self.dest.mkdir()
+
+        # the entry point of the snap, recording the copies it is handed
+        snap = self.tmpdir / "snap"
+        (snap / "bin").mkdir(parents=True)
+        engine = snap / "bin" / "manila-data-copy"
+        engine.write_text(
+            "#!/bin/bash\n"
+            'echo "$@" >> "$SNAP_COMMON/engine.log"\n'
+            f"exec {sys.executable} -c '"
+            "import sys; from manila_data.scripts import data_copy; "
+            'sys.exit(data_copy.main())\' "$@"\n'
+        )
+        engine.chmod(0o755)
+        # as rendered by the hooks
+        self.common = self.tmpdir / "common"
+        conf = self.common / "etc" / "manila" / "manila.conf"
+        conf.parent.mkdir(parents=True)
+        conf.write_text(
+            f"[DEFAULT]\nmount_tmp_location = {self.tmpdir}/mnt/\n\n"
+            "[snap_copy]\nworkers = 2\nmode = delta\n"
+            "job_bandwidth_limit = 1073741824\n"
+        )
+        self.env = {
+            **os.environ,
+            "SNAP": str(snap),
+            "SNAP_COMMON": str(self.common),
+            "PYTHONPATH": str(ROOT),
+            "MANILA_DATA_VERIFY": "off",
+        }
+
+    def _manila_copy(self, path: str, env: dict[str, str]) -> None:
+        """Copy a directory the way manila.data.utils.Copy does."""
+        out = subprocess.run(
+            ["ls", "-pA1", "--group-directories-first", path],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        for line in out.split("\n"):
+            if not line:
+                continue
+            src_item = os.path.join(path, line)
+            dest_item = src_item.replace(str(self.src), str(self.dest))
+            if line[-1] == "/":
+                subprocess.run(["mkdir", "-p", dest_item], check=True)
+                self._manila_copy(src_item, env)
+            else:
+                subprocess.run(
+                    [CP_SHIM, "-P", "--preserve=all", src_item, dest_item],
+                    env=env,
+                    check=True,
+                )
+
+    def _engine_log(self) -> list[str]:
+        log = self.common / "engine.log"
+        return log.read_text().splitlines() if log.exists() else []
+
+    def test_per_file_copies(self):
+        """Tests the large files manila copies go through the engine."""
+        env = {**self.env, "MANILA_DATA_COPY_ENGINE": "parallel"}
+        self._manila_copy(str(self.src), env)
+
+        for name in ["small", "sub/large", "sub/deep/empty"]:
+            content = (self.src / name).read_bytes()
+            self.assertEqual(content, (self.dest / name).read_bytes())
+        self.assertEqual(os.readlink(self.dest / "link"), "sub/large")
+        # small files and links are left to coreutils cp
+        copies = [line.split()[-1] for line in self._engine_log()]
+        self.assertEqual(copies, [str(self.dest / "sub" / "large")])
+        journals = list((self.common / journal.DIRECTORY).glob("*.sqlite"))
+        self.assertEqual(len(journals), 1)
+        indexes = list((self.common / delta.DIRECTORY).glob("*.sqlite"))
+        self.assertEqual(len(indexes), 1)
+        # the files of the share are throttled as a single copy
+        [bucket] = os.listdir(self.common / throttle.DIRECTORY)
+        self.assertTrue(bucket.startswith(throttle.SHARED_PREFIX))
+
+    def test_cp_engine(self):
+        """Tests coreutils cp copies the files with the cp engine."""
+        env = {**self.env, "MANILA_DATA_COPY_ENGINE": "cp"}
+        self._manila_copy(str(self.src), env)
+
+        content = (self.src / "sub/large").read_bytes()
+        self.assertEqual(content, (self.dest / "sub/large").read_bytes())
+        self.assertEqual(self._engine_log(), [])
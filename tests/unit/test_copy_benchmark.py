@@ -0,0 +1,87 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the copy benchmark."""
+
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from tests.benchmark import copy_benchmark
+
+ROOT = pathlib.Path(__file__).parents[2]
+
+# strace -f -c -o
+STRACE_SUMMARY = """\
+% time     seconds  usecs/call     calls    errors syscall
+------ ----------- ----------- --------- --------- ----------------
+ 61.25    0.004900           4      1021           read
+ 30.00    0.002400          24       100        12 openat
+  8.75    0.000700         700         1           execve
+------ ----------- ----------- --------- --------- ----------------
+100.00    0.008000           7      1122        12 total
+"""
+
+
+class TestCopyBenchmark(unittest.TestCase):
+    """tests.benchmark.copy_benchmark tests."""
+
+    def setUp(self):
+        """Test setup."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.tmpdir = pathlib.Path(tmp_dir)
+
+    def test_parse_strace(self):
+        """Tests the calls of each syscall are read, not the total."""
+        summary = self.tmpdir / "strace"
+        summary.write_text(STRACE_SUMMARY)
+
+        calls = copy_benchmark.parse_strace(summary)
+        self.assertEqual(calls, {"read": 1021, "openat": 100, "execve": 1})
+        self.assertEqual(sum(calls.values()), 1122)
+
+    def test_shims_phase(self):
+        """Tests the shims phase copies and hashes each file like manila."""
+        snap = self.tmpdir / "snap"
+        (snap / "usr/bin").mkdir(parents=True)
+        shutil.copy(ROOT / "bin" / "sudo", snap / "usr/bin" / "sudo")
+        (snap / "usr/libexec").mkdir()
+        libexec = snap / "usr/libexec/manila-data"
+        libexec.symlink_to(ROOT / "libexec")
+        config = self.tmpdir / "common/etc/manila/manila.conf"
+        config.parent.mkdir(parents=True)
+        config.write_text(
+            "[snap_service]\nrootwrap = direct\n\n"
+            "[snap_copy]\nengine = cp\n\n"
+            "[snap_verify]\nmode = full\n"
+        )
+        src, dest = self.tmpdir / "src", self.tmpdir / "dest"
+        buckets = [copy_benchmark.Bucket(3, 0, 1024)]
+        copy_benchmark.build_tree(src, buckets, 1.0, 0)
+
+        with mock.patch.dict(os.environ, {"SNAP": str(snap)}):
+            result = copy_benchmark.PHASES["shims"](
+                src, dest, config, self.tmpdir / "digests.sqlite"
+            )
+
+        # mkdir for each directory, cp and two sha256sum for each file
+        self.assertEqual(result["commands"], 2 + 3 * 3)
+        self.assertEqual(result["mismatches"], 0)
+        for path in src.rglob("f*"):
+            copy = dest / path.relative_to(src)
+            self.assertEqual(copy.read_bytes(), path.read_bytes())
@@ -0,0 +1,163 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the metrics exporter."""
+
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.request
+
+from manila_data import exporter
+
+EXECUTABLE = "/snap/manila-data/x1/bin/manila-data"
+
+
+class TestExporter(unittest.TestCase):
+    """manila_data.exporter tests."""
+
+    def setUp(self):
+        """Test setup, with a fake /proc."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.tmpdir = pathlib.Path(tmp_dir)
+        self.proc = self.tmpdir / "proc"
+        self.progress_dir = self.tmpdir / "copies"
+        self.progress_dir.mkdir()
+
+        self._process(
+            100,
+            ["/usr/bin/python3", EXECUTABLE, "--config-file", "x"],
+        )
+        self._process(200, ["/usr/bin/cp", "-a", "src", "dest"])
+        (self.proc / "self").mkdir()
+        (self.proc / "self/mountinfo").write_text(
+            "22 1 8:1 / / rw shared:1 - ext4 /dev/sda1 rw\n"
+            "40 22 0:50 / /tmp/share-1 rw - nfs4 srv:/exports/1 rw,vers=4.2\n"
+            "41 22 0:51 / /tmp/share-2 rw - ceph 10.0.0.1:/volumes/2 rw\n"
+        )
+        self.collector = exporter.Collector(
+            pathlib.Path(EXECUTABLE), self.progress_dir, self.proc
+        )
+
+    def _process(self, pid, argv):
+        base = self.proc / str(pid)
+        base.mkdir(parents=True)
+        cmdline = b"\0".join(os.fsencode(a) for a in argv)
+        (base / "cmdline").write_bytes(cmdline)
+        (base / "status").write_text(
+            "Name:\tmanila-data\nVmRSS:\t  2048 kB\nThreads:\t4\n"
+        )
+        stat = ["0"] * 50
+        stat[39] = str(3 * os.sysconf("SC_CLK_TCK"))
+        (base / "stat").write_text(f"{pid} (manila data) " + " ".join(stat))
+        (base / "io").write_text(
+            "rchar: 1000\nwchar: 2000\nsyscr: 1\nsyscw: 2\n"
+            "read_bytes: 300\nwrite_bytes: 400\ncancelled_write_bytes: 0\n"
+        )
+
+    def _job(self, name, pid, files, size, done=False):
+        job = {
+            "pid": pid,
+            "source": "/tmp/share-1",
+            "destination": "/tmp/share-2",
+            "files": files,
+            "size": size,
+            "started": 1000.0,
+            "updated": 1010.0,
+            "done": done,
+        }
+        (self.progress_dir / f"{name}.json").write_text(json.dumps(job))
+
+    def test_options_from_config(self):
+        """Tests the options are read from the rendered configuration."""
+        conf = self.tmpdir / "manila.conf"
+        conf.write_text("[snap_metrics]\nenabled = True\nport = 9100\n")
+
+        options = exporter.ExporterOptions.from_config(conf)
+        self.assertEqual(
+            options,
+            exporter.ExporterOptions(True, "127.0.0.1", 9100),
+        )
+
+    def test_find_processes(self):
+        """Tests the daemon is found through its interpreter."""
+        self.assertEqual(
+            exporter.find_processes(pathlib.Path(EXECUTABLE), self.proc), [100]
+        )
+
+    def test_collect(self):
+        """Tests the process, mount and copy metrics."""
+        self._job("100-1", 100, 10, 5000)
+        # another file of the same shares
+        self._job("100-2", 100, 1, 500)
+        text = exporter.render(self.collector.collect())
+
+        for line in [
+            "manila_data_processes 1",
+            'manila_data_process_resident_memory_bytes{pid="100"} 2097152',
+            'manila_data_process_io_wait_seconds_total{pid="100"} 3.0',
+            'manila_data_process_read_bytes_total{pid="100"} 1000',
+            'manila_data_process_storage_written_bytes_total{pid="100"} 400',
+            'manila_data_mounts{fstype="nfs4"} 1',
+            'manila_data_mounts{fstype="ceph"} 1',
+            "manila_data_copy_jobs 2",
+            "manila_data_copied_bytes_total 5500",
+            'manila_data_copy_job_bytes{source_share="share-1",'
+            'destination_share="share-2"} 5500',
+            "manila_data_copy_job_throughput_bytes_per_second{"
+            'source_share="share-1",destination_share="share-2"} 550.0',
+        ]:
+            self.assertIn(line, text.splitlines())
+        self.assertIn("# TYPE manila_data_copied_bytes counter", text)
+        self.assertNotIn("/tmp", text)
+        self.assertTrue(text.endswith("# EOF\n"))
+
+    def test_copy_totals(self):
+        """Tests finished copies are accounted for once."""
+        self._job("100-1", 100, 10, 5000)
+        self.collector.jobs.scan()
+
+        self._job("100-1", 100, 12, 6000, done=True)
+        # the copy process is gone
+        self._job("300-1", 300, 1, 10)
+        self.assertEqual(self.collector.jobs.scan(), {})
+        self.assertEqual(self.collector.jobs.finished_files, 13)
+        self.assertEqual(self.collector.jobs.finished_size, 6010)
+        self.assertEqual(list(self.progress_dir.iterdir()), [])
+
+        self.collector.jobs.scan()
+        self.assertEqual(self.collector.jobs.finished_size, 6010)
+
+    def test_server(self):
+        """Tests the metrics are served over HTTP."""
+        options = exporter.ExporterOptions(enabled=True, port=0)
+        server = exporter.make_server(options, self.collector)
+        self.addCleanup(server.server_close)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            content_type = response.headers["Content-Type"]
+            self.assertEqual(content_type, exporter.CONTENT_TYPE)
+            self.assertIn(b"manila_data_processes 1\n", response.read())
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/")
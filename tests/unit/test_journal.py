@@ -0,0 +1,106 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the copy journal."""
+
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from manila_data import journal
+
+
+class TestJournal(unittest.TestCase):
+    """manila_data.journal tests."""
+
+    def setUp(self):
+        """Test setup."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.tmpdir = pathlib.Path(tmp_dir)
+        self.boot_id = self.tmpdir / "boot_id"
+        self.boot_id.write_text("boot-1\n")
+        patcher = mock.patch.object(journal, "BOOT_ID", self.boot_id)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.file = self.tmpdir / "file"
+        self.file.write_bytes(b"a" * 100)
+        self.path = journal.journal_path(
+            self.tmpdir, self.tmpdir / "a", pathlib.Path("/b")
+        )
+
+    def _journal(self):
+        j = journal.Journal(self.path)
+        self.addCleanup(j.close)
+        return j
+
+    def test_resume(self):
+        """Tests the latest progress of each file is resumed."""
+        first = self._journal()
+        self.assertEqual(first.resume(), {})
+        st = os.stat(self.file)
+        first.record([(str(self.file), st, 10, False)])
+        first.record([(str(self.file), st, 100, True)])
+        first.close()
+
+        entries = self._journal().resume()
+        entry = journal.Entry(100, st.st_mtime_ns, 100, True)
+        self.assertEqual(entries, {str(self.file): entry})
+        self.assertTrue(entries[str(self.file)].matches(st))
+        os.utime(self.file, ns=(0, 0))
+        self.assertFalse(entries[str(self.file)].matches(os.stat(self.file)))
+
+    def test_resume_other_boot(self):
+        """Tests the journal of a previous boot is discarded."""
+        first = self._journal()
+        first.resume()
+        first.record([(str(self.file), os.stat(self.file), 100, True)])
+        first.close()
+
+        self.boot_id.write_text("boot-2\n")
+        self.assertEqual(self._journal().resume(), {})
+        self.assertEqual(self._journal().resume(), {})
+
+    def test_lookup(self):
+        """Tests the entry of a single file is read."""
+        first = self._journal()
+        self.assertIsNone(first.lookup(str(self.file)))
+        st = os.stat(self.file)
+        first.record([(str(self.file), st, 10, False)])
+        first.close()
+
+        entry = journal.Entry(100, st.st_mtime_ns, 10, False)
+        self.assertEqual(self._journal().lookup(str(self.file)), entry)
+        self.assertIsNone(self._journal().lookup(str(self.tmpdir / "other")))
+
+        self.boot_id.write_text("boot-2\n")
+        self.assertIsNone(self._journal().lookup(str(self.file)))
+
+    def test_expire(self):
+        """Tests old journals are removed with their log."""
+        self._journal().resume()
+        self._journal().close()
+        wal = self.path.with_name(self.path.name + "-wal")
+        wal.touch()
+
+        journal.expire(self.tmpdir)
+        self.assertTrue(self.path.exists())
+        os.utime(self.path, (0, 0))
+        journal.expire(self.tmpdir)
+        self.assertFalse(self.path.exists())
+        self.assertFalse(wal.exists())
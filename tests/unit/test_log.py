@@ -0,0 +1,67 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the logging setup."""
+
+import gzip
+import logging
+import pathlib
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from manila_data import log
+
+
+class TestLog(unittest.TestCase):
+    """manila_data.log tests."""
+
+    def setUp(self):
+        """Test setup."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.logfile = pathlib.Path(tmp_dir, "hooks.log")
+        root = logging.getLogger()
+        self.addCleanup(root.setLevel, root.level)
+        self.addCleanup(log.stop_logging)
+
+    def test_level(self):
+        """Tests debug messages are only recorded in debug mode."""
+        log.setup_logging(self.logfile)
+        logging.debug("hidden")
+        logging.info("shown")
+        log.setup_logging(self.logfile, debug=True)
+        logging.debug("debug")
+        log.stop_logging()
+
+        content = self.logfile.read_text()
+        self.assertNotIn("hidden", content)
+        self.assertIn("INFO shown", content)
+        self.assertIn("DEBUG debug", content)
+
+    @mock.patch.object(log, "MAX_BYTES", 1024)
+    def test_rotation(self):
+        """Tests log files are rotated and compressed."""
+        log.setup_logging(self.logfile)
+        for i in range(100):
+            logging.info("message %03d", i)
+        log.stop_logging()
+
+        rotated = self.logfile.with_name("hooks.log.1.gz")
+        with gzip.open(rotated, "rt") as f:
+            self.assertIn("message", f.read())
+        self.assertLessEqual(self.logfile.stat().st_size, 1024)
+        self.assertIn("message 099", self.logfile.read_text())
+        self.assertFalse(self.logfile.with_name("hooks.log.6.gz").exists())
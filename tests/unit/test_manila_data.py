@@ -14,16 +14,17 @@
 
 """Tests for ManilaDataService."""
 
+import json
 import pathlib
 import shutil
 import tempfile
 import unittest
 from unittest import mock
 
+import jinja2
 import snaphelpers
 
-from manila_data import configuration as config
-from manila_data import manila_data
+from manila_data import manila_data, services
 
 
 class TestManilaDataService(unittest.TestCase):
@@ -36,7 +37,7 @@ class TestManilaDataService(unittest.TestCase):
 
         self.tmpdir = pathlib.Path(tmp_dir)
         self.snap = mock.Mock()
-        env = {
+        self.env = env = {
             "COMMON": self.tmpdir / "common",
             "DATA": self.tmpdir / "data",
             "REAL_HOME": self.tmpdir / "home",
@@ -45,16 +46,18 @@ class TestManilaDataService(unittest.TestCase):
             "USER_DATA": self.tmpdir / "user_data",
         }
         self.snap.paths = snaphelpers.SnapPaths(env)
+        self.snap.name = self.snap.instance_name = "manila-data"
 
+        # as returned by snapctl
         self.snap.config.get_options.return_value.as_dict.return_value = {
-            "database": config.DatabaseConfiguration(url="foo"),
-            "rabbitmq": config.RabbitMQConfiguration(url="lish"),
-            "settings": config.Settings(),
+            "database": {"url": "foo"},
+            "rabbitmq": {"url": "lish"},
+            "settings": {},
         }
 
         self.manila_service = mock.Mock()
         self.snap.services.list.return_value = {
-            "manila-data": self.manila_service,
+            "manila-data.manila-data": self.manila_service,
         }
 
     def _check_file_contents(self, path, strings):
@@ -75,10 +78,16 @@ class TestManilaDataService(unittest.TestCase):
         expected_manila_conf = [
             f"rootwrap_config = {rootwrap_path}",
             "debug = False",
+            "check_hash = False",
             f"state_path = {tmp}/common/lib/manila",
             "transport_url = lish",
             "connection = foo",
+            "connection_recycle_time = 20",
+            "max_overflow = 50",
+            "pool_timeout = 30",
             f"lock_path = {tmp}/common/lib/manila/tmp",
+            f"mount_tmp_location = {tmp}/common/lib/manila/mnt/",
+            f"scratch_path = {tmp}/common/lib/manila",
         ]
         self._check_file_contents(manila_conf_path, expected_manila_conf)
 
@@ -95,6 +104,161 @@ class TestManilaDataService(unittest.TestCase):
         ]
         self._check_file_contents(rootwrap_path, expected_rootwrap)
 
+        rootwrap_d = self.tmpdir / "common/etc/manila/rootwrap.d"
+        filters_path = rootwrap_d / "data-copy.filters"
+        self._check_file_contents(filters_path, ["[Filters]"])
+        self.assertNotIn("snap_", filters_path.read_text())
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    def test_install_hook_copy_engine(self):
+        """Tests the parallel copy engine is wired into rootwrap."""
+        self.snap.config.get_options.return_value.as_dict.return_value.update(
+            {
+                "settings": {"copy-mode": "delta"},
+                "data-copy": {
+                    "engine": "parallel",
+                    "workers": 8,
+                    "bandwidth-limit": "1GiB",
+                },
+            }
+        )
+        manila_data.GenericManilaData.install_hook(self.snap)
+
+        tmp = str(self.tmpdir)
+        self._check_file_contents(
+            self.tmpdir / "common/etc/manila/manila.conf",
+            [
+                "[snap_copy]",
+                "engine = parallel",
+                "workers = 8\nmode = delta",
+                "bandwidth_limit = 1073741824\n\n[snap_verify]",
+            ],
+        )
+        rootwrap_d = self.tmpdir / "common/etc/manila/rootwrap.d"
+        filters_path = rootwrap_d / "data-copy.filters"
+        self._check_file_contents(
+            filters_path,
+            [
+                "snap_cp: CommandFilter, "
+                f"{tmp}/snap/usr/libexec/manila-data/cp, root",
+            ],
+        )
+        self.assertNotIn("snap_sha256sum", filters_path.read_text())
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    def test_install_hook_verify(self):
+        """Tests the data verifier is wired into manila and rootwrap."""
+        self.snap.config.get_options.return_value.as_dict.return_value.update(
+            {
+                "verify": {"mode": "sampled", "algorithm": "blake2b"},
+            }
+        )
+        manila_data.GenericManilaData.install_hook(self.snap)
+
+        tmp = str(self.tmpdir)
+        self._check_file_contents(
+            self.tmpdir / "common/etc/manila/manila.conf",
+            [
+                "check_hash = True",
+                "[snap_verify]",
+                "mode = sampled",
+                "algorithm = blake2b",
+            ],
+        )
+        rootwrap_d = self.tmpdir / "common/etc/manila/rootwrap.d"
+        filters_path = rootwrap_d / "data-copy.filters"
+        self._check_file_contents(
+            filters_path,
+            [
+                "snap_sha256sum: CommandFilter, "
+                f"{tmp}/snap/usr/libexec/manila-data/sha256sum, root",
+            ],
+        )
+        self.assertNotIn("snap_cp", filters_path.read_text())
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    def test_install_hook_resources(self):
+        """Tests the resource limits are rendered for the service wrapper."""
+        options = self.snap.config.get_options.return_value
+        options.as_dict.return_value["resources"] = {
+            "cpuset": "0-3",
+            "ioprio-class": "idle",
+        }
+        manila_data.GenericManilaData.install_hook(self.snap)
+
+        manila_conf_path = self.tmpdir / "common/etc/manila/manila.conf"
+        self._check_file_contents(
+            manila_conf_path,
+            [
+                "[snap_resources]\ncpuset = 0-3\n",
+                "ioprio_class = idle\nioprio_level = 4\n\n[snap_copy]",
+            ],
+        )
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    def test_install_hook_messaging(self):
+        """Tests the messaging tuning is rendered."""
+        options = self.snap.config.get_options.return_value
+        options.as_dict.return_value["messaging"] = {
+            "executor-thread-pool-size": 128,
+            "qos-prefetch-count": 0,
+        }
+        manila_data.GenericManilaData.install_hook(self.snap)
+
+        manila_conf_path = self.tmpdir / "common/etc/manila/manila.conf"
+        self._check_file_contents(
+            manila_conf_path,
+            [
+                "executor_thread_pool_size = 128\n",
+                "rpc_response_timeout = 120\n",
+                "rabbit_qos_prefetch_count = 0\n",
+                "heartbeat_rate = 3\n",
+                "rabbit_quorum_delivery_limit = 5\n",
+            ],
+        )
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    def test_install_hook_mount_options(self):
+        """Tests the NFS and CephFS client tuning is rendered."""
+        mounts_path = self.tmpdir / "common/etc/manila/data-mounts.conf"
+        ceph_conf_path = self.tmpdir / "common/etc/ceph/ceph.conf"
+        manila_data.GenericManilaData.install_hook(self.snap)
+        self.assertNotIn("data_node_mount_options", mounts_path.read_text())
+        self._check_file_contents(
+            ceph_conf_path,
+            ["[client]\nclient_oc = true\n"],
+        )
+
+        options = self.snap.config.get_options.return_value
+        raw_config = options.as_dict.return_value
+        raw_config["nfs"] = {
+            "version": "4.2",
+            "nconnect": 8,
+            "rsize": "1MiB",
+            "async-writes": True,
+            "options": "noatime, lookupcache=positive",
+        }
+        raw_config["cephfs"] = {
+            "rasize": "64MiB",
+            "client-oc": False,
+            "client-oc-size": "1GiB",
+        }
+        manila_data.GenericManilaData.install_hook(self.snap)
+
+        self._check_file_contents(
+            mounts_path,
+            [
+                "data_node_mount_options = "
+                "nfs:-o vers=4.2 -o nconnect=8 -o rsize=1048576 -o async"
+                " -o noatime -o lookupcache=positive,"
+                "cephfs:-o rasize=67108864\n",
+            ],
+        )
+        self._check_file_contents(
+            ceph_conf_path,
+            ["client_oc = false\n", "client_oc_size = 1073741824\n"],
+        )
+
     @mock.patch("manila_data.log.setup_logging", mock.Mock())
     def test_configure_hook(self):
         """Tests the configure hook."""
@@ -108,3 +272,325 @@ class TestManilaDataService(unittest.TestCase):
         self._check_file_contents(manila_conf_path, expected_manila_conf)
 
         self.manila_service.restart.assert_called_once()
+        self.snap.config.get_options.assert_called_once_with()
+        # no resource limit needs an interface
+        self.snap.health.okay.assert_called_once_with()
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    def test_configure_hook_profile(self):
+        """Tests a profile applies to every template, and is recorded."""
+        options = self.snap.config.get_options.return_value
+        raw_config = options.as_dict.return_value
+        raw_config["settings"] = {"profile": "throughput"}
+        raw_config["nfs"] = {"nconnect": 4}
+        manila_data.GenericManilaData.configure_hook(self.snap)
+
+        self._check_file_contents(
+            self.tmpdir / "common/etc/manila/manila.conf",
+            ["executor_thread_pool_size = 128\n", "engine = parallel\n"],
+        )
+        self._check_file_contents(
+            self.tmpdir / "common/etc/manila/data-mounts.conf",
+            ["nfs:-o nconnect=4 -o rsize=1048576 -o wsize=1048576"],
+        )
+        self._check_file_contents(
+            self.tmpdir / "common/etc/ceph/ceph.conf",
+            ["client_readahead_max_bytes = 67108864\n"],
+        )
+        effective_path = self.tmpdir / "common/effective-config.json"
+        self.assertEqual(effective_path.stat().st_mode & 0o777, 0o600)
+        options = json.loads(effective_path.read_text())
+        self.assertEqual(
+            options["nfs.nconnect"],
+            {"value": 4, "source": "snap set"},
+        )
+        self.assertEqual(
+            options["messaging.qos-prefetch-count"],
+            {"value": 128, "source": "profile"},
+        )
+
+        # switching profiles renders the mount options again
+        raw_config["settings"] = {"profile": "low-latency"}
+        manila_data.GenericManilaData.configure_hook(self.snap)
+        self._check_file_contents(
+            self.tmpdir / "common/etc/manila/data-mounts.conf",
+            ["nfs:-o nconnect=4\n"],
+        )
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    @mock.patch("socket.gethostname", mock.Mock(return_value="node1"))
+    def test_parallel_instances(self):
+        """Tests parallel instances render their own identity and paths."""
+        options = self.snap.config.get_options.return_value
+        raw_config = options.as_dict.return_value
+        raw_config["data-copy"] = {"scratch-path": "/mnt/manila-scratch"}
+        snaps = {}
+        for instance in ("manila-data", "manila-data_a", "manila-data_b"):
+            snap = snaps[instance] = mock.Mock()
+            snap.name, snap.instance_name = "manila-data", instance
+            snap.config = self.snap.config
+            snap.services.list.return_value = {}
+            # snapd gives each instance its own writable areas
+            snap.paths = snaphelpers.SnapPaths(
+                {
+                    **self.env,
+                    "COMMON": self.tmpdir / instance / "common",
+                    "DATA": self.tmpdir / instance / "data",
+                }
+            )
+            manila_data.GenericManilaData.configure_hook(snap)
+
+        conf_path = "etc/manila/manila.conf"
+        confs = {
+            instance: (snap.paths.common / conf_path).read_text()
+            for instance, snap in snaps.items()
+        }
+        self.assertNotIn("\nhost = ", confs["manila-data"])
+        self._check_file_contents(
+            snaps["manila-data"].paths.common / "etc/manila/manila.conf",
+            ["mount_tmp_location = /mnt/manila-scratch/mnt/\n"],
+        )
+        for key in ("a", "b"):
+            instance = f"manila-data_{key}"
+            scratch = f"/mnt/manila-scratch/{instance}"
+            common = snaps[instance].paths.common
+            self._check_file_contents(
+                common / "etc/manila/manila.conf",
+                [
+                    f"host = node1_{key}\n",
+                    f"state_path = {common}/lib/manila\n",
+                    f"mount_tmp_location = {scratch}/mnt/\n",
+                    f"lock_path = {scratch}/tmp\n",
+                ],
+            )
+            self._check_file_contents(
+                common / "etc/manila/rootwrap.conf",
+                [f"filters_path={common}/etc/manila/rootwrap.d,"],
+            )
+            self.assertEqual(
+                services.ManilaDataService().scratch_path(snaps[instance]),
+                pathlib.Path(scratch),
+            )
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    @mock.patch.object(services.ManilaDataService, "busy", return_value=True)
+    def test_configure_hook_deferred_restart(self, mock_busy):
+        """Tests restarts are deferred while copies are in progress."""
+        coordinator = mock.Mock()
+        snap_services = self.snap.services.list.return_value
+        snap_services["manila-data.manila-data-restart"] = coordinator
+        options = self.snap.config.get_options.return_value
+        options.as_dict.return_value["settings"] = {
+            "restart": "deferred",
+            "restart-deadline": 600,
+        }
+        manila_data.GenericManilaData.configure_hook(self.snap)
+
+        self.manila_service.restart.assert_not_called()
+        pending_file = self.tmpdir / "common/restart-pending.json"
+        pending = json.loads(pending_file.read_text())
+        self.assertEqual(pending["services"], ["manila-data"])
+        self.assertEqual(pending["deadline"] - pending["requested"], 600)
+        (options,) = self.snap.config.set.call_args.args
+        self.assertEqual(options["pending-restart"]["services"], "manila-data")
+        coordinator.start.assert_called_with()
+
+        # restarted at once when no copy is in progress
+        mock_busy.return_value = False
+        (self.tmpdir / "common/applied-config.json").unlink()
+        options = self.snap.config.get_options.return_value
+        options.as_dict.return_value["settings"]["debug"] = True
+        manila_data.GenericManilaData.configure_hook(self.snap)
+        self.manila_service.restart.assert_called_once_with(reload=True)
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    def test_configure_hook_trace(self):
+        """Tests the timing of the hook phases is recorded."""
+        manila_data.GenericManilaData.configure_hook(self.snap)
+        manila_data.GenericManilaData.configure_hook(self.snap)
+
+        trace_file = self.tmpdir / "common/hooks-trace.jsonl"
+        first, second = [json.loads(line) for line in trace_file.open()]
+        self.assertEqual(first["hook"], "configure")
+        self.assertGreater(first["import_ms"], 0)
+        spans = {span["name"]: span for span in first["spans"]}
+        for name in [
+            "get_raw_config",
+            "setup_dirs",
+            "template",
+            "get_config",
+            "render_context",
+            "start_services",
+        ]:
+            self.assertIn(name, spans)
+        first_spans = first["spans"]
+        templates = [s for s in first_spans if s["name"] == "process_template"]
+        self.assertIn(
+            "common/etc/manila/manila.conf", [s["template"] for s in templates]
+        )
+        self.assertTrue(all(s["parent"] == "template" for s in templates))
+        self.assertTrue(all(s["modified"] for s in templates))
+        # nothing changed, the second run stops after the snapshot
+        spans = {span["name"]: span for span in second["spans"]}
+        self.assertEqual(spans["config_snapshot"]["changed"], [])
+        self.assertNotIn("template", spans)
+        self.assertNotIn("start_services", spans)
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    def test_configure_hook_unchanged(self):
+        """Tests nothing is applied again for an unchanged configuration."""
+        manila_data.GenericManilaData.configure_hook(self.snap)
+        manila_conf_path = self.tmpdir / "common/etc/manila/manila.conf"
+        mtime = manila_conf_path.stat().st_mtime_ns
+        self.manila_service.reset_mock()
+        # keys the snap does not use are not relevant
+        options = self.snap.config.get_options.return_value
+        options.as_dict.return_value["other"] = 1
+
+        with mock.patch.object(
+            manila_data.GenericManilaData, "template"
+        ) as mock_template:
+            manila_data.GenericManilaData.configure_hook(self.snap)
+
+        mock_template.assert_not_called()
+        self.assertEqual(manila_conf_path.stat().st_mtime_ns, mtime)
+        self.manila_service.restart.assert_not_called()
+        self.manila_service.start.assert_not_called()
+        applied = (self.tmpdir / "common/applied-config.json").read_text()
+        self.assertNotIn("lish", applied)
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    def test_configure_hook_unchanged_inputs(self):
+        """Tests templates with unchanged inputs are not rendered again."""
+        manila_data.GenericManilaData.configure_hook(self.snap)
+        manila_conf_path = self.tmpdir / "common/etc/manila/manila.conf"
+        mtime = manila_conf_path.stat().st_mtime_ns
+        self.manila_service.reset_mock()
+        (self.tmpdir / "common/applied-config.json").unlink()
+
+        with mock.patch.object(
+            manila_data.GenericManilaData, "render_context"
+        ) as mock_render_context:
+            manila_data.GenericManilaData.configure_hook(self.snap)
+
+        mock_render_context.assert_not_called()
+        self.assertEqual(manila_conf_path.stat().st_mtime_ns, mtime)
+        self.manila_service.restart.assert_not_called()
+        self.manila_service.start.assert_called_once()
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    def test_configure_hook_changed(self):
+        """Tests templates are rendered again when their inputs change."""
+        manila_data.GenericManilaData.configure_hook(self.snap)
+        self.manila_service.reset_mock()
+
+        options = self.snap.config.get_options.return_value
+        options.as_dict.return_value["rabbitmq"] = {"url": "other"}
+        manila_data.GenericManilaData.configure_hook(self.snap)
+
+        manila_conf_path = self.tmpdir / "common/etc/manila/manila.conf"
+        self._check_file_contents(manila_conf_path, ["transport_url = other"])
+        self.manila_service.restart.assert_called_once()
+        self.assertEqual(
+            sorted(p.name for p in manila_conf_path.parent.iterdir()),
+            ["data-mounts.conf", "manila.conf", "rootwrap.conf", "rootwrap.d"],
+        )
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    def test_configure_hook_local_changes(self):
+        """Tests local changes to rendered files are overwritten."""
+        manila_data.GenericManilaData.configure_hook(self.snap)
+        manila_conf_path = self.tmpdir / "common/etc/manila/manila.conf"
+        manila_conf_path.write_text("local change\n")
+        self.manila_service.reset_mock()
+
+        manila_data.GenericManilaData.configure_hook(self.snap)
+
+        self._check_file_contents(manila_conf_path, ["transport_url = lish"])
+        self.manila_service.restart.assert_called_once()
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    def test_configure_hook_reload(self):
+        """Tests a change of reloadable options only reloads the service."""
+        manila_data.GenericManilaData.configure_hook(self.snap)
+        self.manila_service.reset_mock()
+
+        options = self.snap.config.get_options.return_value
+        options.as_dict.return_value["settings"] = {"debug": True}
+        manila_data.GenericManilaData.configure_hook(self.snap)
+
+        manila_conf_path = self.tmpdir / "common/etc/manila/manila.conf"
+        self._check_file_contents(manila_conf_path, ["debug = True"])
+        self.manila_service.restart.assert_called_once_with(reload=True)
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    def test_configure_hook_live_options(self):
+        """Tests a change of options read on every use needs no restart."""
+        manila_data.GenericManilaData.configure_hook(self.snap)
+        self.manila_service.reset_mock()
+
+        options = self.snap.config.get_options.return_value
+        options.as_dict.return_value["data-copy"] = {"workers": 3}
+        manila_data.GenericManilaData.configure_hook(self.snap)
+
+        manila_conf_path = self.tmpdir / "common/etc/manila/manila.conf"
+        self._check_file_contents(manila_conf_path, ["workers = 3"])
+        self.manila_service.restart.assert_not_called()
+        self.manila_service.start.assert_called_once()
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    def test_configure_hook_metrics(self):
+        """Tests toggling the metrics only restarts the exporter."""
+        exporter = mock.Mock()
+        snap_services = self.snap.services.list.return_value
+        snap_services["manila-data.manila-data-exporter"] = exporter
+        manila_data.GenericManilaData.configure_hook(self.snap)
+        self.manila_service.reset_mock()
+        exporter.reset_mock()
+
+        options = self.snap.config.get_options.return_value
+        options.as_dict.return_value["metrics"] = {"enabled": True}
+        manila_data.GenericManilaData.configure_hook(self.snap)
+
+        self.manila_service.restart.assert_not_called()
+        self.manila_service.start.assert_called_once()
+        exporter.restart.assert_called_once_with()
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    def test_compiled_templates(self):
+        """Tests the bundled templates are loaded from compiled modules."""
+        compiled = self.tmpdir / "compiled"
+        manila_data.GenericManilaData().compile_templates(compiled)
+        self.assertTrue(list(compiled.glob("tmpl_*.py")))
+
+        with (
+            mock.patch.object(
+                manila_data.GenericManilaData,
+                "compiled_templates_path",
+                return_value=compiled,
+            ),
+            mock.patch("jinja2.FileSystemLoader.get_source") as get_source,
+        ):
+            get_source.side_effect = jinja2.TemplateNotFound("none")
+            manila_data.GenericManilaData.install_hook(self.snap)
+
+        manila_conf_path = self.tmpdir / "common/etc/manila/manila.conf"
+        self._check_file_contents(manila_conf_path, ["transport_url = lish"])
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    def test_override_template_bytecode_cache(self):
+        """Tests override templates are cached as bytecode."""
+        override = self.tmpdir / "common/templates/rootwrap.conf.j2"
+        override.parent.mkdir(parents=True)
+        override.write_text(
+            "[DEFAULT]\nfilters_path = {{ snap_paths.common }}\n",
+        )
+
+        manila_data.GenericManilaData.install_hook(self.snap)
+
+        cache = self.tmpdir / "common" / manila_data.BYTECODE_CACHE
+        self.assertTrue(list(cache.iterdir()))
+        rootwrap_path = self.tmpdir / "common/etc/manila/rootwrap.conf"
+        self._check_file_contents(
+            rootwrap_path, [f"filters_path = {self.tmpdir}/common"]
+        )
@@ -0,0 +1,65 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the leftover mounts cleanup."""
+
+import pathlib
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from manila_data import mounts
+
+MOUNTINFO = """\
+22 1 8:1 / / rw shared:1 - ext4 /dev/sda1 rw
+40 22 0:50 / /scratch/mnt/share-1 rw - nfs4 srv:/exports/1 rw
+41 40 0:51 / /scratch/mnt/share-1/nested rw - nfs4 srv:/exports/2 rw
+42 22 0:52 / /scratch/mnt/share\\0402 rw - ceph 10.0.0.1:/volumes/2 rw
+43 22 0:53 / /scratch/mnt-other rw - nfs4 srv:/exports/3 rw
+"""
+
+
+class TestMounts(unittest.TestCase):
+    """manila_data.mounts tests."""
+
+    def setUp(self):
+        """Test setup."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.mountinfo = pathlib.Path(tmp_dir) / "mountinfo"
+        self.mountinfo.write_text(MOUNTINFO)
+
+    def test_mounts_under(self):
+        """Tests the mounts below a directory are found, deepest first."""
+        self.assertEqual(
+            mounts.mounts_under(pathlib.Path("/scratch/mnt/"), self.mountinfo),
+            [
+                "/scratch/mnt/share-1/nested",
+                "/scratch/mnt/share-1",
+                "/scratch/mnt/share 2",
+            ],
+        )
+
+    @mock.patch.object(mounts, "lazy_unmount")
+    def test_reap(self, mock_lazy_unmount):
+        """Tests failures to detach a mount are skipped."""
+        mock_lazy_unmount.side_effect = [None, OSError(16, "EBUSY"), None]
+
+        detached = mounts.reap(pathlib.Path("/scratch/mnt"), self.mountinfo)
+
+        self.assertEqual(
+            detached, ["/scratch/mnt/share-1/nested", "/scratch/mnt/share 2"]
+        )
+        self.assertEqual(mock_lazy_unmount.call_count, 3)
@@ -0,0 +1,117 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the resource limits."""
+
+import pathlib
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from manila_data import resources
+
+
+class TestResources(unittest.TestCase):
+    """manila_data.resources tests."""
+
+    def test_parse_cpuset(self):
+        """Tests parsing cpuset lists."""
+        self.assertEqual(resources.parse_cpuset("0-3,8"), {0, 1, 2, 3, 8})
+        self.assertEqual(resources.parse_cpuset("5"), {5})
+        for value in ("3-1", "a", "1,,2", "-1"):
+            with self.assertRaises(ValueError):
+                resources.parse_cpuset(value)
+
+    def test_worker_cpus(self):
+        """Tests CPUs are split between workers."""
+        cpus = {0, 1, 2, 3, 4, 5}
+        self.assertEqual(
+            [resources.worker_cpus(cpus, i, 3) for i in range(3)],
+            [{0, 1}, {2, 3}, {4, 5}],
+        )
+        self.assertEqual(
+            [resources.worker_cpus({2, 3}, i, 3) for i in range(3)],
+            [{2}, {3}, {2}],
+        )
+
+    def test_from_config(self):
+        """Tests loading the limits rendered into manila.conf."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        conf = pathlib.Path(tmp_dir, "manila.conf")
+        limits = resources.ResourceLimits.from_config(conf)
+        self.assertEqual(limits, resources.ResourceLimits())
+
+        conf.write_text(
+            "[snap_resources]\n"
+            "cpuset = 0-3\n"
+            "pin_workers = True\n"
+            "nice = 5\n"
+            "ioprio_class = idle\n"
+            "ioprio_level = 7\n"
+        )
+        limits = resources.ResourceLimits.from_config(conf)
+        self.assertEqual(
+            limits,
+            resources.ResourceLimits(
+                cpus=frozenset({0, 1, 2, 3}),
+                pin_workers=True,
+                nice=5,
+                ioprio_class="idle",
+                ioprio_level=7,
+            ),
+        )
+        self.assertEqual(limits.worker_cpus(1, 2), {2, 3})
+        limits = resources.ResourceLimits(cpus=limits.cpus)
+        self.assertIsNone(limits.worker_cpus(1, 2))
+
+    def test_privileged(self):
+        """Tests the limits raising the priority are reported."""
+        self.assertEqual(resources.ResourceLimits(nice=10).privileged(), [])
+        limits = resources.ResourceLimits(nice=-5, ioprio_class="realtime")
+        self.assertEqual(
+            limits.privileged(),
+            ["resources.nice", "resources.ioprio-class"],
+        )
+
+    @mock.patch.object(resources, "set_ioprio")
+    @mock.patch("os.setpriority")
+    @mock.patch("os.sched_setaffinity")
+    def test_apply(self, mock_affinity, mock_setpriority, mock_ioprio):
+        """Tests limits are applied, failures are not fatal."""
+        mock_affinity.side_effect = OSError("invalid")
+        limits = resources.ResourceLimits(
+            cpus=frozenset({1}),
+            nice=10,
+            ioprio_class="best-effort",
+            ioprio_level=6,
+        )
+
+        resources.apply(limits)
+
+        mock_affinity.assert_called_once_with(0, frozenset({1}))
+        mock_setpriority.assert_called_once_with(mock.ANY, 0, 10)
+        mock_ioprio.assert_called_once_with("best-effort", 6)
+
+    @mock.patch.object(resources, "set_ioprio")
+    @mock.patch("os.setpriority")
+    @mock.patch("os.sched_setaffinity")
+    def test_apply_defaults(self, mock_affinity, mock_priority, mock_ioprio):
+        """Tests nothing is changed by default."""
+        resources.apply(resources.ResourceLimits())
+
+        mock_affinity.assert_not_called()
+        mock_priority.assert_not_called()
+        mock_ioprio.assert_not_called()
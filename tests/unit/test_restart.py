@@ -0,0 +1,85 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the deferred restarts."""
+
+import pathlib
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from manila_data import restart
+
+
+class TestRestart(unittest.TestCase):
+    """Tests the deferred restarts."""
+
+    def setUp(self):
+        """Test setup."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.path = pathlib.Path(tmp_dir) / "restart-pending.json"
+
+    @mock.patch("time.time")
+    def test_defer_complete(self, mock_time):
+        """Tests the pending restart keeps its deadline until completed."""
+        self.assertIsNone(restart.read(self.path))
+
+        mock_time.return_value = 1000.0
+        pending = restart.defer(self.path, "manila-data", 600)
+        self.assertEqual(
+            pending,
+            {
+                "services": ["manila-data"],
+                "requested": 1000.0,
+                "deadline": 1600.0,
+            },
+        )
+        self.assertEqual(self.path.stat().st_mode & 0o777, 0o600)
+
+        # later requests do not push the deadline back
+        mock_time.return_value = 1500.0
+        restart.defer(self.path, "manila-data", 600)
+        pending = restart.defer(self.path, "other", 600)
+        self.assertEqual(pending["services"], ["manila-data", "other"])
+        self.assertEqual(pending["deadline"], 1600.0)
+        self.assertEqual(restart.read(self.path), pending)
+
+        pending = restart.complete(self.path, ["manila-data"])
+        self.assertEqual(pending["services"], ["other"])
+        self.assertIsNone(restart.complete(self.path, ["other"]))
+        self.assertFalse(self.path.exists())
+        self.assertIsNone(restart.complete(self.path, ["other"]))
+
+    def test_publish(self):
+        """Tests the pending restart is mirrored into the snap options."""
+        snap = mock.Mock()
+        pending = {
+            "services": ["manila-data"],
+            "requested": 0.0,
+            "deadline": 3600.0,
+        }
+        restart.publish(snap, pending)
+        snap.config.set.assert_called_once_with(
+            {
+                "pending-restart": {
+                    "services": "manila-data",
+                    "requested": "1970-01-01T00:00:00+00:00",
+                    "deadline": "1970-01-01T01:00:00+00:00",
+                }
+            }
+        )
+        restart.publish(snap, None)
+        snap.config.unset.assert_called_once_with(["pending-restart"])
@@ -14,7 +14,11 @@
 
 """Tests for ManilaDataService."""
 
+import importlib.util
 import pathlib
+import shutil
+import subprocess
+import tempfile
 import unittest
 from unittest import mock
 
@@ -24,25 +28,376 @@ from manila_data import services
 class TestManilaDataService(unittest.TestCase):
     """manila_data.services tests."""
 
-    @mock.patch("sys.exit")
     @mock.patch("manila_data.log.setup_logging", mock.Mock())
-    @mock.patch("subprocess.run")
+    @mock.patch("os.execve")
     @mock.patch.object(services, "Snap")
-    def test_service_run(self, mock_snap, mock_run, mock_exit):
-        """Tests OpenStackService run."""
+    def test_service_run(self, mock_snap, mock_execve):
+        """Tests OpenStackService run replaces itself with a single worker."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
         snap = mock_snap.return_value
-        snap.paths.common = pathlib.Path("/foo")
+        snap.paths.common = pathlib.Path(tmp_dir)
         snap.paths.snap = pathlib.Path("/lish")
+        # execve does not return
+        mock_execve.side_effect = SystemExit
 
-        services.manila_data()
+        with self.assertRaises(SystemExit):
+            services.manila_data()
 
-        mock_run.assert_called_once_with(
+        worker_dir = f"{tmp_dir}/lib/manila/workers/0"
+        mock_execve.assert_called_once_with(
+            "/lish/bin/manila-data",
             [
-                "/lish/usr/bin/manila-data",
+                "/lish/bin/manila-data",
+                "--config-file",
+                f"{tmp_dir}/etc/manila/manila.conf",
+                "--config-file",
+                f"{tmp_dir}/etc/manila/data-mounts.conf",
                 "--config-file",
-                "/foo/etc/manila/manila.conf",
+                f"{tmp_dir}/etc/manila/rootwrap.conf",
                 "--config-file",
-                "/foo/etc/manila/rootwrap.conf",
-            ]
+                f"{worker_dir}/worker.conf",
+            ],
+            mock.ANY,
+        )
+        env = mock_execve.call_args.args[2]
+        self.assertEqual(env["TMPDIR"], f"{worker_dir}/tmp")
+        self.assertIn(
+            f"lock_path = {worker_dir}/lock",
+            pathlib.Path(worker_dir, "worker.conf").read_text(),
+        )
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    @mock.patch("os.execve")
+    @mock.patch.object(services.supervisor, "Supervisor")
+    def test_service_run_supervise(self, mock_supervisor, mock_execve):
+        """Tests a single worker is supervised when asked to."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        snap = mock.Mock()
+        snap.paths.common = pathlib.Path(tmp_dir)
+        snap.paths.snap = pathlib.Path("/lish")
+        conf = snap.paths.common / "etc/manila/manila.conf"
+        conf.parent.mkdir(parents=True)
+        conf.write_text(
+            "[snap_service]\nlaunch = supervise\ndrain_timeout = 120\n",
+        )
+
+        returncode = services.ManilaDataService().run(snap)
+
+        mock_execve.assert_not_called()
+        [workers] = mock_supervisor.call_args.args
+        self.assertEqual(len(workers), 1)
+        supervisor = mock_supervisor.return_value
+        self.assertEqual(
+            mock_supervisor.call_args.kwargs,
+            {"stop_timeout": 120},
+        )
+        self.assertEqual(returncode, supervisor.run.return_value)
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    @mock.patch.object(services.supervisor, "Supervisor")
+    def test_service_run_workers(self, mock_supervisor):
+        """Tests one worker process is supervised per configured worker."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        snap = mock.Mock()
+        snap.paths.common = pathlib.Path(tmp_dir)
+        snap.paths.snap = pathlib.Path("/lish")
+        conf = snap.paths.common / "etc/manila/manila.conf"
+        conf.parent.mkdir(parents=True)
+        conf.write_text(
+            "[snap_service]\nworkers = 3\n"
+            "[snap_resources]\ncpuset = 0-5\npin_workers = True\n"
+        )
+
+        with mock.patch.object(services.resources, "apply") as mock_apply:
+            services.ManilaDataService().run(snap)
+
+        mock_apply.assert_called_once()
+
+        [workers] = mock_supervisor.call_args.args
+        self.assertEqual([w.index for w in workers], [0, 1, 2])
+        self.assertEqual(
+            len({w.env["TMPDIR"] for w in workers}),
+            3,
+        )
+        self.assertEqual(
+            [w.setup.args for w in workers],
+            [(0, {0, 1}), (0, {2, 3}), (0, {4, 5})],
+        )
+
+    @mock.patch.object(services, "SnapCtl")
+    def test_check_limits(self, mock_snapctl):
+        """Tests the health names the interface the limits need."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        snap = mock.Mock()
+        snap.paths.common = pathlib.Path(tmp_dir)
+        conf = snap.paths.common / "etc/manila/manila.conf"
+        conf.parent.mkdir(parents=True)
+        conf.write_text("[snap_resources]\nnice = -5\n")
+        is_connected = mock_snapctl.return_value.is_connected
+        is_connected.return_value = False
+
+        services.ManilaDataService().check_limits(snap)
+        is_connected.assert_called_once_with("process-control")
+        snap.health.blocked.assert_called_once_with(
+            "connect process-control for resources.nice",
+            code="process-control",
+        )
+
+        is_connected.return_value = True
+        services.ManilaDataService().check_limits(snap)
+        snap.health.okay.assert_called_once_with()
+
+        # not reported when no limit needs the interface
+        conf.write_text("[snap_resources]\nnice = 5\n")
+        is_connected.reset_mock()
+        services.ManilaDataService().check_limits(snap)
+        is_connected.assert_not_called()
+        self.assertEqual(snap.health.okay.call_count, 2)
+
+    @mock.patch.object(services.mounts, "reap")
+    def test_prepare_scratch_path(self, mock_reap):
+        """Tests the scratch directories are created, stale mounts reaped."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        snap = mock.Mock()
+        snap.paths.common = pathlib.Path(tmp_dir)
+        scratch_path = snap.paths.common / "scratch"
+        conf = snap.paths.common / "etc/manila/manila.conf"
+        conf.parent.mkdir(parents=True)
+        conf.write_text(f"[snap_service]\nscratch_path = {scratch_path}\n")
+
+        service = services.ManilaDataService()
+        service.prepare(snap)
+
+        mock_reap.assert_called_once_with(scratch_path / "mnt")
+        self.assertTrue((scratch_path / "tmp").is_dir())
+        self.assertEqual(
+            service.worker_dir(snap, 1),
+            scratch_path / "workers/1",
+        )
+
+    def test_environment_copy_engine(self):
+        """Tests the command shims are put in PATH when enabled."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        snap = mock.Mock()
+        snap.paths.common = pathlib.Path(tmp_dir)
+        snap.paths.snap = pathlib.Path("/lish")
+
+        service = services.ManilaDataService()
+        path = "/lish/usr/libexec/manila-data:/usr/bin"
+        with mock.patch.dict("os.environ", {"PATH": "/usr/bin"}):
+            self.assertEqual(service.environment(snap)["PATH"], "/usr/bin")
+
+            conf = snap.paths.common / "etc/manila/manila.conf"
+            conf.parent.mkdir(parents=True)
+            conf.write_text("[snap_copy]\nengine = parallel\n")
+            env = service.environment(snap)
+            self.assertEqual(env["PATH"], path)
+            self.assertEqual(env["MANILA_DATA_COPY_ENGINE"], "parallel")
+            self.assertEqual(env["CEPH_CONF"], f"{tmp_dir}/etc/ceph/ceph.conf")
+            self.assertEqual(env["MANILA_DATA_VERIFY"], "off")
+
+            conf.write_text("[snap_verify]\nmode = full\n")
+            env = service.environment(snap)
+            self.assertEqual(env["PATH"], path)
+            self.assertEqual(env["MANILA_DATA_COPY_ENGINE"], "cp")
+            self.assertEqual(env["MANILA_DATA_VERIFY"], "full")
+            self.assertEqual(env["MANILA_DATA_ROOTWRAP"], "rootwrap")
+
+    def test_sudo_shim(self):
+        """Tests the sudo shim only skips rootwrap in direct mode."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        rootwrap = pathlib.Path(tmp_dir, "manila-rootwrap")
+        rootwrap.write_text('#!/bin/sh\necho rootwrap "$@"\n')
+        rootwrap.chmod(0o755)
+        sudo = pathlib.Path(__file__).parents[2] / "bin/sudo"
+
+        for mode, expected in [
+            ("rootwrap", "rootwrap /rootwrap.conf echo a b\n"),
+            ("direct", "a b\n"),
+        ]:
+            result = subprocess.run(
+                [sudo, rootwrap, "/rootwrap.conf", "echo", "a b"],
+                env={"PATH": "/usr/bin:/bin", "MANILA_DATA_ROOTWRAP": mode},
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            self.assertEqual(result.stdout, expected)
+
+    def test_action(self):
+        """Tests the action needed to apply configuration changes."""
+        snap = mock.Mock()
+        snap.paths.common = pathlib.Path("/foo")
+        manila_conf = pathlib.Path("/foo/etc/manila/manila.conf")
+        filters = pathlib.Path("/foo/etc/manila/rootwrap.d/data-copy.filters")
+        service = services.ManilaDataService
+
+        self.assertIsNone(service.action(snap, {}))
+        self.assertIsNone(service.action(snap, {filters: None}))
+        self.assertIsNone(
+            service.action(snap, {manila_conf: {"snap_copy.workers"}}),
+        )
+        metrics = {"snap_metrics.enabled", "snap_metrics.port"}
+        self.assertIsNone(service.action(snap, {manila_conf: metrics}))
+        self.assertEqual(
+            service.action(snap, {manila_conf: {"DEFAULT.debug"}}),
+            "reload",
+        )
+        changed = {"DEFAULT.debug", "database.max_pool_size"}
+        self.assertEqual(
+            service.action(snap, {manila_conf: changed}),
+            "restart",
+        )
+        self.assertEqual(service.action(snap, {manila_conf: None}), "restart")
+
+    @unittest.skipUnless(
+        importlib.util.find_spec("oslo_log"),
+        "oslo.log ships with manila in the snap",
+    )
+    def test_reloadable_options_mutable(self):
+        """Tests the options applied on reload are mutable in place."""
+        from oslo_log import _options
+
+        [(_, opts)] = _options.list_opts()
+        mutable = {f"DEFAULT.{opt.dest}" for opt in opts if opt.mutable}
+        for option in services.ManilaDataService.reloadable_options:
+            with self.subTest(option=option):
+                self.assertIn(option, mutable)
+
+    @unittest.skipUnless(
+        importlib.util.find_spec("manila"),
+        "manila ships in the snap",
+    )
+    def test_reload_mutates(self):
+        """Tests manila-data is launched to mutate its options on SIGHUP."""
+        from manila import service
+
+        with (
+            mock.patch.object(service, "_launcher", None),
+            mock.patch.object(service.service, "launch") as launch,
+        ):
+            service.serve(mock.sentinel.server)
+        launch.assert_called_once_with(
+            service.CONF,
+            mock.sentinel.server,
+            workers=1,
+            restart_method="mutate",
+        )
+
+    def test_exporter_action(self):
+        """Tests the exporter is only restarted for its own options."""
+        snap = mock.Mock()
+        snap.paths.common = pathlib.Path("/foo")
+        manila_conf = pathlib.Path("/foo/etc/manila/manila.conf")
+        service = services.MetricsExporterService
+
+        self.assertIsNone(service.action(snap, {}))
+        self.assertIsNone(
+            service.action(snap, {manila_conf: {"snap_copy.workers"}}),
+        )
+        self.assertEqual(
+            service.action(snap, {manila_conf: {"snap_metrics.port"}}),
+            "restart",
+        )
+        self.assertEqual(service.action(snap, {manila_conf: None}), "restart")
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    @mock.patch.object(services.exporter, "make_server")
+    def test_exporter_run(self, mock_make_server):
+        """Tests the exporter serves the metrics only when enabled."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        snap = mock.Mock()
+        snap.paths.common = pathlib.Path(tmp_dir)
+        snap.paths.snap = pathlib.Path("/lish")
+        progress_dir = snap.paths.common / "lib/manila/copies"
+        service = services.MetricsExporterService()
+
+        self.assertEqual(service.run(snap), 0)
+        mock_make_server.assert_not_called()
+        self.assertFalse(progress_dir.exists())
+
+        conf = snap.paths.common / "etc/manila/manila.conf"
+        conf.parent.mkdir(parents=True)
+        conf.write_text("[snap_metrics]\nenabled = True\nport = 9100\n")
+        self.assertEqual(service.run(snap), 0)
+
+        options, collector = mock_make_server.call_args.args
+        self.assertEqual((options.address, options.port), ("127.0.0.1", 9100))
+        self.assertEqual(
+            collector.executable,
+            pathlib.Path("/lish/bin/manila-data"),
+        )
+        self.assertTrue(progress_dir.is_dir())
+        mock_make_server.return_value.serve_forever.assert_called_once()
+
+    @mock.patch("manila_data.log.setup_logging", mock.Mock())
+    @mock.patch("time.sleep")
+    @mock.patch.object(services.ManilaDataService, "busy")
+    def test_restart_coordinator(self, mock_busy, mock_sleep):
+        """Tests deferred restarts wait for the copies or the deadline."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        snap = mock.Mock()
+        snap.instance_name = "manila-data"
+        snap.paths.common = pathlib.Path(tmp_dir)
+        manila_service = mock.Mock()
+        snap.services.list.return_value = {
+            "manila-data.manila-data": manila_service,
+        }
+        pending_file = snap.paths.common / "restart-pending.json"
+        service = services.RestartCoordinatorService()
+
+        # nothing pending
+        self.assertEqual(service.run(snap), 0)
+        manila_service.restart.assert_not_called()
+
+        # the copies drain after a while
+        mock_busy.side_effect = [True, True, False]
+        services.restart.defer(pending_file, "manila-data", 3600)
+        self.assertEqual(service.run(snap), 0)
+        self.assertEqual(mock_sleep.call_count, 2)
+        manila_service.restart.assert_called_once_with()
+        self.assertFalse(pending_file.exists())
+        snap.config.unset.assert_called_once_with(["pending-restart"])
+
+        # the copies outlast the deadline
+        manila_service.reset_mock()
+        mock_busy.side_effect = None
+        mock_busy.return_value = True
+        services.restart.defer(pending_file, "manila-data", -1)
+        self.assertEqual(service.run(snap), 0)
+        manila_service.restart.assert_called_once_with()
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    @mock.patch.object(services.exporter, "find_processes")
+    @mock.patch.object(services.mounts, "mounts_under")
+    def test_busy(self, mock_mounts_under, mock_find_processes):
+        """Tests copies are detected from their mounts and processes."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        snap = mock.Mock()
+        snap.paths.common = pathlib.Path(tmp_dir)
+        snap.paths.snap = pathlib.Path("/lish")
+        service = services.ManilaDataService()
+
+        mock_mounts_under.return_value = []
+        mock_find_processes.return_value = []
+        self.assertFalse(service.busy(snap))
+        mnt = snap.paths.common / "lib/manila/mnt"
+        mock_mounts_under.assert_called_once_with(mnt)
+        mock_find_processes.assert_called_once_with(
+            pathlib.Path("/lish/bin/manila-data-copy")
         )
-        mock_exit.assert_called_once_with(mock_run.return_value.returncode)
+        mock_find_processes.return_value = [100]
+        self.assertTrue(service.busy(snap))
+        mock_mounts_under.return_value = ["/mnt/share"]
+        mock_find_processes.return_value = []
+        self.assertTrue(service.busy(snap))
@@ -0,0 +1,99 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Start up time of the hook, service and copy engine entry points."""
+
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = pathlib.Path(__file__).parents[2]
+
+# Entry points run for every copy or checksum, which must only depend on
+# the standard library.
+STDLIB_ONLY = [
+    "manila_data.scripts.data_copy",
+    "manila_data.scripts.data_hash",
+]
+THIRD_PARTY = ("jinja2", "pydantic", "snaphelpers")
+
+
+class TestStartup(unittest.TestCase):
+    """Entry point start up tests."""
+
+    def _cache(self) -> str:
+        """Create an empty bytecode cache."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return tmp_dir
+
+    def _run(self, module: str, cache: str, *options: str) -> str:
+        """Import a module in a new interpreter, return its stderr."""
+        env = {**os.environ, "PYTHONPYCACHEPREFIX": cache}
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        result = subprocess.run(
+            [sys.executable, *options, "-c", f"import {module}"],
+            cwd=ROOT,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return result.stderr
+
+    def _import(self, module: str, cache: str) -> dict[str, float]:
+        """Import a module in a new interpreter, time every import."""
+        times = {}
+        for line in self._run(module, cache, "-X", "importtime").splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line.split("|")
+            times[name.strip()] = int(cumulative) / 10**6
+        return times
+
+    def _code_objects(self, module: str, cache: str) -> list[str]:
+        """Files the code of the snap modules was loaded from."""
+        paths = []
+        for line in self._run(module, cache, "-v").splitlines():
+            if line.startswith("# code object from "):
+                path = line.removeprefix("# code object from ").strip("'")
+                if "/manila_data/" in path:
+                    paths.append(path)
+        return paths
+
+    def test_bytecode(self):
+        """Tests the entry points load bytecode once it is available."""
+        for module in ["manila_data.manila_data", "manila_data.services"]:
+            with self.subTest(module=module):
+                cache = self._cache()
+                cold = self._code_objects(module, cache)
+                self.assertTrue(all(path.endswith(".py") for path in cold))
+                # the bytecode shipped in the snap, nothing is parsed
+                warm = self._code_objects(module, cache)
+                self.assertEqual(len(warm), len(cold))
+                self.assertTrue(all(path.endswith(".pyc") for path in warm))
+                self.assertTrue(all(path.startswith(cache) for path in warm))
+
+    def test_stdlib_only(self):
+        """Tests the per command entry points do not import heavy packages."""
+        for module in STDLIB_ONLY:
+            with self.subTest(module=module):
+                imported = self._import(module, self._cache())
+                self.assertFalse(
+                    [name for name in imported if name.startswith(THIRD_PARTY)]
+                )
@@ -0,0 +1,100 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the worker supervisor."""
+
+import os
+import pathlib
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import unittest
+
+from manila_data import supervisor
+
+
+class TestSupervisor(unittest.TestCase):
+    """manila_data.supervisor tests."""
+
+    def setUp(self):
+        """Test setup."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.tmpdir = pathlib.Path(tmp_dir)
+
+    def _signal_after(self, delay, signum=signal.SIGTERM):
+        timer = threading.Timer(delay, os.kill, (os.getpid(), signum))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def _worker(self, index, script):
+        return supervisor.Worker(index, [sys.executable, "-c", script])
+
+    def test_stop(self):
+        """Tests all the workers are stopped on SIGTERM."""
+        script = "import time; time.sleep(30)"
+        workers = [self._worker(i, script) for i in range(2)]
+        self._signal_after(0.5)
+
+        returncode = supervisor.Supervisor(workers).run()
+
+        self.assertEqual(returncode, 0)
+        self.assertTrue(all(w.process is None for w in workers))
+
+    def test_restart_with_backoff(self):
+        """Tests crashed workers are restarted with a growing delay."""
+        starts = self.tmpdir / "starts"
+        script = f"open({str(starts)!r}, 'a').write('x'); raise SystemExit(1)"
+        worker = self._worker(0, script)
+        self._signal_after(1)
+
+        supervisor.Supervisor([worker], backoff_initial=0.1).run()
+
+        # started at 0, 0.1, 0.3 and 0.7s, the next start is after the stop
+        starts_count = len(starts.read_text())
+        self.assertIn(starts_count, (3, 4))
+        self.assertEqual(worker.crashes, starts_count)
+
+    def test_kill_after_timeout(self):
+        """Tests workers ignoring SIGTERM are killed."""
+        script = (
+            "import signal, time;"
+            "signal.signal(signal.SIGTERM, signal.SIG_IGN);"
+            "time.sleep(30)"
+        )
+        workers = [self._worker(0, script)]
+        self._signal_after(0.5)
+
+        returncode = supervisor.Supervisor(workers, stop_timeout=0.5).run()
+
+        self.assertEqual(returncode, 1)
+
+    def test_forward_sighup(self):
+        """Tests SIGHUP is forwarded to the workers."""
+        reloads = self.tmpdir / "reloads"
+        script = (
+            "import signal, time;"
+            "signal.signal(signal.SIGHUP,"
+            f" lambda *a: open({str(reloads)!r}, 'a').write('x'));"
+            "time.sleep(30)"
+        )
+        workers = [self._worker(0, script)]
+        self._signal_after(0.5, signal.SIGHUP)
+        self._signal_after(1)
+
+        supervisor.Supervisor(workers).run()
+
+        self.assertEqual(reloads.read_text(), "x")
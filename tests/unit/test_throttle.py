@@ -0,0 +1,141 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the bandwidth limits of the copy engine."""
+
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from manila_data import journal, throttle
+
+
+class TestThrottle(unittest.TestCase):
+    """manila_data.throttle tests."""
+
+    def setUp(self):
+        """Test setup."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.tmpdir = pathlib.Path(tmp_dir)
+        self.conf = self.tmpdir / "manila.conf"
+        throttle_dir = self.tmpdir / "throttle"
+        self.options = throttle.ThrottleOptions(self.conf, throttle_dir)
+
+    def _render(self, **limits):
+        lines = [f"{key} = {value}" for key, value in limits.items()]
+        # the hooks replace the file when rendering it
+        tmp = self.tmpdir / "manila.conf.tmp"
+        lines = ["[snap_copy]", "workers = 2", *lines]
+        tmp.write_text("\n".join(lines) + "\n")
+        os.replace(tmp, self.conf)
+
+    @mock.patch("time.monotonic", return_value=100.0)
+    def test_token_bucket(self, mock_monotonic):
+        """Tests the bucket lets a burst through, then delays consumers."""
+        bucket = throttle.TokenBucket(self.tmpdir / "bucket")
+        self.addCleanup(bucket.close)
+
+        self.assertEqual(bucket.consume(50, rate=100), 0.0)
+        self.assertEqual(bucket.consume(100, rate=100), 1.0)
+        # another process sharing the bucket
+        other = throttle.TokenBucket(self.tmpdir / "bucket")
+        self.addCleanup(other.close)
+        self.assertEqual(other.consume(100, rate=100), 2.0)
+
+        # idle time is not saved up beyond the burst
+        mock_monotonic.return_value = 200.0
+        self.assertEqual(bucket.consume(100, rate=100), 0.5)
+
+    @mock.patch("time.monotonic", return_value=100.0)
+    def test_token_bucket_stored_deadline(self, mock_monotonic):
+        """Tests a large stored deadline does not hold the copies for long."""
+        boot_id = self.tmpdir / "boot_id"
+        boot_id.write_text("boot-1\n")
+        patcher = mock.patch.object(journal, "BOOT_ID", boot_id)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        path = self.tmpdir / "bucket"
+        path.write_bytes(throttle._STATE.pack(b"boot-1", 10**6))
+
+        bucket = throttle.TokenBucket(path)
+        self.addCleanup(bucket.close)
+        delay = bucket.consume(100, rate=100)
+        self.assertEqual(delay, throttle.MAX_BACKLOG + 1 - throttle.BURST)
+
+        # the monotonic clock of a previous boot is not comparable
+        path.write_bytes(throttle._STATE.pack(b"boot-0", 10**6))
+        bucket = throttle.TokenBucket(path)
+        self.addCleanup(bucket.close)
+        self.assertEqual(bucket.consume(50, rate=100), 0.0)
+
+    @mock.patch("time.sleep")
+    def test_throttle(self, mock_sleep):
+        """Tests the limits are followed, and applied live."""
+        options = throttle.new_job(self.options)
+        limiter = throttle.Throttle(options)
+        self.addCleanup(limiter.close)
+
+        limiter.consume(10**9)
+        self.assertEqual(limiter.chunk_size(2**30), 2**30)
+        mock_sleep.assert_not_called()
+
+        self._render(job_bandwidth_limit=1000)
+        limiter._checked -= throttle.RELOAD_INTERVAL
+        self.assertEqual(limiter.limits(), throttle.Limits(host=0, job=1000))
+        self.assertEqual(limiter.chunk_size(2**30), throttle.CHUNK_SIZE)
+        limiter.consume(2000)
+        self.assertAlmostEqual(mock_sleep.call_args.args[0], 1.5, delta=0.1)
+
+        # changes are only looked for once per interval
+        self._render(bandwidth_limit=10**6)
+        self.assertEqual(limiter.limits().host, 0)
+        limiter._checked -= throttle.RELOAD_INTERVAL
+        self.assertEqual(limiter.limits(), throttle.Limits(host=10**6, job=0))
+
+    def test_jobs(self):
+        """Tests the buckets of finished or dead copies are removed."""
+        self.options.directory.mkdir()
+        (self.options.directory / throttle.HOST_BUCKET).touch()
+        # the pid of a process that is gone
+        (self.options.directory / f"{2**22 + 1}-1").touch()
+
+        options = throttle.new_job(self.options)
+        self.assertEqual(
+            sorted(os.listdir(self.options.directory)),
+            sorted([throttle.HOST_BUCKET, options.job]),
+        )
+        throttle.end_job(options)
+        self.assertEqual(
+            os.listdir(self.options.directory),
+            [throttle.HOST_BUCKET],
+        )
+
+    def test_shared_jobs(self):
+        """Tests copies with the same key share a bucket that is kept."""
+        options = throttle.new_job(self.options, "src\0dest")
+        throttle.end_job(options)
+        self.assertEqual(throttle.new_job(self.options, "src\0dest"), options)
+        other = throttle.new_job(self.options, "other\0dest")
+        self.assertNotEqual(other.job, options.job)
+        self.assertEqual(len(os.listdir(self.options.directory)), 2)
+
+        # unused for a while
+        bucket = self.options.directory / options.job
+        os.utime(bucket, (0, 0))
+        throttle.new_job(self.options, "other\0dest")
+        self.assertFalse(bucket.exists())